@@ -1,14 +1,34 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, ValidationError
 from typing import Optional, List
-from sqlalchemy import create_engine, Column, Integer, String, Text, Date, Time, TIMESTAMP, func
-from sqlalchemy.orm import declarative_base, sessionmaker, Session
-import requests
+from sqlalchemy import Column, Integer, String, Text, Date, Time, TIMESTAMP, Index, func, insert, select, text, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import logging
 import os
-from datetime import datetime, date, time
+from datetime import datetime, date, time, timedelta
+from time import monotonic
+from common.cache import read_version, version_table
+from common.db import Database, env_flag
+from common.etag import ETagMiddleware, check_etag
+from common.expand import BatchLookup, expander
+from common.export import export_response
+from common.fastjson import columns_for
+from common.http import close_clients, get_client
+from common.instrumentation import instrument
+from common.migrations import run_migrations
+from common.pagination import NEXT_CURSOR_HEADER, PageParams, paginate_rows
+from common.profiling import install_profiler
+from common.static import mount_frontend
+from common.tokens import TokenVerifier
+from common.tracing import TRACE_ID_HEADER, install_tracing
+from common.users import UserDirectory
+
+logger = logging.getLogger(__name__)
 
 # ------------------------------
 # FastAPI setup
@@ -21,37 +41,39 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, TRACE_ID_HEADER],
 )
+app.add_middleware(ETagMiddleware)
+# Outermost, so ETags are computed on the uncompressed body.
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
 
-frontend_dir = "frontend"
-if os.path.isdir(frontend_dir):
-    app.mount("/static", StaticFiles(directory=frontend_dir), name="static")
-
-    @app.get("/")
-    def serve_index():
-        return FileResponse(os.path.join(frontend_dir, "index.html"))
-else:
-    @app.get("/")
-    def serve_index():
-        return {"service": "appointment", "frontend": False}
+# frontend/build (scripts/build_static.py) when present, else the raw sources
+mount_frontend(app, "appointment")
 
 # ------------------------------
 # Environment / DB setup
 # ------------------------------
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8000")
-
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT", "5432")
-DB_NAME = os.getenv("DB_NAME")
-
-DB_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-
-engine = create_engine(DB_URL)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+token_verifier = TokenVerifier.from_env(AUTH_SERVICE_URL)
+auth_client = get_client(AUTH_SERVICE_URL, name="Auth service")
+# In-memory replica of the auth user directory, kept current from its change feed
+user_directory = UserDirectory(auth_client, sync_interval=float(os.getenv("USER_DIRECTORY_SYNC_INTERVAL", "5")),
+                               service_token=os.getenv("SERVICE_TOKEN", ""))
+DOCTOR_SERVICE_URL = os.getenv("DOCTOR_SERVICE_URL", "http://doctor-service:8002")
+doctor_client = get_client(DOCTOR_SERVICE_URL, name="Doctor service")
+SCHEDULE_CACHE_TTL = float(os.getenv("SCHEDULE_CACHE_TTL", "300"))
+PATIENT_SERVICE_URL = os.getenv("PATIENT_SERVICE_URL", "http://patient-service:8001")
+patient_client = get_client(PATIENT_SERVICE_URL, name="Patient service")
+EXPAND_CACHE_TTL = float(os.getenv("EXPAND_CACHE_TTL", "60"))
+
+# DB_USER/DB_PASSWORD/DB_HOST/DB_PORT/DB_NAME; DB_ASYNC=0 selects the sync driver
+database = Database.from_env()
+engine = database.engine
 Base = declarative_base()
 
+# Request, query, outbound-call and threadpool metrics at /metrics
+instrument(app, database)
+
 # ------------------------------
 # Database models
 # ------------------------------
@@ -67,8 +89,37 @@ class AppointmentModel(Base):
     reason = Column(Text, nullable=True)
     notes = Column(Text, nullable=True)
     created_at = Column(TIMESTAMP, server_default=func.now())
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # A slot can hold at most one live booking. Enforced by the database so
+    # concurrent bookings can't both pass an application-level check.
+    __table_args__ = (
+        Index(
+            "uq_appointments_doctor_slot",
+            "doctor_id", "appointment_date", "appointment_time",
+            unique=True,
+            postgresql_where=text("status != 'cancelled'"),
+            sqlite_where=text("status != 'cancelled'"),
+        ),
+        # Doctor/patient lists, newest first (migration 0002).
+        Index("ix_appointments_doctor_date", "doctor_id", "appointment_date", "appointment_time", "id"),
+        Index("ix_appointments_patient_date", "patient_id", "appointment_date", "appointment_time", "id"),
+    )
+
+# Owned and migrated by doctor-service (shared database); read here for the "schedules" scope.
+cache_versions = version_table(Base.metadata)
+
+# Schema changes live in migrations/; DB_MIGRATE_ON_STARTUP=0 leaves them to a
+# separate job (python -m common.migrations <service>-service).
+@app.on_event("startup")
+async def migrate():
+    if env_flag("DB_MIGRATE_ON_STARTUP", "1"):
+        await run_migrations(database, "appointment", os.path.join(os.path.dirname(__file__), "migrations"))
 
-Base.metadata.create_all(bind=engine)
+# Outbound connection pools (common/http.py), sync and async.
+@app.on_event("shutdown")
+async def close_service_clients():
+    await close_clients()
 
 # ------------------------------
 # Pydantic models
@@ -79,6 +130,14 @@ class Appointment(BaseModel):
     appointment_time: time  # format: HH:MM
     reason: Optional[str] = None
 
+class AppointmentBatchItem(Appointment):
+    # Admins and doctors importing bookings say whose they are; patients book for themselves.
+    patient_id: Optional[int] = None
+
+class BatchRequest(BaseModel):
+    # Validated per item so one bad row is reported instead of rejecting the batch.
+    items: List[dict]
+
 class AppointmentResponse(BaseModel):
     id: int
     patient_id: int
@@ -92,40 +151,192 @@ class AppointmentResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class AppointmentExpanded(AppointmentResponse):
+    """List item shape; ``doctor``/``patient`` are only present when asked for with ``expand=``."""
+    doctor: Optional[dict] = None
+    patient: Optional[dict] = None
+
+# ------------------------------
+# Doctor schedules and slot bitmaps
+# ------------------------------
+# Templates are owned by doctor-service. Each one is compiled once into the
+# doctor's slot grid plus lookup sets, so availability and booking checks
+# are dict/set lookups. A doctor-day is an int whose bit i is set when
+# slot_times[i] is free, so availability math is a couple of bitwise ops.
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+MAX_AVAILABILITY_DOCTORS = 50
+MAX_AVAILABILITY_DAYS = 31
+MAX_EXCEPTION_DAYS = 366
+SCHEDULE_FETCH_SIZE = 200
+
+def parse_minutes(value: str) -> int:
+    hours, minutes = value.split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+class CompiledSchedule:
+    def __init__(self, template: dict):
+        start, end = parse_minutes(template["work_start"]), parse_minutes(template["work_end"])
+        step = template["slot_minutes"]
+        breaks = [(parse_minutes(b["start"]), parse_minutes(b["end"])) for b in template.get("breaks", [])]
+        slots = []
+        for minute in range(start, end - step + 1, step):
+            if not any(minute < b_end and minute + step > b_start for b_start, b_end in breaks):
+                slots.append(time(minute // 60, minute % 60))
+        self.slot_times = tuple(slots)
+        self.slot_index = {t: i for i, t in enumerate(self.slot_times)}
+        self.full_day = (1 << len(self.slot_times)) - 1
+        self.weekdays = frozenset(WEEKDAYS.index(d) for d in template["weekdays"] if d in WEEKDAYS)
+        days_off = set()
+        for exception in template.get("exceptions", []):
+            first = date.fromisoformat(exception["start_date"])
+            last = date.fromisoformat(exception["end_date"])
+            for offset in range(min((last - first).days + 1, MAX_EXCEPTION_DAYS)):
+                days_off.add(first + timedelta(days=offset))
+        self.days_off = frozenset(days_off)
+
+    def day_mask(self, day: date) -> int:
+        """All slots the doctor offers on ``day``, booked or not."""
+        if day.weekday() not in self.weekdays or day in self.days_off:
+            return 0
+        return self.full_day
+
+    def is_bookable(self, day: date, slot_time: time) -> bool:
+        index = self.slot_index.get(slot_time)
+        return index is not None and bool(self.day_mask(day) >> index & 1)
+
+    def booked_mask(self, times) -> int:
+        mask = 0
+        for t in times:
+            index = self.slot_index.get(t)
+            if index is not None:
+                mask |= 1 << index
+        return mask
+
+    def free_times(self, mask: int):
+        return [self.slot_times[i] for i in range(len(self.slot_times)) if mask >> i & 1]
+
+class ScheduleCache:
+    """Compiled schedules by doctor id, fetched from doctor-service in batches.
+
+    Entries live for ``ttl`` seconds. doctor-service bumps the ``schedules``
+    version in ``cache_versions`` (shared database) with every schedule
+    write; each replica checks it at most every ``sync_interval`` seconds,
+    before answering, and drops every entry when it moves. If doctor-service
+    is unreachable, stale entries are served rather than failing the request.
+    """
+
+    def __init__(self, client, ttl: float, version_loader=None, sync_interval: float = 1.0):
+        self.client = client
+        self.ttl = ttl
+        self.version_loader = version_loader
+        self.sync_interval = sync_interval
+        self._entries = {}
+        self._generation = 0  # bumped on invalidation; fetches started earlier aren't stored
+        self._version = None
+        self._synced_at = None
+        self._syncing = None
+
+    async def _sync(self):
+        try:
+            version = await self.version_loader()
+            if self._version is not None and version != self._version:
+                self.invalidate()
+            self._version = version
+        except Exception as e:
+            logger.warning("Schedule version check failed: %s", e)
+        finally:
+            self._synced_at = monotonic()
+            self._syncing = None
+
+    async def _check_version(self):
+        if self.version_loader is None:
+            return
+        if self._syncing is None and (self._synced_at is None or monotonic() - self._synced_at >= self.sync_interval):
+            self._syncing = asyncio.ensure_future(self._sync())
+        if self._syncing is not None:
+            await asyncio.shield(self._syncing)
+
+    async def get_many(self, doctor_ids):
+        await self._check_version()
+        now = monotonic()
+        generation = self._generation
+        missing = [i for i in doctor_ids if i not in self._entries or now - self._entries[i][0] > self.ttl]
+        fetched = {}
+        # doctor-service caps /schedules at SCHEDULE_FETCH_SIZE ids per call.
+        for chunk_start in range(0, len(missing), SCHEDULE_FETCH_SIZE):
+            chunk = missing[chunk_start:chunk_start + SCHEDULE_FETCH_SIZE]
+            try:
+                response = await self.client.aget("/schedules", params={"doctor_ids": ",".join(map(str, chunk))})
+                if response.status_code != 200:
+                    raise HTTPException(status_code=503, detail="Doctor service unavailable")
+            except HTTPException:
+                if any(i not in self._entries for i in chunk):
+                    raise
+            else:
+                found = {t["doctor_id"]: CompiledSchedule(t) for t in response.json()["schedules"]}
+                for doctor_id in chunk:
+                    fetched[doctor_id] = found.get(doctor_id)
+        if generation == self._generation:
+            self._entries.update((i, (now, s)) for i, s in fetched.items())
+        return {i: fetched[i] if i in fetched else self._entries[i][1] for i in doctor_ids}
+
+    async def get(self, doctor_id: int):
+        return (await self.get_many([doctor_id]))[doctor_id]
+
+    def invalidate(self):
+        self._generation += 1
+        self._entries.clear()
+
+async def load_schedule_version():
+    async with database.session() as db:
+        return await read_version(db, cache_versions, "schedules")
+
+schedules = ScheduleCache(doctor_client, SCHEDULE_CACHE_TTL, version_loader=load_schedule_version,
+                          sync_interval=float(os.getenv("SCHEDULE_CACHE_SYNC_INTERVAL", "1")))
+
+# ?expand= sources: doctor_id is the doctor-service id, patient_id the patient's auth user id.
+expand_lookups = {
+    "doctor": BatchLookup(doctor_client, "/doctors", ttl=EXPAND_CACHE_TTL),
+    # patient-service narrows /patients to the caller's own profile for patients.
+    "patient": BatchLookup(patient_client, "/patients", param="user_ids", key="user_id", ttl=EXPAND_CACHE_TTL,
+                           per_caller=True),
+}
+
 # ------------------------------
 # Dependencies
 # ------------------------------
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with database.session() as db:
         yield db
-    finally:
-        db.close()
 
-def verify_token(authorization: str = Header(None)):
+async def verify_token(authorization: str = Header(None)):
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header missing")
-    
-    try:
-        response = requests.get(
-            f"{AUTH_SERVICE_URL}/verify",
-            headers={"Authorization": authorization}
-        )
-        if response.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return response.json()["user"]
-    except requests.RequestException:
-        raise HTTPException(status_code=503, detail="Auth service unavailable")
+    return await token_verifier.averify(authorization)
+
+# Per-request SQL profiling: SQL_PROFILE at startup, PUT /debug/sql-profile at runtime
+install_profiler(app, database, verify_token)
+# Outermost: traceparent in and out, spans for requests, DB statements and service calls
+install_tracing(app, database, "appointment-service")
 
 # ------------------------------
 # Routes
 # ------------------------------
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "healthy", "service": "appointment"}
 
+@app.get("/health/db")
+async def db_pool_stats():
+    """Connection pool occupancy and checkout wait times, for sizing DB_POOL_SIZE against max_connections."""
+    return database.pool_stats()
+
+@app.get("/health/users")
+async def user_directory_stats():
+    return user_directory.stats()
+
 @app.post("/appointments", response_model=AppointmentResponse)
-def create_appointment(appointment: Appointment, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def create_appointment(appointment: Appointment, user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     # Parse date and time
     try:
         if isinstance(appointment.appointment_date, str):
@@ -139,17 +350,14 @@ def create_appointment(appointment: Appointment, user: dict = Depends(verify_tok
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date/time format")
 
-    # Check if time slot is available
-    existing = db.query(AppointmentModel).filter(
-        AppointmentModel.doctor_id == appointment.doctor_id,
-        AppointmentModel.appointment_date == appointment_date,
-        AppointmentModel.appointment_time == appointment_time,
-        AppointmentModel.status != "cancelled"
-    ).first()
-    if existing:
-        raise HTTPException(status_code=400, detail="Time slot not available")
+    schedule = await schedules.get(appointment.doctor_id)
+    if schedule is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    if not schedule.is_bookable(appointment_date, appointment_time):
+        raise HTTPException(status_code=400, detail="Doctor is not available at that time")
 
-    # Create appointment
+    # Insert straight away: uq_appointments_doctor_slot rejects a taken slot
+    # atomically, so there is no check-then-insert window and no lock to wait on.
     new_appointment = AppointmentModel(
         patient_id=user["user_id"],
         doctor_id=appointment.doctor_id,
@@ -158,42 +366,226 @@ def create_appointment(appointment: Appointment, user: dict = Depends(verify_tok
         reason=appointment.reason
     )
     db.add(new_appointment)
-    db.commit()
-    db.refresh(new_appointment)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Time slot not available")
+    await db.refresh(new_appointment)
 
     return new_appointment
 
-@app.get("/appointments/my", response_model=List[AppointmentResponse])
-def get_my_appointments(user: dict = Depends(verify_token), db: Session = Depends(get_db)):
-    query = db.query(AppointmentModel)
-    if user["role"] == "doctor":
-        query = query.filter(AppointmentModel.doctor_id == user["user_id"])
+MAX_BATCH_ITEMS = 500
+
+@app.post("/appointments/batch")
+async def create_appointments_batch(batch: BatchRequest, user: dict = Depends(verify_token),
+                                    db: AsyncSession = Depends(get_db)):
+    """Book up to MAX_BATCH_ITEMS slots in one request, with a status per item.
+
+    Items are checked against the cached schedules, then every requested slot
+    is checked for an existing booking in a single query, and the free ones
+    go in as one multi-row INSERT.
+    """
+    if len(batch.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    results = [None] * len(batch.items)
+
+    def fail(index, status_code, detail):
+        results[index] = {"index": index, "status": status_code, "detail": detail}
+
+    items = []
+    for index, raw in enumerate(batch.items):
+        try:
+            item = AppointmentBatchItem.model_validate(raw)
+        except ValidationError as e:
+            fail(index, 422, e.errors(include_url=False, include_context=False))
+            continue
+        if user["role"] in ["admin", "doctor"]:
+            if item.patient_id is None:
+                fail(index, 422, "patient_id is required")
+                continue
+        elif item.patient_id not in (None, user["user_id"]):
+            fail(index, 403, "Not authorized to book for another patient")
+            continue
+        else:
+            item.patient_id = user["user_id"]
+        items.append((index, item))
+
+    found = await schedules.get_many(list({item.doctor_id for _, item in items}))
+    candidates = {}
+    for index, item in items:
+        slot = (item.doctor_id, item.appointment_date, item.appointment_time)
+        if found[item.doctor_id] is None:
+            fail(index, 404, "Doctor not found")
+        elif not found[item.doctor_id].is_bookable(item.appointment_date, item.appointment_time):
+            fail(index, 400, "Doctor is not available at that time")
+        elif slot in candidates:
+            fail(index, 409, "Time slot requested twice in this batch")
+        else:
+            candidates[slot] = (index, item)
+
+    # A concurrent booking can take a slot between the check and the insert;
+    # the unique index then rejects the statement and we re-check and retry.
+    for attempt in range(3):
+        if candidates:
+            taken = (await db.execute(
+                select(AppointmentModel.doctor_id, AppointmentModel.appointment_date, AppointmentModel.appointment_time)
+                .where(AppointmentModel.status != "cancelled")
+                .where(tuple_(AppointmentModel.doctor_id, AppointmentModel.appointment_date,
+                              AppointmentModel.appointment_time).in_(list(candidates)))
+            )).all()
+            for slot in taken:
+                index, _ = candidates.pop(tuple(slot))
+                fail(index, 409, "Time slot not available")
+        if not candidates:
+            break
+        pending = list(candidates.values())
+        try:
+            created = (await db.scalars(
+                insert(AppointmentModel).returning(AppointmentModel, sort_by_parameter_order=True),
+                [{"patient_id": item.patient_id, "doctor_id": item.doctor_id,
+                  "appointment_date": item.appointment_date, "appointment_time": item.appointment_time,
+                  "reason": item.reason, "status": "scheduled"} for _, item in pending],
+            )).all()
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            continue
+        for (index, _), appointment in zip(pending, created):
+            results[index] = {"index": index, "status": 201,
+                              "appointment": AppointmentResponse.model_validate(appointment).model_dump(mode="json")}
+        break
     else:
-        query = query.filter(AppointmentModel.patient_id == user["user_id"])
-    appointments = query.order_by(AppointmentModel.appointment_date.desc(), AppointmentModel.appointment_time.desc()).all()
-    return appointments
-
-
-@app.get("/appointments/user/{username}", response_model=List[AppointmentResponse])
-def get_appointments_for_username(username: str, db: Session = Depends(get_db)):
-    """Fetch appointments for a given username by resolving user_id via auth service."""
-    # resolve username -> user_id via auth service
+        for index, _ in candidates.values():
+            fail(index, 409, "Time slot not available")
+
+    return {"created": sum(r["status"] == 201 for r in results), "results": results}
+
+# List routes select just the response columns and skip ORM hydration (common/fastjson.py).
+APPOINTMENT_COLUMNS = columns_for(AppointmentModel, AppointmentResponse)
+# Newest first; id breaks ties so keyset pages never skip or repeat a row.
+APPOINTMENT_ORDER = [AppointmentModel.appointment_date, AppointmentModel.appointment_time, AppointmentModel.id]
+
+@app.get("/appointments/my", response_model=List[AppointmentExpanded])
+async def get_my_appointments(request: Request, response: Response, page: PageParams = Depends(),
+                              expand: Optional[str] = None, authorization: str = Header(None),
+                              user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    expand_hook = expander(expand, expand_lookups, authorization, user)
+    owner = AppointmentModel.doctor_id if user["role"] == "doctor" else AppointmentModel.patient_id
+    mine = owner == user["user_id"]
+    if expand_hook is None:
+        # Any insert, update or delete in the set changes the count or the newest updated_at.
+        # (Expanded objects can change on their own; those responses get the middleware's body hash.)
+        count, last_update = (await db.execute(select(func.count(), func.max(AppointmentModel.updated_at)).where(mine))).one()
+        check_etag(request, response, user["user_id"], user["role"], count, last_update)
+    return await paginate_rows(db, select(*APPOINTMENT_COLUMNS).where(mine), APPOINTMENT_ORDER, page, response,
+                               expand=expand_hook)
+
+
+@app.get("/appointments/user/{username}", response_model=List[AppointmentExpanded])
+async def get_appointments_for_username(username: str, response: Response, page: PageParams = Depends(),
+                                        expand: Optional[str] = None, authorization: str = Header(None),
+                                        user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    """Fetch appointments for a given username, resolved through the local user directory."""
+    # Checked before the lookup, so a 404 can't tell a patient which usernames exist.
+    if user["role"] not in ["doctor", "admin"] and user.get("username") != username:
+        raise HTTPException(status_code=403, detail="Not authorized to view these appointments")
+    target = await user_directory.by_username(username)
+    if target is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    target_id = target["user_id"]
+
+    query = select(*APPOINTMENT_COLUMNS).where(AppointmentModel.patient_id == int(target_id))
+    return await paginate_rows(db, query, APPOINTMENT_ORDER, page, response,
+                               expand=expander(expand, expand_lookups, authorization, user))
+
+@app.get("/appointments/availability")
+async def get_availability(doctor_ids: str, start: date, end: date, earliest: Optional[int] = None,
+                           db: AsyncSession = Depends(get_db)):
+    """Free slots for several doctors over a date range from one query.
+
+    ``doctor_ids`` is comma-separated. Returns, per doctor, the slot grid and a
+    bitmap per day (bit i set = ``slot_times[i]`` free), or with
+    ``earliest=N`` just the N earliest free slots across all the doctors.
+    Unknown doctors are left out.
+    """
     try:
-        r = requests.get(f"http://localhost:8000/users/by-username/{username}")
-        if r.status_code != 200:
-            raise HTTPException(status_code=404, detail="User not found")
-        user_info = r.json()
-        target_id = user_info.get('user_id')
-    except requests.RequestException:
-        raise HTTPException(status_code=503, detail="Auth service unavailable")
-
-    query = db.query(AppointmentModel).filter(AppointmentModel.patient_id == int(target_id))
-    appointments = query.order_by(AppointmentModel.appointment_date.desc(), AppointmentModel.appointment_time.desc()).all()
-    return appointments
+        ids = sorted({int(i) for i in doctor_ids.split(",") if i.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="doctor_ids must be comma-separated integers")
+    if not ids or len(ids) > MAX_AVAILABILITY_DOCTORS:
+        raise HTTPException(status_code=400, detail=f"Give between 1 and {MAX_AVAILABILITY_DOCTORS} doctor_ids")
+    days = (end - start).days + 1
+    if days < 1 or days > MAX_AVAILABILITY_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range must span 1 to {MAX_AVAILABILITY_DAYS} days")
+    if earliest is not None and earliest < 1:
+        raise HTTPException(status_code=400, detail="earliest must be positive")
+
+    doctor_schedules = {i: s for i, s in (await schedules.get_many(ids)).items() if s is not None}
+    ids = sorted(doctor_schedules)
+    rows = (await db.execute(select(
+        AppointmentModel.doctor_id, AppointmentModel.appointment_date, AppointmentModel.appointment_time
+    ).where(
+        AppointmentModel.doctor_id.in_(ids),
+        AppointmentModel.appointment_date.between(start, end),
+        AppointmentModel.status != "cancelled"
+    ))).all()
+    booked = {}
+    for doctor_id, day, slot in rows:
+        booked[(doctor_id, day)] = booked.get((doctor_id, day), 0) | doctor_schedules[doctor_id].booked_mask([slot])
+
+    dates = [start + timedelta(days=i) for i in range(days)]
+    free = {
+        (doctor_id, day): schedule.day_mask(day) & ~booked.get((doctor_id, day), 0)
+        for doctor_id, schedule in doctor_schedules.items() for day in dates
+    }
+    if earliest is not None:
+        found = []
+        for day in dates:
+            candidates = sorted(
+                (slot_time, doctor_id)
+                for doctor_id in ids
+                for slot_time in doctor_schedules[doctor_id].free_times(free[(doctor_id, day)])
+            )
+            for slot_time, doctor_id in candidates[:earliest - len(found)]:
+                found.append({"doctor_id": doctor_id, "date": day.isoformat(), "time": slot_time.strftime("%H:%M")})
+            if len(found) == earliest:
+                break
+        return {"earliest": found}
+
+    return {
+        "availability": {
+            str(doctor_id): {
+                "slot_times": [t.strftime("%H:%M") for t in schedule.slot_times],
+                "days": {day.isoformat(): free[(doctor_id, day)] for day in dates},
+            }
+            for doctor_id, schedule in doctor_schedules.items()
+        },
+    }
+
+@app.get("/appointments/export")
+async def export_appointments(format: str = "ndjson", start: Optional[date] = None, end: Optional[date] = None,
+                              doctor_id: Optional[int] = None, patient_id: Optional[int] = None,
+                              user: dict = Depends(verify_token)):
+    """Stream appointments (by appointment_date, inclusive) as NDJSON or CSV; doctors and patients only get their own."""
+    if user["role"] == "doctor":
+        doctor_id = user["user_id"]
+    elif user["role"] != "admin":
+        patient_id = user["user_id"]
+    query = select(*AppointmentModel.__table__.columns)
+    if start:
+        query = query.where(AppointmentModel.appointment_date >= start)
+    if end:
+        query = query.where(AppointmentModel.appointment_date <= end)
+    if doctor_id is not None:
+        query = query.where(AppointmentModel.doctor_id == doctor_id)
+    if patient_id is not None:
+        query = query.where(AppointmentModel.patient_id == patient_id)
+    return export_response(database, query.order_by(AppointmentModel.id), format, "appointments")
 
 @app.get("/appointments/{appointment_id}", response_model=AppointmentResponse)
-def get_appointment(appointment_id: int, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
-    appointment = db.query(AppointmentModel).filter(AppointmentModel.id == appointment_id).first()
+async def get_appointment(appointment_id: int, user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    appointment = await db.get(AppointmentModel, appointment_id)
     if not appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
     if appointment.patient_id != user["user_id"] and user["role"] not in ["admin", "doctor"]:
@@ -201,45 +593,45 @@ def get_appointment(appointment_id: int, user: dict = Depends(verify_token), db:
     return appointment
 
 @app.put("/appointments/{appointment_id}/cancel")
-def cancel_appointment(appointment_id: int, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
-    appointment = db.query(AppointmentModel).filter(AppointmentModel.id == appointment_id).first()
+async def cancel_appointment(appointment_id: int, user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    appointment = await db.get(AppointmentModel, appointment_id)
     if not appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
     if appointment.patient_id != user["user_id"] and user["role"] not in ["admin", "doctor"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     appointment.status = "cancelled"
-    db.commit()
+    await db.commit()
     return {"message": "Appointment cancelled successfully"}
 
 @app.put("/appointments/{appointment_id}/complete")
-def complete_appointment(appointment_id: int, notes: str = "", user: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def complete_appointment(appointment_id: int, notes: str = "", user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     if user["role"] not in ["doctor", "admin"]:
         raise HTTPException(status_code=403, detail="Only doctors can complete appointments")
-    appointment = db.query(AppointmentModel).filter(AppointmentModel.id == appointment_id).first()
+    appointment = await db.get(AppointmentModel, appointment_id)
     if not appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
     appointment.status = "completed"
     appointment.notes = notes
-    db.commit()
+    await db.commit()
     return {"message": "Appointment marked as completed"}
 
 @app.get("/appointments/doctor/{doctor_id}/available-slots")
-def get_available_slots(doctor_id: int, date: str, db: Session = Depends(get_db)):
+async def get_available_slots(doctor_id: int, date: str, db: AsyncSession = Depends(get_db)):
     try:
         target_date = datetime.strptime(date, "%Y-%m-%d").date()
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format")
     
-    booked_slots = db.query(AppointmentModel.appointment_time).filter(
+    booked_slots = (await db.scalars(select(AppointmentModel.appointment_time).where(
         AppointmentModel.doctor_id == doctor_id,
         AppointmentModel.appointment_date == target_date,
         AppointmentModel.status != "cancelled"
-    ).all()
-    booked_slots = [slot[0].strftime("%H:%M") for slot in booked_slots]
-
-    all_slots = [f"{h:02d}:00" for h in range(9, 17)]
-    available = [slot for slot in all_slots if slot not in booked_slots]
-    return {"available_slots": available}
+    ))).all()
+    schedule = await schedules.get(doctor_id)
+    if schedule is None:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    available = schedule.free_times(schedule.day_mask(target_date) & ~schedule.booked_mask(booked_slots))
+    return {"available_slots": [slot.strftime("%H:%M") for slot in available]}
 
 # ------------------------------
 # Run server
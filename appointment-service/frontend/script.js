@@ -92,6 +92,13 @@ function getToken() {
     return localStorage.getItem('access_token') || '';
 }
 
+// W3C trace context for a request we want traced end to end (sampled flag set;
+// services still cap how many traces they record).
+function newTraceparent() {
+    const hex = n => Array.from(crypto.getRandomValues(new Uint8Array(n)), b => b.toString(16).padStart(2, "0")).join("");
+    return `00-${hex(16)}-${hex(8)}-01`;
+}
+
 // ------------------------------
 // Appointment actions
 // ------------------------------
@@ -105,17 +112,21 @@ function bookAppointment() {
         method: "POST",
         headers: {
             "Content-Type": "application/json",
-            "Authorization": `Bearer ${getToken()}`
+            "Authorization": `Bearer ${getToken()}`,
+            "traceparent": newTraceparent()
         },
         body: JSON.stringify({ doctor_id, appointment_date, appointment_time, reason })
     })
-    .then(res => res.json())
+    .then(res => {
+        console.info("Booking trace", res.headers.get("X-Trace-Id"));
+        return res.json();
+    })
     .then(data => { alert("Appointment booked!"); getAppointments(); })
     .catch(err => alert("Error: " + err));
 }
 
 function getAppointments() {
-    fetch(`${SERVICES.appointment}/appointments/my`, {
+    fetch(`${SERVICES.appointment}/appointments/my?expand=doctor`, {
         headers: { "Authorization": `Bearer ${getToken()}` }
     })
     .then(res => res.ok ? res.json() : Promise.reject('Failed to load appointments'))
@@ -124,7 +135,9 @@ function getAppointments() {
 }
 
 function getAppointmentsByUsername(username) {
-    fetch(`${SERVICES.appointment}/appointments/user/${encodeURIComponent(username)}`)
+    fetch(`${SERVICES.appointment}/appointments/user/${encodeURIComponent(username)}?expand=doctor`, {
+        headers: { "Authorization": `Bearer ${getToken()}` }
+    })
     .then(res => res.ok ? res.json() : Promise.reject('User not found or error'))
     .then(data => renderAppointmentsTable(data))
     .catch(err => { document.getElementById('appointments').innerText = 'No appointments found for that username.'; });
@@ -197,11 +210,11 @@ function renderAppointmentsTable(data) {
     const pname = localStorage.getItem('patient_name') || '';
     let html = "";
     if(pname) html += `<div class="small">Appointments for: <strong>${pname}</strong></div>`;
-    html += "<table><tr><th>ID</th><th>Doctor ID</th><th>Date</th><th>Time</th><th>Status</th><th>Reason</th><th>Actions</th></tr>";
+    html += "<table><tr><th>ID</th><th>Doctor</th><th>Date</th><th>Time</th><th>Status</th><th>Reason</th><th>Actions</th></tr>";
     data.forEach(a => {
         html += `<tr>
             <td>${a.id}</td>
-            <td>${a.doctor_id}</td>
+            <td>${a.doctor ? `Dr. ${a.doctor.first_name} ${a.doctor.last_name}` : a.doctor_id}</td>
             <td>${a.appointment_date}</td>
             <td>${a.appointment_time}</td>
             <td>${a.status}</td>
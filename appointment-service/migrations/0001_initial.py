@@ -0,0 +1,67 @@
+"""Baseline: the appointments table, including the live-booking unique index.
+
+Tables from before the index can hold double bookings (the old
+SELECT-then-INSERT race), which would make building it fail. In each slot
+the earliest live booking is kept and the others are cancelled, with a
+note and a log line naming them.
+"""
+import logging
+
+from sqlalchemy import TIMESTAMP, Column, Date, Index, Integer, MetaData, String, Table, Text, Time, func, text
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+appointments = Table(
+    "appointments", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("patient_id", Integer, nullable=False),
+    Column("doctor_id", Integer, nullable=False),
+    Column("appointment_date", Date, nullable=False),
+    Column("appointment_time", Time, nullable=False),
+    Column("status", String),
+    Column("reason", Text, nullable=True),
+    Column("notes", Text, nullable=True),
+    Column("created_at", TIMESTAMP, server_default=func.now()),
+    Index(
+        "uq_appointments_doctor_slot",
+        "doctor_id", "appointment_date", "appointment_time",
+        unique=True,
+        postgresql_where=text("status != 'cancelled'"),
+        sqlite_where=text("status != 'cancelled'"),
+    ),
+)
+
+
+# Live bookings that share a slot with an earlier live booking.
+LATER_DUPLICATES = """
+    SELECT id FROM appointments a
+    WHERE status != 'cancelled' AND EXISTS (
+        SELECT 1 FROM appointments b
+        WHERE b.doctor_id = a.doctor_id AND b.appointment_date = a.appointment_date
+          AND b.appointment_time = a.appointment_time AND b.status != 'cancelled' AND b.id < a.id
+    )
+"""
+
+
+def cancel_double_bookings(conn):
+    duplicates = conn.scalars(text(LATER_DUPLICATES + " ORDER BY id")).all()
+    if not duplicates:
+        return
+    logger.warning("Cancelling %d double-booked appointments before adding uq_appointments_doctor_slot: %s",
+                   len(duplicates), ", ".join(map(str, duplicates)))
+    conn.execute(text(
+        "UPDATE appointments SET status = 'cancelled', "
+        "notes = COALESCE(notes || ' ', '') || '[Cancelled: slot was double-booked]' "
+        f"WHERE id IN ({LATER_DUPLICATES})"
+    ))
+
+
+def upgrade(conn):
+    metadata.create_all(conn)
+    cancel_double_bookings(conn)
+    # Databases created before migrations already have the table, so
+    # create_all skipped it; make sure the unique index exists there too.
+    for index in appointments.indexes:
+        index.create(conn, checkfirst=True)
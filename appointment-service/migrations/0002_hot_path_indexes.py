@@ -0,0 +1,20 @@
+"""Composite indexes for the appointment list queries.
+
+Doctor and patient views filter on their id and order by date/time and
+then id (the keyset tiebreak) descending; a backward scan of these indexes
+returns rows already sorted and starts at the cursor.
+Slot lookups (doctor + date, status != 'cancelled') are served by
+uq_appointments_doctor_slot from 0001.
+"""
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_appointments_doctor_date "
+        "ON appointments (doctor_id, appointment_date, appointment_time, id)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_appointments_patient_date "
+        "ON appointments (patient_id, appointment_date, appointment_time, id)"
+    ))
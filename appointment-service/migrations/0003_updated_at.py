@@ -0,0 +1,9 @@
+"""appointments.updated_at: last write time, a cheap validator for conditional GETs."""
+from sqlalchemy import inspect, text
+
+
+def upgrade(conn):
+    if "updated_at" in {c["name"] for c in inspect(conn).get_columns("appointments")}:
+        return
+    conn.execute(text("ALTER TABLE appointments ADD COLUMN updated_at TIMESTAMP"))
+    conn.execute(text("UPDATE appointments SET updated_at = created_at"))
@@ -0,0 +1,21 @@
+"""Add id to the appointment list indexes so the keyset ORDER BY is fully covered.
+
+Pages are ordered by date and time, then id, and continue with
+``WHERE (..., id) < cursor``. Indexes that 0002 built before it included
+id leave rows sharing a date to be sorted; those are rebuilt.
+"""
+from sqlalchemy import inspect, text
+
+INDEXES = {
+    "ix_appointments_doctor_date": ["doctor_id", "appointment_date", "appointment_time", "id"],
+    "ix_appointments_patient_date": ["patient_id", "appointment_date", "appointment_time", "id"],
+}
+
+
+def upgrade(conn):
+    existing = {i["name"]: i["column_names"] for i in inspect(conn).get_indexes("appointments")}
+    for name, columns in INDEXES.items():
+        if existing.get(name) == columns:
+            continue
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        conn.execute(text(f"CREATE INDEX {name} ON appointments ({', '.join(columns)})"))
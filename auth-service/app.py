@@ -1,16 +1,32 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
-from typing import Optional
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, or_
-from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from typing import List, Optional
+from sqlalchemy import Column, Integer, String, DateTime, or_, select
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import base64
 import hashlib
+import hmac
 import jwt
+from cryptography.hazmat.primitives import serialization
 from datetime import datetime, timedelta
 import os
+from common.cache import bump_version, read_version, version_table
+from common.db import Database, env_flag
+from common.etag import ETagMiddleware
+from common.http import close_clients
+from common.instrumentation import instrument
+from common.metrics import REGISTRY
+from common.migrations import run_migrations
+from common.profiling import install_profiler
+from common.static import mount_frontend
+from common.tracing import TRACE_ID_HEADER, TRACER, install_tracing
+from common.users import SERVICE_TOKEN_HEADER
 
 # ------------------------------
 # FastAPI setup
@@ -23,42 +39,107 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[TRACE_ID_HEADER],
 )
+app.add_middleware(ETagMiddleware)
+# Outermost, so ETags are computed on the uncompressed body.
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
 
-frontend_dir = "frontend"
-if os.path.isdir(frontend_dir):
-    app.mount("/static", StaticFiles(directory=frontend_dir), name="static")
-
-    @app.get("/")
-    def serve_index():
-        return FileResponse(os.path.join(frontend_dir, "index.html"))
-else:
-    @app.get("/")
-    def serve_index():
-        return {"service": "auth", "frontend": False}
+# frontend/build (scripts/build_static.py) when present, else the raw sources
+mount_frontend(app, "auth")
 
 # ------------------------------
 # Security
 # ------------------------------
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
-ALGORITHM = "HS256"
+ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 security = HTTPBearer()
 
+# Asymmetric signing (RS256/ES256): JWT_KEYS_DIR holds one <kid>.pem private key
+# per key. JWT_ACTIVE_KID picks the signing key; every key's public half stays
+# published in the key set so tokens signed before a rotation keep verifying.
+JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR")
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID")
+
+def load_signing_keys():
+    keys = {}
+    if ALGORITHM.startswith("HS") or not JWT_KEYS_DIR:
+        return keys
+    for name in sorted(os.listdir(JWT_KEYS_DIR)):
+        if name.endswith(".pem"):
+            with open(os.path.join(JWT_KEYS_DIR, name), "rb") as f:
+                keys[name[:-4]] = serialization.load_pem_private_key(f.read(), password=None)
+    return keys
+
+SIGNING_KEYS = load_signing_keys()
+if not ALGORITHM.startswith("HS"):
+    if not SIGNING_KEYS:
+        raise RuntimeError(f"JWT_ALGORITHM={ALGORITHM} requires private keys in JWT_KEYS_DIR")
+    ACTIVE_KID = JWT_ACTIVE_KID or list(SIGNING_KEYS)[-1]
+else:
+    ACTIVE_KID = None
+
 # ------------------------------
-# Database setup
+# Password hashing
 # ------------------------------
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT", "5432")
-DB_NAME = os.getenv("DB_NAME")
+# Salted scrypt, stored as scrypt$<n>$<r>$<p>$<salt>$<hash>. Changing the cost
+# parameters applies to new passwords right away and to existing ones at their
+# next login; hashes from before this format (unsalted SHA-256 hex) still
+# verify and are upgraded the same way.
+SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+
+# A hash costs tens of milliseconds of CPU, so it runs on this pool instead of
+# the event loop; the worker count bounds how many run at once.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p, dklen=32)
+
+def hash_password(password: str) -> str:
+    salt = os.urandom(16)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    encode = lambda b: base64.b64encode(b).decode()
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${encode(salt)}${encode(digest)}"
+
+def verify_password(password: str, stored: str) -> bool:
+    if stored.startswith("scrypt$"):
+        _, n, r, p, salt, digest = stored.split("$")
+        candidate = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+        return hmac.compare_digest(candidate, base64.b64decode(digest))
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
 
-DB_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+def needs_rehash(stored: str) -> bool:
+    return not stored.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
 
-engine = create_engine(DB_URL)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+HASH_POOL_WORKERS = REGISTRY.gauge("password_hash_workers", "Password hashing threads")
+HASH_POOL_WORKERS.set(PASSWORD_HASH_WORKERS)
+HASH_IN_FLIGHT = REGISTRY.gauge("password_hash_in_flight", "Password hashes queued or running; above workers means waiting")
+
+async def in_hash_pool(fn, *args):
+    HASH_IN_FLIGHT.inc()
+    try:
+        with TRACER.span(fn.__name__):
+            return await asyncio.get_running_loop().run_in_executor(hash_executor, fn, *args)
+    finally:
+        HASH_IN_FLIGHT.dec()
+
+# Verified against when no user matches, so unknown usernames take as long as wrong passwords.
+DUMMY_HASH = hash_password(base64.b64encode(os.urandom(12)).decode())
+
+# ------------------------------
+# Database setup
+# ------------------------------
+# DB_USER/DB_PASSWORD/DB_HOST/DB_PORT/DB_NAME; DB_ASYNC=0 selects the sync driver
+database = Database.from_env()
+engine = database.engine
 Base = declarative_base()
 
+# Request, query, outbound-call and threadpool metrics at /metrics
+instrument(app, database)
+
 # ------------------------------
 # Models
 # ------------------------------
@@ -70,8 +151,22 @@ class UserDB(Base):
     email = Column(String, unique=True, nullable=False)
     role = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Position in the /users/changes feed; see record_user_change.
+    change_seq = Column(Integer, index=True)
+
+cache_versions = version_table(Base.metadata)
+
+# Schema changes live in migrations/; DB_MIGRATE_ON_STARTUP=0 leaves them to a
+# separate job (python -m common.migrations <service>-service).
+@app.on_event("startup")
+async def migrate():
+    if env_flag("DB_MIGRATE_ON_STARTUP", "1"):
+        await run_migrations(database, "auth", os.path.join(os.path.dirname(__file__), "migrations"))
 
-Base.metadata.create_all(bind=engine)
+# Outbound connection pools (common/http.py), sync and async.
+@app.on_event("shutdown")
+async def close_service_clients():
+    await close_clients()
 
 # ------------------------------
 # Pydantic models
@@ -92,54 +187,110 @@ class Token(BaseModel):
     user_id: int
     role: str
 
+class UserInfo(BaseModel):
+    user_id: int
+    username: str
+    email: str
+    role: str
+
+class UserChanges(BaseModel):
+    users: List[UserInfo]
+    cursor: int
+    has_more: bool
+
 # ------------------------------
 # Dependencies
 # ------------------------------
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with database.session() as db:
         yield db
-    finally:
-        db.close()
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+async def record_user_change(db, user: UserDB):
+    """Give ``user`` the next /users/changes position; call before commit.
+
+    The counter row stays locked until the transaction commits, so writers
+    commit in sequence order and a feed reader never sees a later position
+    before an earlier one.
+    """
+    await bump_version(db, cache_versions, "users")
+    user.change_seq = await read_version(db, cache_versions, "users")
+
+def user_info(user: UserDB) -> UserInfo:
+    return UserInfo(user_id=user.id, username=user.username, email=user.email, role=user.role)
 
 def create_token(user_id: int, username: str, role: str) -> str:
+    now = datetime.utcnow()
     payload = {
         "user_id": user_id,
         "username": username,
         "role": role,
-        "exp": datetime.utcnow() + timedelta(hours=24)
+        "iat": now,
+        "exp": now + timedelta(hours=24)
     }
+    if ACTIVE_KID:
+        return jwt.encode(payload, SIGNING_KEYS[ACTIVE_KID], algorithm=ALGORITHM, headers={"kid": ACTIVE_KID})
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if ACTIVE_KID:
+            kid = jwt.get_unverified_header(token).get("kid")
+            if kid not in SIGNING_KEYS:
+                raise jwt.InvalidTokenError("Unknown key id")
+            key = SIGNING_KEYS[kid].public_key()
+        else:
+            key = SECRET_KEY
+        payload = jwt.decode(token, key, algorithms=[ALGORITHM])
         return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# Shared secret other services present in X-Service-Token for bulk directory reads;
+# unset, only admins can read them.
+SERVICE_TOKEN = os.getenv("SERVICE_TOKEN", "")
+optional_bearer = HTTPBearer(auto_error=False)
+
+async def require_directory_reader(
+    service_token: Optional[str] = Header(None, alias=SERVICE_TOKEN_HEADER),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_bearer),
+):
+    if service_token is not None and SERVICE_TOKEN and hmac.compare_digest(service_token, SERVICE_TOKEN):
+        return
+    if service_token is not None or credentials is None:
+        raise HTTPException(status_code=401, detail="Service credential or admin token required")
+    user = await verify_token(credentials)
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins and services can read the user directory")
+
+# Per-request SQL profiling: SQL_PROFILE at startup, PUT /debug/sql-profile at runtime
+install_profiler(app, database, verify_token)
+# Outermost: traceparent in and out, spans for requests, DB statements and service calls
+install_tracing(app, database, "auth-service")
+
 # ------------------------------
 # Routes
 # ------------------------------
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "healthy", "service": "auth"}
 
+@app.get("/health/db")
+async def db_pool_stats():
+    """Connection pool occupancy and checkout wait times, for sizing DB_POOL_SIZE against max_connections."""
+    return database.pool_stats()
+
 @app.post("/register", response_model=Token)
-def register(user: UserRegister, db: Session = Depends(get_db)):
-    existing_user = db.query(UserDB).filter(
+async def register(user: UserRegister, db: AsyncSession = Depends(get_db)):
+    existing_user = await db.scalar(select(UserDB).where(
         (UserDB.username == user.username) | (UserDB.email == user.email)
-    ).first()
+    ))
     if existing_user:
         raise HTTPException(status_code=400, detail="Username or email already exists")
 
-    hashed_pw = hash_password(user.password)
+    hashed_pw = await in_hash_pool(hash_password, user.password)
     new_user = UserDB(
         username=user.username,
         password=hashed_pw,
@@ -147,8 +298,9 @@ def register(user: UserRegister, db: Session = Depends(get_db)):
         role=user.role
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await record_user_change(db, new_user)
+    await db.commit()
+    await db.refresh(new_user)
 
     token = create_token(new_user.id, new_user.username, new_user.role)
     return Token(
@@ -159,18 +311,29 @@ def register(user: UserRegister, db: Session = Depends(get_db)):
     )
 
 @app.post("/login", response_model=Token)
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    hashed_pw = hash_password(user.password)
-    # allow login by username OR email (frontend sends email as username when registering)
-    db_user = db.query(UserDB).filter(
-        UserDB.password == hashed_pw
-    ).filter(
+async def login(user: UserLogin, db: AsyncSession = Depends(get_db)):
+    # allow login by username OR email (frontend sends email as username when registering);
+    # both columns are unique, so this is two index lookups
+    matches = (await db.scalars(select(UserDB).where(
         or_(UserDB.username == user.username, UserDB.email == user.username)
-    ).first()
+    ))).all()
+    # one user's username can be another's email: try the username match first
+    candidates = sorted(matches, key=lambda u: u.username != user.username)
 
+    db_user = None
+    for candidate in candidates:
+        if await in_hash_pool(verify_password, user.password, candidate.password):
+            db_user = candidate
+            break
+    if not candidates:
+        await in_hash_pool(verify_password, user.password, DUMMY_HASH)
     if not db_user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    if needs_rehash(db_user.password):
+        db_user.password = await in_hash_pool(hash_password, user.password)
+        await db.commit()
+
     token = create_token(db_user.id, db_user.username, db_user.role)
     return Token(
         access_token=token,
@@ -180,20 +343,74 @@ def login(user: UserLogin, db: Session = Depends(get_db)):
     )
 
 @app.get("/verify")
-def verify(payload: dict = Depends(verify_token)):
+async def verify(payload: dict = Depends(verify_token)):
     return {"valid": True, "user": payload}
 
+@app.get("/.well-known/jwks.json")
+async def jwks():
+    """Public signing keys for in-process verification in the other services.
+
+    Empty in HS256 mode: the shared secret is distributed via SECRET_KEY, never published.
+    """
+    keys = []
+    algorithm = jwt.get_algorithm_by_name(ALGORITHM) if ACTIVE_KID else None
+    for kid, private_key in SIGNING_KEYS.items():
+        jwk = algorithm.to_jwk(private_key.public_key(), as_dict=True)
+        jwk.update({"kid": kid, "alg": ALGORITHM, "use": "sig"})
+        keys.append(jwk)
+    return {"keys": keys}
+
 
 @app.get("/debug/users")
-def debug_users(db: Session = Depends(get_db)):
+async def debug_users(db: AsyncSession = Depends(get_db)):
     """Development-only: list users to help debug registration/login issues."""
-    users = db.query(UserDB).all()
+    users = (await db.scalars(select(UserDB))).all()
     return [{"id": u.id, "username": u.username, "email": u.email, "role": u.role} for u in users]
 
 
+MAX_USER_BATCH = 500
+MAX_CHANGES_PAGE = 5000
+
+@app.get("/users", response_model=List[UserInfo], dependencies=[Depends(require_directory_reader)])
+async def get_users(ids: Optional[str] = None, usernames: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    """Batch lookup by comma-separated ``ids`` or ``usernames``; unknown ones are left out."""
+    if (ids is None) == (usernames is None):
+        raise HTTPException(status_code=400, detail="Give either ids or usernames")
+    if ids is not None:
+        try:
+            keys = {int(i) for i in ids.split(",") if i.strip()}
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+        column = UserDB.id
+    else:
+        keys = {u.strip() for u in usernames.split(",") if u.strip()}
+        column = UserDB.username
+    if len(keys) > MAX_USER_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_USER_BATCH} users per request")
+    if not keys:
+        return []
+    users = (await db.scalars(select(UserDB).where(column.in_(keys)).order_by(UserDB.id))).all()
+    return [user_info(u) for u in users]
+
+@app.get("/users/changes", response_model=UserChanges, dependencies=[Depends(require_directory_reader)])
+async def get_user_changes(since: int = 0, limit: int = Query(1000, ge=1, le=MAX_CHANGES_PAGE),
+                           db: AsyncSession = Depends(get_db)):
+    """Users created or changed after feed position ``since``, oldest first.
+
+    Start from 0 and pass the returned ``cursor`` back in; ``has_more`` means
+    another page is ready now. Replicas (common/users.py) stay current this way.
+    """
+    users = (await db.scalars(
+        select(UserDB).where(UserDB.change_seq > since).order_by(UserDB.change_seq).limit(limit + 1)
+    )).all()
+    page = users[:limit]
+    return UserChanges(users=[user_info(u) for u in page],
+                       cursor=page[-1].change_seq if page else since,
+                       has_more=len(users) > limit)
+
 @app.get("/users/by-username/{username}")
-def get_user_by_username(username: str, db: Session = Depends(get_db)):
-    user = db.query(UserDB).filter(UserDB.username == username).first()
+async def get_user_by_username(username: str, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(UserDB).where(UserDB.username == username))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return {"user_id": user.id, "username": user.username, "email": user.email, "role": user.role}
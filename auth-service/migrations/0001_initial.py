@@ -0,0 +1,18 @@
+"""Baseline: the users table as created by create_all before migrations existed."""
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table
+
+metadata = MetaData()
+
+users = Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String, unique=True, nullable=False),
+    Column("password", String, nullable=False),
+    Column("email", String, unique=True, nullable=False),
+    Column("role", String, nullable=False),
+    Column("created_at", DateTime),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn)
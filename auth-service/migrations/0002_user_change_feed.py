@@ -0,0 +1,21 @@
+"""users.change_seq: position in the /users/changes feed, ordered by the cache_versions 'users' counter."""
+from sqlalchemy import Column, Integer, MetaData, String, Table, insert, inspect, select, text
+
+metadata = MetaData()
+
+cache_versions = Table(
+    "cache_versions", metadata,
+    Column("scope", String, primary_key=True),
+    Column("version", Integer, nullable=False),
+)
+
+
+def upgrade(conn):
+    if "change_seq" not in {c["name"] for c in inspect(conn).get_columns("users")}:
+        conn.execute(text("ALTER TABLE users ADD COLUMN change_seq INTEGER"))
+        conn.execute(text("UPDATE users SET change_seq = id"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_change_seq ON users (change_seq)"))
+    cache_versions.create(conn, checkfirst=True)
+    if conn.scalar(select(cache_versions.c.scope).where(cache_versions.c.scope == "users")) is None:
+        last = conn.scalar(text("SELECT max(change_seq) FROM users")) or 0
+        conn.execute(insert(cache_versions).values(scope="users", version=last))
@@ -1,14 +1,27 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, Date, DateTime, func
-from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import Column, Integer, String, Float, Text, Date, DateTime, Index, delete, func, insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 from datetime import datetime, date
-import requests
 import os
+from common.db import Database, env_flag
+from common.etag import ETagMiddleware, check_etag
+from common.export import export_response
+from common.fastjson import columns_for
+from common.http import close_clients
+from common.instrumentation import instrument
+from common.migrations import run_migrations
+from common.pagination import NEXT_CURSOR_HEADER, PageParams, paginate_rows
+from common.profiling import install_profiler
+from common.static import mount_frontend
+from common.tokens import TokenVerifier
+from common.tracing import TRACE_ID_HEADER, install_tracing
 
 # ------------------------------
 # FastAPI setup
@@ -21,37 +34,29 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, TRACE_ID_HEADER],
 )
+app.add_middleware(ETagMiddleware)
+# Outermost, so ETags are computed on the uncompressed body.
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
 
-frontend_dir = "frontend"
-if os.path.isdir(frontend_dir):
-    app.mount("/static", StaticFiles(directory=frontend_dir), name="static")
-
-    @app.get("/")
-    def serve_index():
-        return FileResponse(os.path.join(frontend_dir, "index.html"))
-else:
-    @app.get("/")
-    def serve_index():
-        return {"service": "billing", "frontend": False}
+# frontend/build (scripts/build_static.py) when present, else the raw sources
+mount_frontend(app, "billing")
 
 # ------------------------------
 # Environment variables
 # ------------------------------
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8000")
+token_verifier = TokenVerifier.from_env(AUTH_SERVICE_URL)
 
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT", "5432")
-DB_NAME = os.getenv("DB_NAME")
-
-DB_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-
-engine = create_engine(DB_URL)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# DB_USER/DB_PASSWORD/DB_HOST/DB_PORT/DB_NAME; DB_ASYNC=0 selects the sync driver
+database = Database.from_env()
+engine = database.engine
 Base = declarative_base()
 
+# Request, query, outbound-call and threadpool metrics at /metrics
+instrument(app, database)
+
 # ------------------------------
 # Database models
 # ------------------------------
@@ -67,8 +72,45 @@ class InvoiceDB(Base):
     due_date = Column(Date, nullable=False)
     paid_date = Column(Date, nullable=True)
     created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # A patient's invoices, optionally by status, ordered by date (migration 0002).
+    __table_args__ = (
+        Index("ix_invoices_patient_date", "patient_id", "invoice_date", "id"),
+        Index("ix_invoices_patient_status_date", "patient_id", "status", "invoice_date", "id"),
+        # One invoice per appointment (migration 0005).
+        Index(
+            "uq_invoices_appointment", "appointment_id",
+            unique=True,
+            postgresql_where=text("appointment_id IS NOT NULL"),
+            sqlite_where=text("appointment_id IS NOT NULL"),
+        ),
+    )
+
+class InvoiceRollupDB(Base):
+    """Invoice counts and amounts by month, patient and status, updated with every invoice write.
 
-Base.metadata.create_all(bind=engine)
+    period is the invoice_date month ("YYYY-MM") or "all"; patient_id 0 means
+    all patients, so the dashboard totals are the ("all", 0) rows.
+    """
+    __tablename__ = "invoice_rollups"
+    period = Column(String, primary_key=True)
+    patient_id = Column(Integer, primary_key=True)
+    status = Column(String, primary_key=True)
+    invoice_count = Column(Integer, nullable=False, default=0)
+    amount = Column(Float, nullable=False, default=0.0)
+
+# Schema changes live in migrations/; DB_MIGRATE_ON_STARTUP=0 leaves them to a
+# separate job (python -m common.migrations <service>-service).
+@app.on_event("startup")
+async def migrate():
+    if env_flag("DB_MIGRATE_ON_STARTUP", "1"):
+        await run_migrations(database, "billing", os.path.join(os.path.dirname(__file__), "migrations"))
+
+# Outbound connection pools (common/http.py), sync and async.
+@app.on_event("shutdown")
+async def close_service_clients():
+    await close_clients()
 
 # ------------------------------
 # Pydantic models
@@ -81,6 +123,10 @@ class Invoice(BaseModel):
     invoice_date: date
     due_date: date
 
+class BatchRequest(BaseModel):
+    # Validated per item so one bad row is reported instead of rejecting the batch.
+    items: List[dict]
+
 class InvoiceResponse(Invoice):
     id: int
     status: str
@@ -89,39 +135,118 @@ class InvoiceResponse(Invoice):
     class Config:
         from_attributes = True
 
+# ------------------------------
+# Billing rollups
+# ------------------------------
+ALL_PERIODS = "all"
+ALL_PATIENTS = 0
+
+def rollup_keys(period: str, patient_id: int, status: str):
+    return [(p, pid, status) for p in (period, ALL_PERIODS) for pid in (patient_id, ALL_PATIENTS)]
+
+def add_rollup_delta(deltas: dict, invoice, status: str, sign: int):
+    """Accumulate +/-1 invoice of ``status`` into ``deltas`` for every grain the invoice counts towards."""
+    for key in rollup_keys(invoice.invoice_date.strftime("%Y-%m"), invoice.patient_id, status):
+        entry = deltas.setdefault(key, [0, 0.0])
+        entry[0] += sign
+        entry[1] += sign * invoice.amount
+
+async def apply_rollup_deltas(db, deltas: dict):
+    """Upsert ``deltas`` in one statement, inside the caller's transaction.
+
+    Keys are written in sorted order so concurrent writers lock rollup rows
+    in the same order and can't deadlock.
+    """
+    if not deltas:
+        return
+    dialect_insert = sqlite.insert if database.sync_engine.dialect.name == "sqlite" else postgresql.insert
+    stmt = dialect_insert(InvoiceRollupDB.__table__).values([
+        {"period": period, "patient_id": patient_id, "status": status, "invoice_count": count, "amount": amount}
+        for (period, patient_id, status), (count, amount) in sorted(deltas.items())
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["period", "patient_id", "status"],
+        set_={"invoice_count": InvoiceRollupDB.invoice_count + stmt.excluded.invoice_count,
+              "amount": InvoiceRollupDB.amount + stmt.excluded.amount},
+    )
+    await db.execute(stmt)
+
+async def rebuild_rollups(db) -> dict:
+    """Recompute every rollup row from invoices, replace the table and report rows that had drifted."""
+    if database.sync_engine.dialect.name == "postgresql":
+        # Writers wait for the rebuild, so no delta lands between the aggregate and the swap.
+        await db.execute(text("LOCK TABLE invoice_rollups IN EXCLUSIVE MODE"))
+    year, month = func.extract("year", InvoiceDB.invoice_date), func.extract("month", InvoiceDB.invoice_date)
+    grouped = (await db.execute(
+        select(year, month, InvoiceDB.patient_id, InvoiceDB.status, func.count(InvoiceDB.id), func.sum(InvoiceDB.amount))
+        .group_by(year, month, InvoiceDB.patient_id, InvoiceDB.status)
+    )).all()
+    expected = {}
+    for y, m, patient_id, status, count, amount in grouped:
+        for key in rollup_keys(f"{int(y):04d}-{int(m):02d}", patient_id, status):
+            entry = expected.setdefault(key, [0, 0.0])
+            entry[0] += count
+            entry[1] += amount or 0.0
+    current = {(r.period, r.patient_id, r.status): [r.invoice_count, r.amount]
+               for r in (await db.scalars(select(InvoiceRollupDB))).all()}
+
+    def same(a, b):
+        a, b = a or [0, 0.0], b or [0, 0.0]
+        return a[0] == b[0] and round(a[1], 2) == round(b[1], 2)
+    drifted = sorted(key for key in expected.keys() | current.keys() if not same(expected.get(key), current.get(key)))
+
+    await db.execute(delete(InvoiceRollupDB))
+    if expected:
+        await db.execute(insert(InvoiceRollupDB), [
+            {"period": period, "patient_id": patient_id, "status": status, "invoice_count": count, "amount": amount}
+            for (period, patient_id, status), (count, amount) in expected.items()
+        ])
+    await db.commit()
+    return {"rows": len(expected), "drifted": len(drifted),
+            "examples": [{"period": p, "patient_id": pid, "status": st} for p, pid, st in drifted[:20]]}
+
+def summarize(rows) -> dict:
+    by_status = {row.status: row for row in rows}
+    pending, paid = by_status.get("pending"), by_status.get("paid")
+    return {
+        "pending_invoices": pending.invoice_count if pending else 0,
+        "pending_amount": pending.amount if pending else 0.0,
+        "paid_invoices": paid.invoice_count if paid else 0,
+        "paid_amount": paid.amount if paid else 0.0,
+        "total_amount": sum(row.amount for row in rows),
+    }
+
 # ------------------------------
 # Dependencies
 # ------------------------------
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with database.session() as db:
         yield db
-    finally:
-        db.close()
 
-def verify_token(authorization: str = Header(None)):
+async def verify_token(authorization: str = Header(None)):
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header missing")
-    try:
-        response = requests.get(
-            f"{AUTH_SERVICE_URL}/verify",
-            headers={"Authorization": authorization}
-        )
-        if response.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return response.json()["user"]
-    except requests.RequestException:
-        raise HTTPException(status_code=503, detail="Auth service unavailable")
+    return await token_verifier.averify(authorization)
+
+# Per-request SQL profiling: SQL_PROFILE at startup, PUT /debug/sql-profile at runtime
+install_profiler(app, database, verify_token)
+# Outermost: traceparent in and out, spans for requests, DB statements and service calls
+install_tracing(app, database, "billing-service")
 
 # ------------------------------
 # Routes
 # ------------------------------
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "healthy", "service": "billing"}
 
+@app.get("/health/db")
+async def db_pool_stats():
+    """Connection pool occupancy and checkout wait times, for sizing DB_POOL_SIZE against max_connections."""
+    return database.pool_stats()
+
 @app.post("/invoices", response_model=InvoiceResponse)
-def create_invoice(invoice: Invoice, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def create_invoice(invoice: Invoice, user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     if user["role"] not in ["admin", "doctor"]:
         raise HTTPException(status_code=403, detail="Not authorized to create invoices")
     
@@ -147,28 +272,134 @@ def create_invoice(invoice: Invoice, user: dict = Depends(verify_token), db: Ses
         status="pending"
     )
     db.add(new_invoice)
-    db.commit()
-    db.refresh(new_invoice)
+    deltas = {}
+    add_rollup_delta(deltas, new_invoice, "pending", 1)
+    await apply_rollup_deltas(db, deltas)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # uq_invoices_appointment
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Appointment already invoiced")
+    await db.refresh(new_invoice)
     return new_invoice
 
+MAX_BATCH_ITEMS = 500
+
+@app.post("/invoices/batch")
+async def create_invoices_batch(batch: BatchRequest, user: dict = Depends(verify_token),
+                                db: AsyncSession = Depends(get_db)):
+    """Create up to MAX_BATCH_ITEMS invoices in one multi-row INSERT, with a status per item.
+
+    An appointment that already has an invoice (or appears twice in the batch)
+    is reported as 409, so a billing run can be re-submitted safely.
+    """
+    if user["role"] not in ["admin", "doctor"]:
+        raise HTTPException(status_code=403, detail="Not authorized to create invoices")
+    if len(batch.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    results = [None] * len(batch.items)
+
+    def fail(index, status_code, detail):
+        results[index] = {"index": index, "status": status_code, "detail": detail}
+
+    items = []
+    for index, raw in enumerate(batch.items):
+        try:
+            items.append((index, Invoice.model_validate(raw)))
+        except ValidationError as e:
+            fail(index, 422, e.errors(include_url=False, include_context=False))
+
+    candidates = {}  # appointment_id (or a placeholder for items without one) -> (index, item)
+    for index, item in items:
+        if item.appointment_id is None:
+            candidates[("none", index)] = (index, item)
+        elif item.appointment_id in candidates:
+            fail(index, 409, "Appointment invoiced twice in this batch")
+        else:
+            candidates[item.appointment_id] = (index, item)
+
+    # A concurrent invoice can take an appointment between the check and the
+    # insert; uq_invoices_appointment then rejects the statement and we re-check.
+    created = []
+    for attempt in range(3):
+        appointment_ids = [key for key in candidates if not isinstance(key, tuple)]
+        if appointment_ids:
+            invoiced = (await db.scalars(
+                select(InvoiceDB.appointment_id).where(InvoiceDB.appointment_id.in_(appointment_ids))
+            )).all()
+            for appointment_id in invoiced:
+                index, _ = candidates.pop(appointment_id)
+                fail(index, 409, "Appointment already invoiced")
+        if not candidates:
+            break
+        pending = list(candidates.values())
+        try:
+            created = (await db.scalars(
+                insert(InvoiceDB).returning(InvoiceDB, sort_by_parameter_order=True),
+                [{**item.model_dump(), "status": "pending"} for _, item in pending],
+            )).all()
+            deltas = {}
+            for invoice in created:
+                add_rollup_delta(deltas, invoice, "pending", 1)
+            await apply_rollup_deltas(db, deltas)
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            created = []
+            continue
+        for (index, _), invoice in zip(pending, created):
+            results[index] = {"index": index, "status": 201,
+                              "invoice": InvoiceResponse.model_validate(invoice).model_dump(mode="json")}
+        break
+    else:
+        for index, _ in candidates.values():
+            fail(index, 409, "Appointment already invoiced")
+
+    return {"created": len(created), "results": results}
+
+# List routes select just the response columns and skip ORM hydration (common/fastjson.py).
+INVOICE_COLUMNS = columns_for(InvoiceDB, InvoiceResponse)
+# Newest first; id breaks ties between invoices on the same date.
+INVOICE_ORDER = [InvoiceDB.invoice_date, InvoiceDB.id]
+
 @app.get("/invoices/my", response_model=List[InvoiceResponse])
-def get_my_invoices(user: dict = Depends(verify_token), status: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(InvoiceDB).filter(InvoiceDB.patient_id == user["user_id"])
+async def get_my_invoices(request: Request, response: Response, page: PageParams = Depends(),
+                          user: dict = Depends(verify_token), status: Optional[str] = None,
+                          db: AsyncSession = Depends(get_db)):
+    mine = InvoiceDB.patient_id == user["user_id"]
     if status:
-        query = query.filter(InvoiceDB.status == status)
-    invoices = query.order_by(InvoiceDB.invoice_date.desc()).all()
-    return invoices
+        mine = mine & (InvoiceDB.status == status)
+    count, last_update = (await db.execute(select(func.count(), func.max(InvoiceDB.updated_at)).where(mine))).one()
+    check_etag(request, response, user["user_id"], count, last_update)
+    return await paginate_rows(db, select(*INVOICE_COLUMNS).where(mine), INVOICE_ORDER, page, response)
 
 @app.get("/invoices/patient/{patient_id}", response_model=List[InvoiceResponse])
-def get_patient_invoices(patient_id: int, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def get_patient_invoices(patient_id: int, response: Response, page: PageParams = Depends(),
+                               user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     if user["role"] not in ["admin", "doctor"]:
         raise HTTPException(status_code=403, detail="Not authorized")
-    invoices = db.query(InvoiceDB).filter(InvoiceDB.patient_id == patient_id).order_by(InvoiceDB.invoice_date.desc()).all()
-    return invoices
+    query = select(*INVOICE_COLUMNS).where(InvoiceDB.patient_id == patient_id)
+    return await paginate_rows(db, query, INVOICE_ORDER, page, response)
+
+@app.get("/invoices/export")
+async def export_invoices(format: str = "ndjson", start: Optional[date] = None, end: Optional[date] = None,
+                          patient_id: Optional[int] = None, user: dict = Depends(verify_token)):
+    """Stream invoices (by invoice_date, inclusive) as NDJSON or CSV; patients only get their own."""
+    if user["role"] not in ["admin", "doctor"]:
+        patient_id = user["user_id"]
+    query = select(*InvoiceDB.__table__.columns)
+    if start:
+        query = query.where(InvoiceDB.invoice_date >= start)
+    if end:
+        query = query.where(InvoiceDB.invoice_date <= end)
+    if patient_id is not None:
+        query = query.where(InvoiceDB.patient_id == patient_id)
+    return export_response(database, query.order_by(InvoiceDB.id), format, "invoices")
 
 @app.get("/invoices/{invoice_id}", response_model=InvoiceResponse)
-def get_invoice(invoice_id: int, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
-    invoice = db.query(InvoiceDB).filter(InvoiceDB.id == invoice_id).first()
+async def get_invoice(invoice_id: int, user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    invoice = await db.get(InvoiceDB, invoice_id)
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     if invoice.patient_id != user["user_id"] and user["role"] not in ["admin", "doctor"]:
@@ -176,8 +407,9 @@ def get_invoice(invoice_id: int, user: dict = Depends(verify_token), db: Session
     return invoice
 
 @app.put("/invoices/{invoice_id}/pay")
-def pay_invoice(invoice_id: int, paid_date: str, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
-    invoice = db.query(InvoiceDB).filter(InvoiceDB.id == invoice_id).first()
+async def pay_invoice(invoice_id: int, paid_date: str, user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    # Row lock: two concurrent payments must not both move the invoice out of pending in the rollup.
+    invoice = await db.get(InvoiceDB, invoice_id, with_for_update=True)
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     if invoice.patient_id != user["user_id"] and user["role"] not in ["admin"]:
@@ -186,27 +418,52 @@ def pay_invoice(invoice_id: int, paid_date: str, user: dict = Depends(verify_tok
         invoice.paid_date = datetime.strptime(paid_date, "%Y-%m-%d").date()
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format")
+    if invoice.status != "paid":
+        deltas = {}
+        add_rollup_delta(deltas, invoice, invoice.status, -1)
+        add_rollup_delta(deltas, invoice, "paid", 1)
+        await apply_rollup_deltas(db, deltas)
     invoice.status = "paid"
-    db.commit()
-    db.refresh(invoice)
+    await db.commit()
     return {"message": "Invoice marked as paid"}
 
 @app.get("/invoices/stats/summary")
-def get_billing_summary(user: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def get_billing_summary(user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can view billing summary")
 
-    pending = db.query(func.count(InvoiceDB.id), func.sum(InvoiceDB.amount)).filter(InvoiceDB.status == "pending").first()
-    paid = db.query(func.count(InvoiceDB.id), func.sum(InvoiceDB.amount)).filter(InvoiceDB.status == "paid").first()
-    total = db.query(func.sum(InvoiceDB.amount)).first()
+    # One row per status from the maintained rollup, however many invoices exist.
+    rows = (await db.scalars(select(InvoiceRollupDB).where(
+        InvoiceRollupDB.period == ALL_PERIODS, InvoiceRollupDB.patient_id == ALL_PATIENTS
+    ))).all()
+    return summarize(rows)
 
-    return {
-        "pending_invoices": pending[0] or 0,
-        "pending_amount": pending[1] or 0.0,
-        "paid_invoices": paid[0] or 0,
-        "paid_amount": paid[1] or 0.0,
-        "total_amount": total[0] or 0.0
-    }
+@app.get("/invoices/stats/periods")
+async def get_billing_periods(start: str, end: str, patient_id: Optional[int] = None,
+                              user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    """Summary per month from ``start`` to ``end`` (YYYY-MM, inclusive), optionally for one patient."""
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view billing summary")
+    try:
+        datetime.strptime(start, "%Y-%m")
+        datetime.strptime(end, "%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be YYYY-MM")
+    rows = (await db.scalars(select(InvoiceRollupDB).where(
+        InvoiceRollupDB.period >= start, InvoiceRollupDB.period <= end, InvoiceRollupDB.period != ALL_PERIODS,
+        InvoiceRollupDB.patient_id == (patient_id if patient_id is not None else ALL_PATIENTS),
+    ).order_by(InvoiceRollupDB.period))).all()
+    periods = {}
+    for row in rows:
+        periods.setdefault(row.period, []).append(row)
+    return {"periods": [{"period": period, **summarize(period_rows)} for period, period_rows in periods.items()]}
+
+@app.post("/invoices/stats/rebuild")
+async def rebuild_billing_rollups(user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    """Recompute the rollup from invoices; the response lists rows that had drifted from the source."""
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can rebuild billing rollups")
+    return await rebuild_rollups(db)
 
 """
 if __name__ == "__main__":
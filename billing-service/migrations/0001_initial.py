@@ -0,0 +1,22 @@
+"""Baseline: the invoices table as created by create_all before migrations existed."""
+from sqlalchemy import Column, Date, DateTime, Float, Integer, MetaData, String, Table, Text
+
+metadata = MetaData()
+
+invoices = Table(
+    "invoices", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("patient_id", Integer, nullable=False),
+    Column("appointment_id", Integer, nullable=True),
+    Column("amount", Float, nullable=False),
+    Column("description", Text),
+    Column("status", String),
+    Column("invoice_date", Date, nullable=False),
+    Column("due_date", Date, nullable=False),
+    Column("paid_date", Date, nullable=True),
+    Column("created_at", DateTime),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn)
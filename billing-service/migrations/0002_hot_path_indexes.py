@@ -0,0 +1,17 @@
+"""Composite indexes for a patient's invoices, with and without a status filter.
+
+Both lists are ordered by invoice_date and then id (the keyset tiebreak),
+so those are the trailing columns.
+"""
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_invoices_patient_date "
+        "ON invoices (patient_id, invoice_date, id)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_invoices_patient_status_date "
+        "ON invoices (patient_id, status, invoice_date, id)"
+    ))
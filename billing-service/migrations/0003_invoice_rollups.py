@@ -0,0 +1,44 @@
+"""invoice_rollups: counts and amounts by month, patient and status, backfilled from invoices."""
+from sqlalchemy import Column, Date, Float, Integer, MetaData, String, Table, func, insert, select
+
+metadata = MetaData()
+
+invoices = Table(
+    "invoices", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("patient_id", Integer),
+    Column("amount", Float),
+    Column("status", String),
+    Column("invoice_date", Date),
+)
+
+invoice_rollups = Table(
+    "invoice_rollups", metadata,
+    Column("period", String, primary_key=True),
+    Column("patient_id", Integer, primary_key=True),
+    Column("status", String, primary_key=True),
+    Column("invoice_count", Integer, nullable=False),
+    Column("amount", Float, nullable=False),
+)
+
+
+def upgrade(conn):
+    invoice_rollups.create(conn, checkfirst=True)
+    year, month = func.extract("year", invoices.c.invoice_date), func.extract("month", invoices.c.invoice_date)
+    grouped = conn.execute(
+        select(year, month, invoices.c.patient_id, invoices.c.status,
+               func.count(invoices.c.id), func.sum(invoices.c.amount))
+        .group_by(year, month, invoices.c.patient_id, invoices.c.status)
+    ).all()
+    rollups = {}
+    for y, m, patient_id, status, count, amount in grouped:
+        period = f"{int(y):04d}-{int(m):02d}"
+        for key in ((period, patient_id, status), (period, 0, status), ("all", patient_id, status), ("all", 0, status)):
+            entry = rollups.setdefault(key, [0, 0.0])
+            entry[0] += count
+            entry[1] += amount or 0.0
+    if rollups:
+        conn.execute(insert(invoice_rollups), [
+            {"period": period, "patient_id": patient_id, "status": status, "invoice_count": count, "amount": amount}
+            for (period, patient_id, status), (count, amount) in rollups.items()
+        ])
@@ -0,0 +1,9 @@
+"""invoices.updated_at: last write time, a cheap validator for conditional GETs."""
+from sqlalchemy import inspect, text
+
+
+def upgrade(conn):
+    if "updated_at" in {c["name"] for c in inspect(conn).get_columns("invoices")}:
+        return
+    conn.execute(text("ALTER TABLE invoices ADD COLUMN updated_at TIMESTAMP"))
+    conn.execute(text("UPDATE invoices SET updated_at = created_at"))
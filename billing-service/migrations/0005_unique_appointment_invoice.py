@@ -0,0 +1,25 @@
+"""At most one invoice per appointment, enforced by a partial unique index.
+
+Duplicates already in the table can't be settled automatically (either
+invoice may have been paid), so they are listed and the migration stops.
+"""
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    duplicates = conn.execute(text(
+        "SELECT appointment_id, id FROM invoices WHERE appointment_id IN ("
+        "SELECT appointment_id FROM invoices WHERE appointment_id IS NOT NULL "
+        "GROUP BY appointment_id HAVING COUNT(*) > 1) ORDER BY appointment_id, id"
+    )).all()
+    if duplicates:
+        by_appointment = {}
+        for appointment_id, invoice_id in duplicates:
+            by_appointment.setdefault(appointment_id, []).append(str(invoice_id))
+        listed = "; ".join(f"appointment {a}: invoices {', '.join(ids)}" for a, ids in by_appointment.items())
+        raise RuntimeError(f"Appointments invoiced more than once ({listed}). "
+                           "Remove the extra invoices, then run the migration again.")
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_invoices_appointment "
+        "ON invoices (appointment_id) WHERE appointment_id IS NOT NULL"
+    ))
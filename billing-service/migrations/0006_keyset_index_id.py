@@ -0,0 +1,21 @@
+"""Add id to the invoice list indexes so the keyset ORDER BY is fully covered.
+
+Pages are ordered by invoice_date, then id, and continue with
+``WHERE (..., id) < cursor``. Indexes that 0002 built before it included
+id leave rows sharing a date to be sorted; those are rebuilt.
+"""
+from sqlalchemy import inspect, text
+
+INDEXES = {
+    "ix_invoices_patient_date": ["patient_id", "invoice_date", "id"],
+    "ix_invoices_patient_status_date": ["patient_id", "status", "invoice_date", "id"],
+}
+
+
+def upgrade(conn):
+    existing = {i["name"]: i["column_names"] for i in inspect(conn).get_indexes("invoices")}
+    for name, columns in INDEXES.items():
+        if existing.get(name) == columns:
+            continue
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        conn.execute(text(f"CREATE INDEX {name} ON invoices ({', '.join(columns)})"))
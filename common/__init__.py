@@ -0,0 +1,4 @@
+"""Helpers shared by the healthcare microservices.
+
+Services import from here with the repository root on ``PYTHONPATH``.
+"""
@@ -0,0 +1,136 @@
+"""Read-through cache with stale-while-revalidate and cross-replica invalidation.
+
+Entries are fresh for ``ttl`` seconds. After that they are still served for
+up to ``stale_ttl`` more while one background task reloads them, so readers
+never wait on a slow database for data the cache already has, and a failed
+reload just leaves the stale value in place. Only a key with no usable
+entry is loaded inline (concurrent misses share one load).
+
+Replicas share nothing in memory. Writers bump a version number in the
+database in the same transaction as their change (see ``bump_version``);
+each cache polls that version at most every ``sync_interval`` seconds, in
+the background, and clears itself when it moves. The writing replica
+clears its own cache immediately. Polling, rather than LISTEN/NOTIFY, keeps
+this working behind PgBouncer in transaction mode.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from sqlalchemy import Column, Integer, String, Table, select, update
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class ReadThroughCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0, stale_ttl: float = 300.0,
+                 version_loader=None, sync_interval: float = 1.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.version_loader = version_loader
+        self.sync_interval = sync_interval
+        self.hits = self.stale_hits = self.misses = 0
+        self._entries = OrderedDict()  # key -> (loaded_at, value)
+        self._loads = {}  # key -> Task, shared by concurrent misses and refreshes
+        self._generation = 0  # bumped by invalidate; loads started earlier aren't stored
+        self._version = None
+        self._synced_at = 0.0
+        self._syncing = None
+
+    async def get(self, key, loader):
+        """Cached value for ``key``, calling ``loader()`` (a coroutine function) to fill it."""
+        self._maybe_sync()
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = now - entry[0]
+            if age <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if age <= self.ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                self._load(key, loader)
+                return entry[1]
+        self.misses += 1
+        return await asyncio.shield(self._load(key, loader))
+
+    def _load(self, key, loader):
+        task = self._loads.get(key)
+        if task is None:
+            generation = self._generation
+            task = self._loads[key] = asyncio.ensure_future(loader())
+            task.add_done_callback(lambda t: self._loaded(key, t, generation))
+        return task
+
+    def _loaded(self, key, task, generation):
+        if self._loads.get(key) is task:
+            del self._loads[key]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            if key in self._entries:
+                logger.warning("Refreshing %r failed; serving stale entry: %s", key, task.exception())
+            return
+        # An invalidation while this load was in flight may mean it read old data.
+        if generation != self._generation:
+            return
+        self._entries[key] = (time.monotonic(), task.result())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key=_MISSING):
+        self._generation += 1
+        if key is _MISSING:
+            self._entries.clear()
+            self._loads.clear()
+        else:
+            self._entries.pop(key, None)
+            self._loads.pop(key, None)
+
+    def _maybe_sync(self):
+        if self.version_loader is None or self._syncing is not None:
+            return
+        if time.monotonic() - self._synced_at < self.sync_interval:
+            return
+        self._syncing = asyncio.ensure_future(self._sync())
+
+    async def _sync(self):
+        try:
+            version = await self.version_loader()
+            if self._version is not None and version != self._version:
+                self.invalidate()
+            self._version = version
+        except Exception as e:
+            logger.warning("Cache version check failed: %s", e)
+        finally:
+            self._synced_at = time.monotonic()
+            self._syncing = None
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits,
+                "stale_hits": self.stale_hits, "misses": self.misses, "version": self._version}
+
+
+def version_table(metadata, name: str = "cache_versions"):
+    """Table of named version counters, one row per cache scope."""
+    return Table(
+        name, metadata,
+        Column("scope", String, primary_key=True),
+        Column("version", Integer, nullable=False, default=0),
+    )
+
+
+async def read_version(db, table, scope: str) -> int:
+    return await db.scalar(select(table.c.version).where(table.c.scope == scope)) or 0
+
+
+async def bump_version(db, table, scope: str):
+    """Call inside the writing transaction so other replicas see the change and the bump together."""
+    await db.execute(update(table).where(table.c.scope == scope).values(version=table.c.version + 1))
@@ -0,0 +1,185 @@
+"""Database engine and session setup shared by the services.
+
+With ``DB_ASYNC=1`` (the default) the engine runs on asyncpg and ``get_db``
+yields an ``AsyncSession``, so one worker can have many queries in flight.
+With ``DB_ASYNC=0`` the psycopg2 engine is used and the session is wrapped in
+``SyncSessionAdapter``, which exposes the same awaitable API by running each
+call in the threadpool; routes are written once against that API.
+
+Pooling is configured from the environment (see ``pool_options_from_env``)
+and every pool records checkout wait times so ``Database.pool_stats`` can
+report them next to the checked-out/idle/overflow counts.
+"""
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from starlette.concurrency import run_in_threadpool
+
+from common.metrics import Histogram
+
+
+def env_flag(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.wait_seconds = Histogram()
+        self.checkouts = 0
+        self.timeouts = 0
+
+    def snapshot(self) -> dict:
+        return {"checkouts": self.checkouts, "timeouts": self.timeouts,
+                "wait_seconds": self.wait_seconds.snapshot()}
+
+
+class _TimedCheckout:
+    """Pool mixin timing how long callers wait for a connection."""
+
+    metrics = None
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            self.metrics.checkouts += 1
+            self.metrics.wait_seconds.observe(time.perf_counter() - start)
+
+
+def pool_options_from_env(use_async: bool, metrics: PoolMetrics) -> dict:
+    """Engine pool arguments for ``DB_POOL_MODE``.
+
+    ``queue`` (default) keeps a per-process pool sized by DB_POOL_SIZE and
+    DB_MAX_OVERFLOW. ``pgbouncer`` is for PgBouncer in transaction mode: no
+    client-side pool (PgBouncer is the pool) and no named prepared statements,
+    which can't survive being moved between server connections.
+    """
+    mode = os.getenv("DB_POOL_MODE", "queue").strip().lower()
+    if mode == "pgbouncer":
+        options = {"poolclass": type("TimedNullPool", (_TimedCheckout, NullPool), {"metrics": metrics})}
+        if use_async:
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            }
+        return options
+    if mode != "queue":
+        raise ValueError(f"Unknown DB_POOL_MODE: {mode}")
+    base = AsyncAdaptedQueuePool if use_async else QueuePool
+    return {
+        "poolclass": type(f"Timed{base.__name__}", (_TimedCheckout, base), {"metrics": metrics}),
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_pre_ping": env_flag("DB_POOL_PRE_PING", "1"),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+
+
+class SyncSessionAdapter:
+    """Awaitable facade over a sync ``Session`` with the ``AsyncSession`` call shapes we use."""
+
+    def __init__(self, session):
+        self.sync_session = session
+
+    def add(self, instance):
+        self.sync_session.add(instance)
+
+    def add_all(self, instances):
+        self.sync_session.add_all(instances)
+
+    async def execute(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.execute, statement, params, **kwargs)
+
+    async def scalar(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalar, statement, params, **kwargs)
+
+    async def scalars(self, statement, params=None, **kwargs):
+        return await run_in_threadpool(self.sync_session.scalars, statement, params, **kwargs)
+
+    async def get(self, entity, ident, **kwargs):
+        return await run_in_threadpool(self.sync_session.get, entity, ident, **kwargs)
+
+    async def delete(self, instance):
+        await run_in_threadpool(self.sync_session.delete, instance)
+
+    async def flush(self, objects=None):
+        await run_in_threadpool(self.sync_session.flush, objects)
+
+    async def refresh(self, instance, attribute_names=None):
+        await run_in_threadpool(self.sync_session.refresh, instance, attribute_names)
+
+    async def commit(self):
+        await run_in_threadpool(self.sync_session.commit)
+
+    async def rollback(self):
+        await run_in_threadpool(self.sync_session.rollback)
+
+    async def close(self):
+        await run_in_threadpool(self.sync_session.close)
+
+
+class Database:
+    def __init__(self, url: str, use_async: bool = True, pool_metrics: PoolMetrics = None, **engine_kwargs):
+        self.use_async = use_async
+        self.pool_metrics = pool_metrics or PoolMetrics()
+        if use_async:
+            self.engine = create_async_engine(url, **engine_kwargs)
+            self.sync_engine = self.engine.sync_engine
+            self.session_factory = async_sessionmaker(self.engine, expire_on_commit=False, autoflush=False)
+        else:
+            self.engine = create_engine(url, **engine_kwargs)
+            self.sync_engine = self.engine
+            self.session_factory = sessionmaker(bind=self.engine, expire_on_commit=False,
+                                                autoflush=False, autocommit=False)
+
+    @classmethod
+    def from_env(cls, **engine_kwargs):
+        use_async = env_flag("DB_ASYNC", "1")
+        driver = "postgresql+asyncpg" if use_async else "postgresql+psycopg2"
+        url = (
+            f"{driver}://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+            f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME')}"
+        )
+        metrics = PoolMetrics()
+        options = pool_options_from_env(use_async, metrics)
+        options.update(engine_kwargs)
+        return cls(url, use_async=use_async, pool_metrics=metrics, **options)
+
+    def pool_stats(self) -> dict:
+        pool = self.sync_engine.pool
+        stats = {"pool": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            stats.update({
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                # QueuePool counts overflow from -size; only connections beyond size are overflow.
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow,
+            })
+        stats.update(self.pool_metrics.snapshot())
+        return stats
+
+    @asynccontextmanager
+    async def session(self):
+        if self.use_async:
+            async with self.session_factory() as db:
+                yield db
+        else:
+            db = SyncSessionAdapter(self.session_factory())
+            try:
+                yield db
+            finally:
+                await db.close()
@@ -0,0 +1,82 @@
+"""Strong ETags and ``If-None-Match`` handling for GET endpoints.
+
+``ETagMiddleware`` covers every GET: a buffered 200 response without an
+ETag gets one hashed from its body, and if the request's If-None-Match
+matches, the client gets an empty 304 instead. Streaming responses
+(exports) pass through untouched.
+
+Hashing still runs the query and serializes the result, so the hot
+endpoints call ``check_etag`` first with cheap validators (row count and
+max(updated_at) for the rows the endpoint would return). A match raises a
+304 before the real query runs; otherwise the validator ETag is set on the
+response and the middleware leaves it alone.
+"""
+import hashlib
+
+from fastapi import HTTPException, Request, Response
+from starlette.datastructures import Headers, MutableHeaders
+
+
+def make_etag(*parts) -> str:
+    return '"' + hashlib.sha256(repr(parts).encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison: W/"x" matches "x".
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def check_etag(request: Request, response: Response, *validators):
+    """Raise 304 if the client's copy is current, else set the ETag for the response."""
+    etag = make_etag(request.url.path, request.url.query, *validators)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        raise HTTPException(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+
+
+class ETagMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        start = None
+        passthrough = False
+
+        async def send_with_etag(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+            if message.get("more_body", False) or start["status"] != 200:
+                # Streaming or non-200: nothing to tag.
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+            headers = MutableHeaders(scope=start)
+            etag = headers.get("etag")
+            if etag is None:
+                etag = headers["ETag"] = make_etag(message.get("body", b""))
+            if etag_matches(if_none_match, etag):
+                not_modified = [(k, v) for k, v in start["headers"]
+                                if k.lower() not in (b"content-length", b"content-type", b"content-encoding")]
+                await send({"type": "http.response.start", "status": 304, "headers": not_modified})
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
@@ -0,0 +1,121 @@
+"""``expand=`` support: embed related objects from other services in list responses.
+
+Appointments and records carry bare ``doctor_id``/``patient_id`` values. With
+``?expand=doctor,patient`` the route collects the ids on the page and each
+``BatchLookup`` resolves them with one call to the owning service's batch
+endpoint (``/doctors?ids=``, ``/patients?user_ids=``), so a page costs at
+most one request per expanded field instead of one per row, and none when
+the ids are cached.
+"""
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+from typing import Optional
+
+from fastapi import HTTPException
+
+
+class BatchLookup:
+    """Objects by id from a batch endpoint, cached for ``ttl`` seconds.
+
+    Ids the service doesn't return are cached as missing too. If the service
+    is unreachable, cached entries are served past their TTL rather than
+    failing the request.
+
+    For endpoints that answer differently depending on who asks (patients
+    only get their own profile), pass ``per_caller=True``: entries are then
+    kept per caller, and ids left out of a response aren't cached, since a
+    narrowed response can't tell a missing object from a hidden one.
+    """
+
+    def __init__(self, client, path: str, param: str = "ids", key: str = "id", ttl: float = 60.0,
+                 fetch_size: int = 200, maxsize: int = 10000, per_caller: bool = False):
+        self.client = client
+        self.path = path
+        self.param = param
+        self.key = key
+        self.ttl = ttl
+        self.fetch_size = fetch_size
+        self.maxsize = maxsize
+        self.per_caller = per_caller
+        self._entries = OrderedDict()  # id, or (caller, id) with per_caller -> (fetched_at, object or None)
+
+    async def get_many(self, ids, headers: dict = None, caller=None) -> dict:
+        now = monotonic()
+        ids = set(ids)
+        entry_key = (lambda i: (caller, i)) if self.per_caller else (lambda i: i)
+        missing = sorted(i for i in ids
+                         if entry_key(i) not in self._entries or now - self._entries[entry_key(i)][0] > self.ttl)
+        for chunk_start in range(0, len(missing), self.fetch_size):
+            chunk = missing[chunk_start:chunk_start + self.fetch_size]
+            try:
+                response = await self.client.aget(
+                    self.path, params={self.param: ",".join(map(str, chunk))}, headers=headers)
+            except HTTPException:
+                if any(entry_key(i) not in self._entries for i in chunk):
+                    raise
+                continue
+            if response.status_code in (401, 403):
+                raise HTTPException(status_code=response.status_code,
+                                    detail=f"Not authorized to read {self.client.name}")
+            if response.status_code != 200:
+                if any(entry_key(i) not in self._entries for i in chunk):
+                    raise HTTPException(status_code=503, detail=f"{self.client.name} unavailable")
+                continue
+            found = {obj[self.key]: obj for obj in response.json()}
+            for i in chunk:
+                if i in found or not self.per_caller:
+                    self._entries[entry_key(i)] = (now, found.get(i))
+                    self._entries.move_to_end(entry_key(i))
+                else:
+                    self._entries.pop(entry_key(i), None)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return {i: self._entries[entry_key(i)][1] for i in ids if entry_key(i) in self._entries}
+
+
+def parse_ids(value: str, name: str = "ids", limit: int = 200) -> list:
+    """Sorted unique ints from a comma-separated query parameter."""
+    try:
+        ids = sorted({int(i) for i in value.split(",") if i.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be comma-separated integers")
+    if len(ids) > limit:
+        raise HTTPException(status_code=400, detail=f"At most {limit} {name} per request")
+    return ids
+
+
+def parse_expand(expand: Optional[str], allowed) -> list:
+    fields = sorted({f.strip() for f in expand.split(",") if f.strip()}) if expand else []
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot expand {', '.join(unknown)}; "
+                                                    f"expandable: {', '.join(sorted(allowed))}")
+    return fields
+
+
+async def expand_items(items: list, fields, lookups: dict, headers: dict = None, caller=None):
+    """Set ``item[field]`` from ``item[field + "_id"]`` for each field, fetching all fields concurrently."""
+    async def fill(field):
+        found = await lookups[field].get_many({item[f"{field}_id"] for item in items}, headers=headers,
+                                              caller=caller)
+        for item in items:
+            item[field] = found.get(item[f"{field}_id"])
+
+    if items:
+        await asyncio.gather(*(fill(field) for field in fields))
+
+
+def expander(expand: Optional[str], lookups: dict, authorization: Optional[str] = None, user: dict = None):
+    """The ``expand=`` hook for ``paginate_rows``, or None when nothing is expanded.
+
+    The caller's ``Authorization`` header is forwarded so the other service
+    applies its own access rules; ``user`` (the verified claims) keys the
+    ``per_caller`` caches.
+    """
+    fields = parse_expand(expand, lookups)
+    if not fields:
+        return None
+    headers = {"Authorization": authorization} if authorization else None
+    caller = (user["role"], user["user_id"]) if user else None
+    return lambda items: expand_items(items, fields, lookups, headers=headers, caller=caller)
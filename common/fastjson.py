@@ -0,0 +1,60 @@
+"""Fast path from Core result rows to a JSON response.
+
+List endpoints that only need columns select them with Core and hand the
+rows here, skipping ORM identity-map work, per-row pydantic validation and
+``jsonable_encoder``. The output matches what the endpoint's
+``response_model`` would produce for those columns (ISO dates and times),
+so the declared model still documents the shape.
+
+orjson is used when installed; the stdlib encoder is the fallback.
+"""
+import json
+from datetime import date, time
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def columns_for(model, response_model) -> list:
+    """The model's columns that ``response_model`` exposes, in field order."""
+    return [getattr(model, field) for field in response_model.model_fields]
+
+
+def row_dicts(rows) -> list:
+    fields = rows[0]._fields if rows else ()
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def json_response(content, response: Response = None) -> FastJSONResponse:
+    """``content`` as JSON, carrying over headers set on the route's ``response``."""
+    headers = None
+    if response is not None:
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    return FastJSONResponse(content, headers=headers)
+
+
+def rows_response(rows, response: Response = None) -> FastJSONResponse:
+    """Serialize Core rows as a JSON list."""
+    return json_response(row_dicts(rows), response)
@@ -0,0 +1,324 @@
+"""Pooled, timeout-bounded HTTP client for service-to-service calls.
+
+One ``ServiceClient`` per destination (``get_client(base_url)``) keeps a
+keep-alive connection pool, caps how many calls may be in flight to that
+destination, retries idempotent requests with jittered backoff and trips a
+circuit breaker when the destination keeps failing, so callers fail fast
+with a 503 instead of tying up worker threads.
+
+Both a blocking (``get``) and an asyncio (``aget``) interface are provided;
+they share the breaker and the concurrency budget settings. Each call's
+latency is recorded per destination for ``/metrics``, and calls carry the
+current trace's ``traceparent`` (``common/tracing.py``).
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+import httpx
+from fastapi import HTTPException
+
+from common.metrics import REGISTRY
+from common.tracing import TRACER, inject
+
+RETRY_STATUSES = {502, 503, 504}
+
+CALL_DURATION = REGISTRY.histogram(
+    "http_client_request_duration_seconds",
+    "Outbound service calls, including retries and waiting for a concurrency slot",
+    ("target", "method", "status"))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Closed -> open after ``failure_threshold`` consecutive failures.
+
+    While open every call is rejected until ``reset_timeout`` has passed; then
+    one trial call is let through (half-open) and its outcome closes or
+    re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpenError if the call must not go out; True if it is the half-open trial."""
+        with self._lock:
+            if self.state == "closed":
+                return False
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half-open"
+                self._trial_in_flight = False
+            if self.state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            raise CircuitOpenError()
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def abandon_trial(self):
+        """The trial ended without an outcome (cancelled, no free slot): let the next call be the trial."""
+        with self._lock:
+            if self.state == "half-open":
+                self._trial_in_flight = False
+
+
+class ServiceClient:
+    def __init__(self, base_url: str, name: str = None, timeout: float = 3.0, connect_timeout: float = 1.0,
+                 retries: int = 2, backoff: float = 0.1, max_connections: int = 20,
+                 max_concurrency: int = 20, breaker: CircuitBreaker = None):
+        self.base_url = base_url.rstrip("/")
+        self.name = name or self.base_url
+        self.retries = retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker or CircuitBreaker()
+        self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        # Both created on first use, and again after close().
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._async_client = None
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots = None
+
+    def _unavailable(self):
+        return HTTPException(status_code=503, detail=f"{self.name} unavailable")
+
+    def _delay(self, attempt: int) -> float:
+        # Full jitter: spreads retries from many workers over the window.
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def _should_retry(self, method: str, attempt: int, delay: float = 0.0, ends_at: float = None) -> bool:
+        if ends_at is not None and time.monotonic() + delay >= ends_at:
+            return False
+        return method in ("GET", "HEAD") and attempt < self.retries
+
+    def _time_left(self, ends_at: float, timeout: float = None) -> float:
+        """The next attempt's timeout under a deadline; 503 when nothing is left."""
+        left = ends_at - time.monotonic()
+        if left <= 0:
+            raise self._unavailable()
+        return min(left, timeout or self._timeout.read or left)
+
+    def _start(self, method: str, path: str, kwargs: dict):
+        span = TRACER.start_span(f"{method} {self.name}", "client",
+                                 {"http.method": method, "http.url": self.base_url + path, "peer.service": self.name})
+        kwargs["headers"] = inject(kwargs.get("headers"), span)
+        return time.perf_counter(), span
+
+    def _observe(self, method: str, status, start: float, span):
+        CALL_DURATION.labels(self.name, method, status).observe(time.perf_counter() - start)
+        if span is not None:
+            span.attributes["http.status_code"] = status
+            TRACER.end(span, error=status == "error" or status >= 500)
+
+    def request(self, method: str, path: str, timeout: float = None, deadline: float = None,
+                **kwargs) -> httpx.Response:
+        """``timeout`` bounds each attempt; ``deadline`` bounds the whole call in seconds.
+
+        Within a deadline, slot waits, attempts and backoff share the budget:
+        each attempt's timeout is cut to what is left and no retry starts that
+        couldn't finish. Running out gives the usual 503.
+        """
+        start, span = self._start(method, path, kwargs)
+        status = "error"
+        try:
+            response = self._request(method, path, timeout, deadline, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            self._observe(method, status, start, span)
+
+    def _request(self, method: str, path: str, timeout: float = None, deadline: float = None,
+                 **kwargs) -> httpx.Response:
+        try:
+            trial = self.breaker.before_call()
+        except CircuitOpenError:
+            raise self._unavailable()
+        try:
+            return self._attempts(method, path, timeout, deadline, **kwargs)
+        except BaseException:
+            if trial:
+                # Ended without recording an outcome, e.g. no free slot: don't leave the trial pending.
+                self.breaker.abandon_trial()
+            raise
+
+    def _attempts(self, method: str, path: str, timeout: float = None, deadline: float = None,
+                  **kwargs) -> httpx.Response:
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        ends_at = None if deadline is None else time.monotonic() + deadline
+        attempt = 0
+        while True:
+            slot_timeout = self._timeout.read or None
+            if ends_at is not None:
+                kwargs["timeout"] = slot_timeout = self._time_left(ends_at, timeout)
+            # Waiting for a slot counts against the call's budget too.
+            if not self._slots.acquire(timeout=slot_timeout):
+                raise self._unavailable()
+            try:
+                response = self._sync_client().request(method, path, **kwargs)
+            except httpx.TransportError:
+                response = None
+            finally:
+                self._slots.release()
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                self.breaker.record_success()
+                return response
+            delay = self._delay(attempt)
+            if not self._should_retry(method, attempt, delay, ends_at):
+                self.breaker.record_failure()
+                if response is None:
+                    raise self._unavailable()
+                return response
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, path: str, **kwargs) -> httpx.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> httpx.Response:
+        return self.request("POST", path, **kwargs)
+
+    async def arequest(self, method: str, path: str, timeout: float = None, deadline: float = None,
+                       **kwargs) -> httpx.Response:
+        """As ``request``; prefer ``deadline`` to wrapping this in ``asyncio.wait_for``, which cancels mid-call."""
+        start, span = self._start(method, path, kwargs)
+        status = "error"
+        try:
+            response = await self._arequest(method, path, timeout, deadline, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            self._observe(method, status, start, span)
+
+    async def _arequest(self, method: str, path: str, timeout: float = None, deadline: float = None,
+                        **kwargs) -> httpx.Response:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(base_url=self.base_url, timeout=self._timeout, limits=self._limits)
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        try:
+            trial = self.breaker.before_call()
+        except CircuitOpenError:
+            raise self._unavailable()
+        try:
+            return await self._aattempts(method, path, timeout, deadline, **kwargs)
+        except BaseException:
+            if trial:
+                # Ended without recording an outcome, e.g. cancelled by the caller's timeout.
+                self.breaker.abandon_trial()
+            raise
+
+    async def _aattempts(self, method: str, path: str, timeout: float = None, deadline: float = None,
+                         **kwargs) -> httpx.Response:
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        ends_at = None if deadline is None else time.monotonic() + deadline
+        attempt = 0
+        while True:
+            if ends_at is None:
+                await self._async_slots.acquire()
+            else:
+                kwargs["timeout"] = self._time_left(ends_at, timeout)
+                try:
+                    # Only the wait for a slot is cancelled here, never a request in flight.
+                    await asyncio.wait_for(self._async_slots.acquire(), kwargs["timeout"])
+                except asyncio.TimeoutError:
+                    raise self._unavailable()
+            try:
+                response = await self._async_client.request(method, path, **kwargs)
+            except httpx.TransportError:
+                response = None
+            finally:
+                self._async_slots.release()
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                self.breaker.record_success()
+                return response
+            delay = self._delay(attempt)
+            if not self._should_retry(method, attempt, delay, ends_at):
+                self.breaker.record_failure()
+                if response is None:
+                    raise self._unavailable()
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aget(self, path: str, **kwargs) -> httpx.Response:
+        return await self.arequest("GET", path, **kwargs)
+
+    async def apost(self, path: str, **kwargs) -> httpx.Response:
+        return await self.arequest("POST", path, **kwargs)
+
+    def _sync_client(self) -> httpx.Client:
+        with self._client_lock:
+            if self._client is None:
+                self._client = httpx.Client(base_url=self.base_url, timeout=self._timeout, limits=self._limits)
+            return self._client
+
+    async def close(self):
+        """Close both connection pools; a later call opens new ones."""
+        with self._client_lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+        async_client, self._async_client = self._async_client, None
+        if async_client is not None:
+            await async_client.aclose()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+async def close_clients():
+    """Close every client's connections; call from the service's shutdown handler."""
+    with _clients_lock:
+        clients = list(_clients.values())
+    for client in clients:
+        await client.close()
+
+
+def get_client(base_url: str, name: str = None) -> ServiceClient:
+    """Return the process-wide client for ``base_url``, configured from the environment."""
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = ServiceClient(
+                base_url,
+                name=name,
+                timeout=float(os.getenv("HTTP_TIMEOUT", "3")),
+                connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "1")),
+                retries=int(os.getenv("HTTP_RETRIES", "2")),
+                backoff=float(os.getenv("HTTP_RETRY_BACKOFF", "0.1")),
+                max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "20")),
+                max_concurrency=int(os.getenv("HTTP_MAX_CONCURRENCY", "20")),
+                breaker=CircuitBreaker(
+                    failure_threshold=int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5")),
+                    reset_timeout=float(os.getenv("BREAKER_RESET_TIMEOUT", "30")),
+                ),
+            )
+        return client
@@ -0,0 +1,137 @@
+"""Runtime metrics for a service, served in the Prometheus text format at ``/metrics``.
+
+``instrument(app, database)`` sets up:
+
+- ``http_requests_total`` and ``http_request_duration_seconds`` by route
+  template (``/appointments/{appointment_id}``, never the raw path), method
+  and status, plus ``http_requests_in_flight``
+- ``db_query_duration_seconds`` by statement verb, from SQLAlchemy's
+  cursor-execute events, and ``db_query_errors_total``
+- the DB pool (checked out, overflow, checkout waits and timeouts) and the
+  worker threadpool that sync routes and ``DB_ASYNC=0`` sessions run on
+  (busy, total, waiting), read at scrape time
+
+Outbound service calls, including those to auth-service, are timed in
+``common/http.py``. Recording is a dict lookup and a locked increment per
+request or query; ``scripts/bench_metrics_overhead.py`` measures the cost.
+"""
+import time
+
+from anyio import to_thread
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+
+from common.metrics import REGISTRY
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+REQUESTS = REGISTRY.counter("http_requests_total", "HTTP requests", ("route", "method", "status"))
+REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency, to the end of the response body",
+    ("route", "method", "status"))
+IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "HTTP requests being handled")
+
+QUERY_DURATION = REGISTRY.histogram("db_query_duration_seconds", "SQL statement execution time", ("verb",))
+QUERY_ERRORS = REGISTRY.counter("db_query_errors_total", "SQL statements that raised", ("verb",))
+POOL_CHECKED_OUT = REGISTRY.gauge("db_pool_checked_out", "Connections checked out of the pool")
+POOL_OVERFLOW = REGISTRY.gauge("db_pool_overflow", "Connections open beyond the pool size")
+POOL_WAIT = REGISTRY.histogram("db_pool_wait_seconds", "Time spent waiting to check out a connection")
+POOL_TIMEOUTS = REGISTRY.counter("db_pool_timeouts_total", "Checkouts that gave up waiting for a connection")
+
+THREADS_BUSY = REGISTRY.gauge("threadpool_threads_busy", "Worker threads running sync code")
+THREADS_TOTAL = REGISTRY.gauge("threadpool_threads_total", "Worker thread limit")
+THREADS_WAITING = REGISTRY.gauge("threadpool_tasks_waiting", "Tasks queued for a worker thread")
+
+VERBS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "BEGIN", "COMMIT", "ROLLBACK"}
+
+
+def route_label(scope, status: int) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope:
+        # Mounted apps (the static frontend) are labelled by their mount point.
+        return scope.get("root_path") or "/"
+    return "unmatched" if status == 404 else "other"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            IN_FLIGHT.dec()
+            labels = (route_label(scope, status), scope["method"], status)
+            REQUESTS.labels(*labels).inc()
+            REQUEST_DURATION.labels(*labels).observe(time.perf_counter() - start)
+
+
+def statement_verb(statement: str) -> str:
+    verb = statement.lstrip()[:8].split(None, 1)[0].upper() if statement.strip() else ""
+    return verb if verb in VERBS else "OTHER"
+
+
+# statement text -> its verb's histogram; statements come from a fixed set of queries
+_statement_histograms = {}
+
+
+def _histogram_for(statement: str):
+    histogram = _statement_histograms.get(statement)
+    if histogram is None:
+        if len(_statement_histograms) > 10000:
+            _statement_histograms.clear()
+        histogram = _statement_histograms[statement] = QUERY_DURATION.labels(statement_verb(statement))
+    return histogram
+
+
+def instrument_engine(sync_engine):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        _histogram_for(statement).observe(time.perf_counter() - context._query_start)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        QUERY_ERRORS.labels(statement_verb(context.statement or "")).inc()
+
+
+def instrument(app, database):
+    """Record request, DB and threadpool metrics for ``app`` and serve them at /metrics."""
+    app.add_middleware(MetricsMiddleware)
+    instrument_engine(database.sync_engine)
+    POOL_WAIT.attach(database.pool_metrics.wait_seconds)
+
+    @REGISTRY.collector
+    def collect_pool():
+        stats = database.pool_stats()
+        POOL_CHECKED_OUT.set(stats.get("checked_out", 0))
+        POOL_OVERFLOW.set(stats.get("overflow", 0))
+        POOL_TIMEOUTS.set(stats["timeouts"])
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        # The default limiter is per event loop, so read it here rather than in a collector.
+        limiter = to_thread.current_default_thread_limiter().statistics()
+        THREADS_BUSY.set(limiter.borrowed_tokens)
+        THREADS_TOTAL.set(limiter.total_tokens)
+        THREADS_WAITING.set(limiter.tasks_waiting)
+        return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
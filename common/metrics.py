@@ -0,0 +1,166 @@
+"""Small in-process metric primitives used by the shared helpers.
+
+``Histogram`` is used on its own (pool wait times) and, with ``Counter`` and
+``Gauge``, inside labelled families registered on a ``Registry``, which
+renders everything in the Prometheus text format for ``/metrics``.
+"""
+import bisect
+import threading
+
+# Seconds; tuned for request/query latencies from ~1ms up to a few seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram; ``observe`` is O(log buckets) and lock-protected."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative, running = {}, 0
+        for bound, n in zip(self.buckets, counts):
+            running += n
+            cumulative[str(bound)] = running
+        cumulative["+Inf"] = count
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+    def samples(self, name: str, labels: str):
+        snapshot = self.snapshot()
+        sep = "," if labels else ""
+        for bound, n in snapshot["buckets"].items():
+            yield f'{name}_bucket{{{labels}{sep}le="{bound}"}} {n}'
+        yield f"{name}_sum{_braces(labels)} {snapshot['sum']}"
+        yield f"{name}_count{_braces(labels)} {snapshot['count']}"
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float):
+        """For mirroring a count kept elsewhere, at scrape time."""
+        self.value = value
+
+    def samples(self, name: str, labels: str):
+        yield f"{name}{_braces(labels)} {self.value}"
+
+
+class Gauge(Counter):
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+
+def _braces(labels: str) -> str:
+    return f"{{{labels}}}" if labels else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Family:
+    """One metric name with a child per combination of label values."""
+
+    def __init__(self, kind: str, name: str, help: str, labelnames=(), factory=None):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self.factory())
+        return child
+
+    def attach(self, child, *values):
+        """Report an existing metric object (e.g. a pool's Histogram) under these label values."""
+        with self._lock:
+            self._children[values] = child
+        if not values:
+            self._default = child
+
+    # Unlabelled families forward to their single child.
+    def inc(self, amount: float = 1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default.dec(amount)
+
+    def set(self, value: float):
+        self._default.set(value)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            children = sorted(self._children.items(), key=lambda item: tuple(map(str, item[0])))
+        for values, child in children:
+            labels = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, values))
+            yield from child.samples(self.name, labels)
+
+
+class Registry:
+    def __init__(self):
+        self._families = {}
+        self._collectors = []
+
+    def _family(self, kind, name, help, labelnames, factory):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = Family(kind, name, help, labelnames, factory)
+        return family
+
+    def counter(self, name: str, help: str, labelnames=()) -> Family:
+        return self._family("counter", name, help, labelnames, Counter)
+
+    def gauge(self, name: str, help: str, labelnames=()) -> Family:
+        return self._family("gauge", name, help, labelnames, Gauge)
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Family:
+        return self._family("histogram", name, help, labelnames, lambda: Histogram(buckets))
+
+    def collector(self, fn):
+        """Register ``fn()``, called at each scrape to refresh gauges that are cheaper to read than to track."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            collect()
+        lines = []
+        for family in self._families.values():
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
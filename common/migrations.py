@@ -0,0 +1,103 @@
+"""Versioned schema migrations, one sequence per service.
+
+Each service keeps numbered scripts in its ``migrations/`` directory
+(``0001_initial.py``, ``0002_hot_path_indexes.py``, ...). A script defines
+``upgrade(conn)``, which receives a SQLAlchemy ``Connection`` inside the
+migration transaction. Applied versions are recorded per service in the
+shared ``schema_migrations`` table; on Postgres an advisory lock keeps two
+replicas starting together from racing.
+
+Run on startup (``DB_MIGRATE_ON_STARTUP=1``, the default) or as a job:
+
+    PYTHONPATH=. python -m common.migrations appointment-service
+"""
+import asyncio
+import importlib.util
+import os
+import re
+import sys
+import zlib
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, insert, select, text
+from starlette.concurrency import run_in_threadpool
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _metadata,
+    Column("service", String, primary_key=True),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, server_default=func.now()),
+)
+
+FILENAME = re.compile(r"^(\d+)_(\w+)\.py$")
+
+
+def load_migrations(directory: str):
+    """Return ``(version, name, module)`` for each script, in version order."""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        match = FILENAME.match(filename)
+        if not match:
+            continue
+        spec = importlib.util.spec_from_file_location(f"_migration_{match.group(2)}", os.path.join(directory, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        migrations.append((int(match.group(1)), match.group(2), module))
+    versions = [v for v, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+def _advisory_lock(conn, name: str):
+    """Held until the transaction ends; a no-op outside Postgres."""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": zlib.crc32(name.encode())})
+
+
+def create_schema_migrations(conn):
+    # Every service shares this table, so its creation is serialized across services,
+    # in a transaction of its own so no service holds that lock through its migrations.
+    _advisory_lock(conn, "schema_migrations")
+    schema_migrations.create(conn, checkfirst=True)
+
+
+def apply_migrations(conn, service: str, migrations) -> list:
+    # Lock before reading what is applied, so a second replica waits and then sees our rows.
+    _advisory_lock(conn, service)
+    applied = set(conn.scalars(select(schema_migrations.c.version).where(schema_migrations.c.service == service)))
+    newly_applied = []
+    for version, name, module in migrations:
+        if version in applied:
+            continue
+        module.upgrade(conn)
+        conn.execute(insert(schema_migrations).values(service=service, version=version, name=name))
+        newly_applied.append(f"{version:04d}_{name}")
+    return newly_applied
+
+
+async def run_migrations(database, service: str, directory: str) -> list:
+    """Apply pending migrations in one transaction; returns the names applied."""
+    migrations = load_migrations(directory)
+    if database.use_async:
+        async with database.engine.begin() as conn:
+            await conn.run_sync(create_schema_migrations)
+        async with database.engine.begin() as conn:
+            return await conn.run_sync(apply_migrations, service, migrations)
+
+    def run():
+        with database.engine.begin() as conn:
+            create_schema_migrations(conn)
+        with database.engine.begin() as conn:
+            return apply_migrations(conn, service, migrations)
+    return await run_in_threadpool(run)
+
+
+if __name__ == "__main__":
+    from common.db import Database
+
+    service_dir = sys.argv[1].rstrip("/")
+    service = os.path.basename(service_dir).removesuffix("-service")
+    applied = asyncio.run(run_migrations(Database.from_env(), service, os.path.join(service_dir, "migrations")))
+    print(f"{service}: applied {applied or 'nothing'}")
@@ -0,0 +1,106 @@
+"""Keyset (cursor) pagination for list endpoints.
+
+A page is requested with ``?limit=`` (capped at ``MAX_PAGE_SIZE``) and the
+opaque ``?cursor=`` returned by the previous page. The body stays a plain
+list so existing clients keep working; the cursor for the next page, if
+there is one, is sent in the ``X-Next-Cursor`` header.
+
+The cursor holds the sort-key values of the last row served, and the next
+page is ``WHERE (keys) < (cursor)`` (or ``>`` when ascending), which is an
+index range scan however deep the client pages. Sort keys must end in a
+unique column so rows sharing a date are neither skipped nor repeated.
+
+``?all=true`` returns the full unpaginated list for callers that really
+need it.
+"""
+import base64
+import json
+import os
+from datetime import date, datetime, time
+from typing import Optional
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import tuple_
+
+from common.fastjson import json_response, row_dicts
+
+DEFAULT_PAGE_SIZE = int(os.getenv("PAGE_SIZE_DEFAULT", "50"))
+MAX_PAGE_SIZE = int(os.getenv("PAGE_SIZE_MAX", "200"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class PageParams:
+    """Query parameters shared by every paginated endpoint (use as a dependency)."""
+
+    def __init__(self, limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                 cursor: Optional[str] = None,
+                 all: bool = Query(False, description="Return every row, unpaginated")):
+        self.limit = limit
+        self.cursor = cursor
+        self.all = all
+
+
+def encode_cursor(values) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, (date, time)) else v for v in values],
+                     separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, keys) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError(cursor)
+        decoded = []
+        for key, value in zip(keys, values):
+            python_type = key.type.python_type
+            if python_type in (date, time, datetime):
+                decoded.append(python_type.fromisoformat(value))
+            else:
+                decoded.append(python_type(value))
+        return decoded
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _page_query(query, keys, page: PageParams, descending: bool):
+    query = query.order_by(*(key.desc() if descending else key.asc() for key in keys))
+    if page.all:
+        return query
+    if page.cursor:
+        after = tuple_(*keys)
+        values = tuple_(*decode_cursor(page.cursor, keys))
+        query = query.where(after < values if descending else after > values)
+    return query.limit(page.limit + 1)
+
+
+def _trim_page(rows, keys, page: PageParams, response: Response):
+    if not page.all and len(rows) > page.limit:
+        rows = rows[:page.limit]
+        last = rows[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([getattr(last, key.key) for key in keys])
+    return rows
+
+
+async def paginate(db, query, keys, page: PageParams, response: Response, descending: bool = True) -> list:
+    """Run ``query`` ordered by ``keys`` and return one page of ORM objects.
+
+    ``keys`` are model attributes, the last of which must be unique (normally
+    the primary key).
+    """
+    rows = (await db.scalars(_page_query(query, keys, page, descending))).all()
+    return _trim_page(rows, keys, page, response)
+
+
+async def paginate_rows(db, query, keys, page: PageParams, response: Response, descending: bool = True,
+                        expand=None):
+    """``paginate`` for a Core select of columns, returned as a ready JSON response.
+
+    The select must include every key column. ``expand``, if given, is awaited
+    with the page's row dicts to add fields before serialization.
+    """
+    rows = (await db.execute(_page_query(query, keys, page, descending))).all()
+    items = row_dicts(_trim_page(rows, keys, page, response))
+    if expand is not None:
+        await expand(items)
+    return json_response(items, response)
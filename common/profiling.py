@@ -0,0 +1,179 @@
+"""Per-request SQL profiling, switchable at runtime.
+
+While enabled, every statement a request runs is recorded against that
+request (a context variable follows it into SQLAlchemy's greenlets and the
+sync-mode threadpool) and the response gets:
+
+- ``X-DB-Query-Count`` and ``X-DB-Time-Ms``
+- ``X-DB-Repeated-Statements``: how many statements ran at least
+  ``n_plus_one`` times with the same text, the usual sign of an N+1 loop;
+  each one is also logged with its count
+
+Statements slower than ``slow_ms`` are logged with the shape of their
+parameters (names and types, never values, since they can hold patient
+data).
+
+When disabled, the engine listeners are removed and the middleware is a
+single attribute check, so it costs nothing. Start enabled with
+``SQL_PROFILE=1``; ``PUT /debug/sql-profile`` (admins) switches it on the
+replica that receives the call.
+"""
+import contextvars
+import logging
+import os
+import re
+import time
+from collections import Counter
+from typing import Optional
+
+from fastapi import Depends, HTTPException
+from pydantic import BaseModel
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+from common.db import env_flag
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("sql_profile", default=None)
+
+# Expanded IN lists vary in length per call; collapse them so the template repeats.
+_IN_LIST = re.compile(r"IN \([^()]*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_template(statement: str) -> str:
+    return _IN_LIST.sub("IN (...)", _WHITESPACE.sub(" ", statement).strip())
+
+
+def parameter_shape(parameters, executemany: bool = False):
+    if executemany:
+        return f"{len(parameters)} x {parameter_shape(parameters[0]) if parameters else '()'}"
+    if isinstance(parameters, dict):
+        return {k: type(v).__name__ for k, v in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(v).__name__ for v in parameters]
+    return type(parameters).__name__
+
+
+class RequestProfile:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.templates = Counter()
+
+
+class SQLProfiler:
+    def __init__(self, sync_engine, slow_ms: float = 100.0, n_plus_one: int = 3):
+        self.sync_engine = sync_engine
+        self.slow_ms = slow_ms
+        self.n_plus_one = n_plus_one
+        self.enabled = False
+
+    def enable(self):
+        if not self.enabled:
+            event.listen(self.sync_engine, "before_cursor_execute", self._before)
+            event.listen(self.sync_engine, "after_cursor_execute", self._after)
+            self.enabled = True
+
+    def disable(self):
+        if self.enabled:
+            event.remove(self.sync_engine, "before_cursor_execute", self._before)
+            event.remove(self.sync_engine, "after_cursor_execute", self._after)
+            self.enabled = False
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        context._profile_start = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_profile_start", None)
+        if start is None:
+            # Enabled while this statement was running.
+            return
+        elapsed = time.perf_counter() - start
+        profile = _current.get()
+        if profile is not None:
+            profile.count += 1
+            profile.seconds += elapsed
+            profile.templates[statement_template(statement)] += 1
+        if elapsed * 1000 >= self.slow_ms:
+            logger.warning("Slow query (%.1fms): %s params=%s", elapsed * 1000,
+                           statement_template(statement), parameter_shape(parameters, executemany))
+
+    def settings(self) -> dict:
+        return {"enabled": self.enabled, "slow_ms": self.slow_ms, "n_plus_one": self.n_plus_one}
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, profiler: SQLProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if not self.profiler.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = RequestProfile()
+        token = _current.set(profile)
+        reported = False
+
+        async def send_with_profile(message):
+            nonlocal reported
+            if message["type"] == "http.response.start":
+                repeated = self._repeated(scope, profile)
+                headers = MutableHeaders(scope=message)
+                headers["X-DB-Query-Count"] = str(profile.count)
+                headers["X-DB-Time-Ms"] = f"{profile.seconds * 1000:.1f}"
+                headers["X-DB-Repeated-Statements"] = str(len(repeated))
+                reported = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            _current.reset(token)
+        if not reported:
+            self._repeated(scope, profile)
+
+    def _repeated(self, scope, profile: RequestProfile) -> dict:
+        repeated = {t: n for t, n in profile.templates.items() if n >= self.profiler.n_plus_one}
+        for template, n in repeated.items():
+            logger.warning("Possible N+1 in %s %s: %dx %s", scope["method"], scope["path"], n, template)
+        return repeated
+
+
+class ProfilerSettings(BaseModel):
+    enabled: bool
+    slow_ms: Optional[float] = None
+    n_plus_one: Optional[int] = None
+
+
+def install_profiler(app, database, verify_token) -> SQLProfiler:
+    """Attach the profiler to ``database`` and add the middleware and the admin switch to ``app``."""
+    profiler = SQLProfiler(
+        database.sync_engine,
+        slow_ms=float(os.getenv("SQL_SLOW_MS", "100")),
+        n_plus_one=int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "3")),
+    )
+    if env_flag("SQL_PROFILE"):
+        profiler.enable()
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+    def require_admin(user: dict = Depends(verify_token)):
+        if user["role"] != "admin":
+            raise HTTPException(status_code=403, detail="Only admins can change SQL profiling")
+
+    @app.get("/debug/sql-profile", dependencies=[Depends(require_admin)])
+    async def get_sql_profile():
+        return profiler.settings()
+
+    @app.put("/debug/sql-profile", dependencies=[Depends(require_admin)])
+    async def set_sql_profile(settings: ProfilerSettings):
+        if settings.slow_ms is not None:
+            profiler.slow_ms = settings.slow_ms
+        if settings.n_plus_one is not None:
+            profiler.n_plus_one = settings.n_plus_one
+        profiler.enable() if settings.enabled else profiler.disable()
+        return profiler.settings()
+
+    return profiler
@@ -0,0 +1,78 @@
+"""Frontend serving: precompressed variants and long-lived caching for hashed assets.
+
+``scripts/build_static.py`` writes ``frontend/build/`` with content-hashed
+JS/CSS names (``script.3f9a1c2b7d.js``), HTML rewritten to reference them,
+and ``.br``/``.gz`` siblings for each text file. When that directory exists
+it is what gets served; otherwise the raw ``frontend/`` sources are, as
+before, so development needs no build step.
+
+Hashed files never change under the same name and are sent with
+``Cache-Control: immutable``; HTML and unhashed files get ``no-cache`` so
+a new build is picked up on the next load.
+"""
+import mimetypes
+import os
+import re
+
+from fastapi import Request
+from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException
+
+HASHED_NAME = re.compile(r"\.[0-9a-f]{10}\.\w+$")
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves ``<file>.br``/``<file>.gz`` when the client accepts them."""
+
+    async def get_response(self, path: str, scope):
+        accept = ""
+        for key, value in scope["headers"]:
+            if key == b"accept-encoding":
+                accept = value.decode("latin-1")
+        accepted = accepted_encodings(accept)
+        response = None
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                response = await super().get_response(path + suffix, scope)
+            except HTTPException:
+                continue
+            response.headers["content-encoding"] = encoding
+            response.headers["content-type"] = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            break
+        if response is None:
+            response = await super().get_response(path, scope)
+        response.headers["vary"] = "Accept-Encoding"
+        response.headers["cache-control"] = IMMUTABLE if HASHED_NAME.search(path) else "no-cache"
+        return response
+
+
+def mount_frontend(app, service: str, directory: str = "frontend"):
+    """Mount the service's frontend at /static and its index.html at /."""
+    build = os.path.join(directory, "build")
+    root = build if os.path.isdir(build) else directory
+    if not os.path.isdir(root):
+        @app.get("/")
+        async def serve_index():
+            return {"service": service, "frontend": False}
+        return
+
+    static = PrecompressedStaticFiles(directory=root)
+    app.mount("/static", static, name="static")
+
+    @app.get("/")
+    async def serve_index(request: Request):
+        return await static.get_response("index.html", request.scope)
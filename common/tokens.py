@@ -0,0 +1,250 @@
+"""In-process verification of the JWTs issued by auth-service.
+
+HS256 tokens are checked against the shared ``SECRET_KEY``. Asymmetric tokens
+(RS256/ES256) are checked against the public keys auth-service publishes at
+``/.well-known/jwks.json``; keys are cached and re-fetched when a token names
+a ``kid`` we have not seen, which is how rotation is picked up.
+
+Set ``AUTH_VERIFY_MODE=remote`` to fall back to the old ``/verify`` round trip;
+results are then kept in a bounded ``TokenCache`` so a session's repeated
+requests don't each cost an auth-service call. The cache's hit, miss and
+coalesced counts are reported at ``/metrics``.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+import jwt
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from common.http import get_client
+from common.metrics import REGISTRY
+from common.tracing import TRACER
+
+REQUIRED_CLAIMS = ["exp", "user_id", "role"]
+SYMMETRIC_ALGORITHMS = {"HS256", "HS384", "HS512"}
+
+CACHE_HITS = REGISTRY.counter("token_cache_hits_total", "Remote-mode token verifications served from the cache")
+CACHE_MISSES = REGISTRY.counter("token_cache_misses_total", "Remote-mode token verifications not in the cache")
+CACHE_COALESCED = REGISTRY.counter("token_cache_coalesced_total", "Cache misses that waited on another request's lookup")
+CACHE_SIZE = REGISTRY.gauge("token_cache_entries", "Verified tokens held in the cache")
+
+
+class JWKSCache:
+    """Caches the auth-service key set, keyed by ``kid``."""
+
+    def __init__(self, client, path: str = "/.well-known/jwks.json", ttl: float = 300.0,
+                 min_refresh_interval: float = 30.0):
+        self.client = client
+        self.path = path
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys = {}
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        response = self.client.get(self.path)
+        response.raise_for_status()
+        keys = {}
+        for jwk in response.json().get("keys", []):
+            key = jwt.PyJWK(jwk)
+            keys[key.key_id] = key
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+
+    def has_fresh(self, kid: str) -> bool:
+        return kid in self._keys and time.monotonic() - self._fetched_at < self.ttl
+
+    def get(self, kid: str):
+        age = time.monotonic() - self._fetched_at
+        key = self._keys.get(kid)
+        if key is not None and age < self.ttl:
+            return key
+        # Unknown kid (rotation) or stale set: refresh, but never more often
+        # than min_refresh_interval so forged kids can't hammer auth-service.
+        with self._lock:
+            age = time.monotonic() - self._fetched_at
+            if age >= self.min_refresh_interval:
+                try:
+                    self._refresh()
+                except (HTTPException, httpx.HTTPError, ValueError, jwt.PyJWKError):
+                    # Keep serving the keys we already have.
+                    if not self._keys:
+                        raise HTTPException(status_code=503, detail="Auth service unavailable")
+            return self._keys.get(kid)
+
+
+class _Flight:
+    """An upstream lookup that concurrent misses for the same token wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class TokenCache:
+    """LRU cache of verified claims, keyed by a SHA-256 of the token.
+
+    Entries expire at the earlier of the token's ``exp`` claim and ``ttl``
+    seconds after they were stored. Concurrent misses for one token share a
+    single call to ``loader``; failures are never cached.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, token: str, loader) -> dict:
+        key = hashlib.sha256(token.encode()).hexdigest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            claims = loader()
+            flight.result = claims
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        else:
+            expires_at = now + self.ttl
+            if isinstance(claims.get("exp"), (int, float)):
+                expires_at = min(expires_at, claims["exp"])
+            with self._lock:
+                self._entries[key] = (expires_at, claims)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            return claims
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+class TokenVerifier:
+    def __init__(self, auth_service_url: str, mode: str = "local", secret_key: str = None,
+                 algorithms=None, jwks_ttl: float = 300.0, cache: TokenCache = None):
+        self.auth_service_url = auth_service_url
+        self.mode = mode
+        self.secret_key = secret_key
+        self.algorithms = algorithms or ["HS256", "RS256"]
+        self.client = get_client(auth_service_url, name="Auth service")
+        self.jwks = JWKSCache(self.client, ttl=jwks_ttl)
+        self.cache = cache or TokenCache()
+        REGISTRY.collector(self._collect_cache_stats)
+
+    def _collect_cache_stats(self):
+        stats = self.cache.stats()
+        CACHE_HITS.set(stats["hits"])
+        CACHE_MISSES.set(stats["misses"])
+        CACHE_COALESCED.set(stats["coalesced"])
+        CACHE_SIZE.set(stats["size"])
+
+    @classmethod
+    def from_env(cls, auth_service_url: str):
+        return cls(
+            auth_service_url,
+            mode=os.getenv("AUTH_VERIFY_MODE", "local"),
+            secret_key=os.getenv("SECRET_KEY", "your-secret-key-change-in-production"),
+            algorithms=[a.strip() for a in os.getenv("JWT_ALGORITHMS", "HS256,RS256").split(",") if a.strip()],
+            jwks_ttl=float(os.getenv("JWKS_CACHE_TTL", "300")),
+            cache=TokenCache(
+                maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "1024")),
+                ttl=float(os.getenv("TOKEN_CACHE_TTL", "60")),
+            ),
+        )
+
+    def verify(self, authorization: str) -> dict:
+        """Return the token's claims or raise the HTTPException the route should send."""
+        if self.mode == "remote":
+            return self.cache.get_or_load(authorization, lambda: self.verify_remote(authorization))
+        return self.verify_local(authorization)
+
+    async def averify(self, authorization: str) -> dict:
+        """``verify`` for async routes: anything that may wait on auth-service runs in the threadpool."""
+        with TRACER.span("verify token", **{"auth.mode": self.mode}):
+            if self.mode != "remote":
+                try:
+                    kid = jwt.get_unverified_header(authorization.partition(" ")[2]).get("kid")
+                except jwt.InvalidTokenError:
+                    kid = None
+                if kid is None or self.jwks.has_fresh(kid):
+                    return self.verify_local(authorization)
+            return await run_in_threadpool(self.verify, authorization)
+
+    def verify_local(self, authorization: str) -> dict:
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        try:
+            header = jwt.get_unverified_header(token)
+            alg = header.get("alg")
+            if alg not in self.algorithms:
+                raise HTTPException(status_code=401, detail="Invalid token")
+            # Pick the key by algorithm family so an HS256 token can never be
+            # checked against a published public key (alg confusion).
+            if alg in SYMMETRIC_ALGORITHMS:
+                key = self.secret_key
+            else:
+                jwk = self.jwks.get(header.get("kid"))
+                if jwk is None:
+                    raise HTTPException(status_code=401, detail="Invalid token")
+                key = jwk.key
+            return jwt.decode(token, key, algorithms=[alg], options={"require": REQUIRED_CLAIMS})
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(status_code=401, detail="Token expired")
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+    def verify_remote(self, authorization: str) -> dict:
+        response = self.client.get("/verify", headers={"Authorization": authorization})
+        if response.status_code >= 500:
+            raise HTTPException(status_code=503, detail="Auth service unavailable")
+        if response.status_code != 200:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return response.json()["user"]
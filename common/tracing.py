@@ -0,0 +1,472 @@
+"""Distributed tracing with W3C ``traceparent`` propagation.
+
+``install_tracing(app, database, service)`` sets up:
+
+- a server span per request, continuing the caller's trace from its
+  ``traceparent`` header (the browser sends one when booking) or starting a
+  new one; the trace id is returned in ``X-Trace-Id``
+- a client span per ``ServiceClient`` call (``common/http.py``), which also
+  forwards ``traceparent``, so auth-service ``/verify`` and the other hops
+  land in the same trace
+- a span per SQL statement, from SQLAlchemy's cursor-execute events
+- ``trace_id``/``span_id`` on every log record
+
+Sampling is decided where a trace enters a replica: a caller's sampled flag
+is honoured, new traces are kept with probability ``TRACE_SAMPLE_RATIO``,
+and either way at most ``TRACE_MAX_PER_SECOND`` traces per replica start
+recording, with at most ``TRACE_MAX_SPANS`` spans each. Unsampled requests
+still carry ids for propagation and logs but record nothing.
+
+Finished spans go through a bounded queue (``TRACE_QUEUE_SIZE``; overflow is
+dropped and counted in ``/metrics``) to a background thread that appends
+them to ``TRACE_FILE`` as JSON lines (``TRACE_EXPORTER=file``) or POSTs them
+as OTLP/JSON to ``TRACE_OTLP_ENDPOINT`` (``otlp``). With the default,
+``none``, nothing is recorded and no DB listeners are installed.
+``scripts/trace_collector.py`` is a stand-in collector and waterfall viewer.
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+import httpx
+from sqlalchemy import event
+from starlette.datastructures import MutableHeaders
+
+from common.instrumentation import route_label, statement_verb
+from common.metrics import REGISTRY
+from common.profiling import statement_template
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = "traceparent"
+TRACE_ID_HEADER = "X-Trace-Id"
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s [trace=%(trace_id)s span=%(span_id)s] %(message)s"
+
+SPANS_EXPORTED = REGISTRY.counter("trace_spans_exported_total", "Spans sent to the trace exporter")
+SPANS_DROPPED = REGISTRY.counter("trace_spans_dropped_total", "Spans not exported", ("reason",))
+
+_TRACEPARENT = re.compile(r"([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$")
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits) or 1:0{bits // 4}x}"
+
+
+def parse_traceparent(value: Optional[str]):
+    """``(trace_id, parent_id, sampled)`` from a ``traceparent`` header, or None if absent or malformed."""
+    match = _TRACEPARENT.match(value.strip()) if value else None
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags, rest = match.groups()
+    if version == "ff" or (version == "00" and rest) or not int(trace_id, 16) or not int(parent_id, 16):
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: str, sampled: bool,
+                 budget: list, attributes: dict = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.sampled = sampled
+        # [spans recorded so far], shared by every span of this trace in this replica.
+        self.budget = budget
+        self.attributes = attributes or {}
+        self.status = "unset"
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def child(self, name: str, kind: str = "internal", attributes: dict = None) -> "Span":
+        return Span(name, self.trace_id, self.span_id, kind, self.sampled, self.budget, attributes)
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def record(self, service: str) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": self.kind,
+            "service": service,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": self.attributes,
+            "status": self.status,
+        }
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def inject(headers: Optional[dict], span: Optional[Span] = None) -> Optional[dict]:
+    """``headers`` plus ``traceparent`` for ``span`` (default: the current one), if there is a trace."""
+    span = span or _current.get()
+    if span is None:
+        return headers
+    headers = dict(headers or {})
+    headers[TRACEPARENT] = span.traceparent()
+    return headers
+
+
+class RateLimiter:
+    """Token bucket: ``allow()`` is true at most ``per_second`` times a second, with bursts up to that."""
+
+    def __init__(self, per_second: float):
+        self.per_second = per_second
+        self.tokens = per_second
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.per_second, self.tokens + (now - self.updated) * self.per_second)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+# ------------------------------
+# Exporters
+# ------------------------------
+OTLP_KINDS = {"internal": 1, "server": 2, "client": 3}
+OTLP_STATUS = {"unset": 0, "ok": 1, "error": 2}
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _from_otlp_value(value: dict):
+    if "intValue" in value:
+        return int(value["intValue"])
+    return next(iter(value.values()), None)
+
+
+def otlp_payload(records: list) -> dict:
+    """OTLP/JSON ``ExportTraceServiceRequest`` for span records from one service."""
+    service = records[0]["service"] if records else ""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+        "scopeSpans": [{"scope": {"name": "common.tracing"}, "spans": [{
+            "traceId": r["traceId"],
+            "spanId": r["spanId"],
+            "parentSpanId": r["parentSpanId"],
+            "name": r["name"],
+            "kind": OTLP_KINDS[r["kind"]],
+            "startTimeUnixNano": str(r["startTimeUnixNano"]),
+            "endTimeUnixNano": str(r["endTimeUnixNano"]),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in r["attributes"].items()],
+            "status": {"code": OTLP_STATUS[r["status"]]},
+        } for r in records]}],
+    }]}
+
+
+def records_from_otlp(payload: dict) -> list:
+    """The span records in an OTLP/JSON request, in the shape ``FileExporter`` writes."""
+    kinds = {v: k for k, v in OTLP_KINDS.items()}
+    statuses = {v: k for k, v in OTLP_STATUS.items()}
+    records = []
+    for resource_spans in payload.get("resourceSpans", []):
+        resource = {a["key"]: a["value"] for a in resource_spans.get("resource", {}).get("attributes", [])}
+        service = resource.get("service.name", {}).get("stringValue", "")
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for span in scope_spans.get("spans", []):
+                records.append({
+                    "traceId": span["traceId"],
+                    "spanId": span["spanId"],
+                    "parentSpanId": span.get("parentSpanId", ""),
+                    "name": span.get("name", ""),
+                    "kind": kinds.get(span.get("kind"), "internal"),
+                    "service": service,
+                    "startTimeUnixNano": int(span["startTimeUnixNano"]),
+                    "endTimeUnixNano": int(span["endTimeUnixNano"]),
+                    "attributes": {a["key"]: _from_otlp_value(a["value"]) for a in span.get("attributes", [])},
+                    "status": statuses.get(span.get("status", {}).get("code", 0), "unset"),
+                })
+    return records
+
+
+class FileExporter:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, records: list):
+        lines = "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records)
+        with self._lock, open(self.path, "a") as f:
+            f.write(lines)
+
+    def __str__(self):
+        return self.path
+
+
+class OTLPExporter:
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self._client = httpx.Client(timeout=timeout)
+
+    def export(self, records: list):
+        self._client.post(self.endpoint, json=otlp_payload(records)).raise_for_status()
+
+    def __str__(self):
+        return self.endpoint
+
+
+class BatchProcessor:
+    """Queues finished spans and exports them in batches from a background thread."""
+
+    def __init__(self, exporter, queue_size: int = 2048, batch_size: int = 512, interval: float = 1.0):
+        self.exporter = exporter
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = deque()
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="trace-export", daemon=True).start()
+
+    def submit(self, record: dict):
+        with self._cond:
+            if len(self._queue) >= self.queue_size:
+                SPANS_DROPPED.labels("queue_full").inc()
+                return
+            self._queue.append(record)
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def _take(self) -> list:
+        return [self._queue.popleft() for _ in range(min(len(self._queue), self.batch_size))]
+
+    def _export(self, batch: list):
+        try:
+            self.exporter.export(batch)
+            SPANS_EXPORTED.inc(len(batch))
+        except Exception as exc:
+            logger.warning("Exporting %d spans to %s failed: %s", len(batch), self.exporter, exc)
+            SPANS_DROPPED.labels("export_failed").inc(len(batch))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size:
+                    self._cond.wait(self.interval)
+                batch = self._take()
+            if batch:
+                self._export(batch)
+
+    def flush(self):
+        while True:
+            with self._cond:
+                batch = self._take()
+            if not batch:
+                return
+            self._export(batch)
+
+
+# ------------------------------
+# Tracer
+# ------------------------------
+class Tracer:
+    def __init__(self):
+        self.service = "unknown"
+        self.processor = None
+        self.sample_ratio = 0.0
+        self.max_spans = 256
+        self.limiter = RateLimiter(0)
+
+    def configure(self, service: str, processor: Optional[BatchProcessor], sample_ratio: float,
+                  max_per_second: float, max_spans: int):
+        self.service = service
+        self.processor = processor
+        self.sample_ratio = sample_ratio
+        self.max_spans = max_spans
+        self.limiter = RateLimiter(max_per_second)
+
+    def _sample(self, parent_sampled: Optional[bool]) -> bool:
+        if self.processor is None or parent_sampled is False:
+            return False
+        if parent_sampled is None and random.random() >= self.sample_ratio:
+            return False
+        return self.limiter.allow()
+
+    def start_trace(self, name: str, traceparent: Optional[str]) -> Span:
+        """The server span for an inbound request, continuing ``traceparent`` if it is valid."""
+        parent = parse_traceparent(traceparent)
+        if parent is None:
+            trace_id, parent_id, parent_sampled = _new_id(128), None, None
+        else:
+            trace_id, parent_id, parent_sampled = parent
+        return Span(name, trace_id, parent_id, "server", self._sample(parent_sampled), [0])
+
+    def start_span(self, name: str, kind: str = "internal", attributes: dict = None) -> Optional[Span]:
+        """A child of the current span, or None when the current trace isn't being recorded."""
+        parent = _current.get()
+        if parent is None or not parent.sampled:
+            return None
+        return parent.child(name, kind, attributes)
+
+    def end(self, span: Span, error: bool = False):
+        span.end_ns = time.time_ns()
+        if error:
+            span.status = "error"
+        # Unlocked: the cap is approximate when a request's statements run on several threads.
+        if span.budget[0] >= self.max_spans:
+            SPANS_DROPPED.labels("trace_limit").inc()
+            return
+        span.budget[0] += 1
+        self.processor.submit(span.record(self.service))
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Record the block as a child span, made current so nested calls attach to it."""
+        span = self.start_span(name, attributes=attributes)
+        if span is None:
+            yield None
+            return
+        token = _current.set(span)
+        error = False
+        try:
+            yield span
+        except BaseException:
+            error = True
+            raise
+        finally:
+            _current.reset(token)
+            self.end(span, error)
+
+    def flush(self):
+        if self.processor is not None:
+            self.processor.flush()
+
+
+TRACER = Tracer()
+
+
+class TracingMiddleware:
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        traceparent = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"traceparent"), None)
+        span = self.tracer.start_trace(scope["method"], traceparent)
+        token = _current.set(span)
+        status = 500
+
+        async def send_with_trace(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message)[TRACE_ID_HEADER] = span.trace_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            _current.reset(token)
+            if span.sampled:
+                route = route_label(scope, status)
+                span.name = f"{scope['method']} {route}"
+                span.attributes.update({"http.method": scope["method"], "http.route": route,
+                                        "http.status_code": status})
+                self.tracer.end(span, error=status >= 500)
+
+
+def trace_engine(sync_engine, tracer: Tracer):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Statement text only: parameters can hold patient data.
+        context._trace_span = tracer.start_span(
+            f"db {statement_verb(statement)}", "client",
+            {"db.system": conn.dialect.name, "db.statement": statement_template(statement)})
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, "_trace_span", None)
+        if span is not None:
+            tracer.end(span)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        span = getattr(exception_context.execution_context, "_trace_span", None)
+        if span is not None:
+            tracer.end(span, error=True)
+
+
+def install_log_context():
+    """Stamp ``trace_id``/``span_id`` on every log record and log them unless logging is already configured."""
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, "adds_trace_ids", False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        span = _current.get()
+        record.trace_id = span.trace_id if span else "-"
+        record.span_id = span.span_id if span else "-"
+        return record
+
+    record_factory.adds_trace_ids = True
+    logging.setLogRecordFactory(record_factory)
+    logging.basicConfig(format=LOG_FORMAT)
+
+
+def exporter_from_env():
+    kind = os.getenv("TRACE_EXPORTER", "none")
+    if kind == "file":
+        return FileExporter(os.getenv("TRACE_FILE", "traces.jsonl"))
+    if kind == "otlp":
+        return OTLPExporter(os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"))
+    if kind != "none":
+        raise ValueError(f"TRACE_EXPORTER must be none, file or otlp, not {kind!r}")
+    return None
+
+
+def install_tracing(app, database, service: str):
+    """Trace ``app``'s requests and ``database``'s statements as ``service``, configured from the environment."""
+    exporter = exporter_from_env()
+    processor = None
+    if exporter is not None:
+        processor = BatchProcessor(
+            exporter,
+            queue_size=int(os.getenv("TRACE_QUEUE_SIZE", "2048")),
+            interval=float(os.getenv("TRACE_EXPORT_INTERVAL", "1")),
+        )
+    TRACER.configure(
+        service,
+        processor,
+        sample_ratio=float(os.getenv("TRACE_SAMPLE_RATIO", "0.01")),
+        max_per_second=float(os.getenv("TRACE_MAX_PER_SECOND", "5")),
+        max_spans=int(os.getenv("TRACE_MAX_SPANS", "256")),
+    )
+    install_log_context()
+    app.add_middleware(TracingMiddleware, tracer=TRACER)
+    if processor is not None:
+        trace_engine(database.sync_engine, TRACER)
+    app.add_event_handler("shutdown", TRACER.flush)
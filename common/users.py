@@ -0,0 +1,127 @@
+"""Local replica of the auth-service user directory.
+
+``UserDirectory`` keeps every user's id, username, email and role in memory
+and follows auth-service's change feed (``/users/changes?since=<cursor>``),
+so resolving a user needs no network hop. The feed is polled in the
+background at most every ``sync_interval`` seconds; only the first lookup
+waits for the initial load. A user the replica doesn't know yet (registered
+since the last poll) is fetched with one batch call (``/users?ids=`` or
+``?usernames=``) and kept; one it doesn't return is remembered as unknown
+until the feed next moves (or fails), so repeated lookups of a nonexistent
+user don't reach auth-service. If auth-service is down, lookups keep
+answering from what was already replicated.
+
+Both endpoints require the shared service credential (``SERVICE_TOKEN``),
+sent in ``X-Service-Token``.
+"""
+import asyncio
+import logging
+import time
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+SERVICE_TOKEN_HEADER = "X-Service-Token"
+
+
+class UserDirectory:
+    def __init__(self, client, sync_interval: float = 5.0, page_size: int = 1000, service_token: str = "",
+                 max_unknown: int = 10000):
+        self.client = client
+        self.max_unknown = max_unknown
+        self.headers = {SERVICE_TOKEN_HEADER: service_token} if service_token else {}
+        self.sync_interval = sync_interval
+        self.page_size = page_size
+        self.hits = self.misses = 0
+        self.cursor = 0
+        self._by_id = {}
+        self._by_username = {}
+        # Looked up and not found; trusted only until the feed moves or fails.
+        self._unknown_ids = set()
+        self._unknown_usernames = set()
+        self._synced_at = None
+        self._syncing = None
+
+    def _store(self, user: dict):
+        old = self._by_id.get(user["user_id"])
+        if old is not None and old["username"] != user["username"]:
+            self._by_username.pop(old["username"], None)
+        self._by_id[user["user_id"]] = user
+        self._by_username[user["username"]] = user
+
+    async def _sync(self):
+        try:
+            while True:
+                response = await self.client.aget(
+                    "/users/changes", params={"since": self.cursor, "limit": self.page_size}, headers=self.headers)
+                response.raise_for_status()
+                body = response.json()
+                for user in body["users"]:
+                    self._store(user)
+                if body["cursor"] != self.cursor:
+                    self._forget_unknown()
+                self.cursor = body["cursor"]
+                if not body["has_more"]:
+                    break
+        except Exception as e:
+            self._forget_unknown()
+            logger.warning("User directory sync failed: %s", e)
+        finally:
+            self._synced_at = time.monotonic()
+            self._syncing = None
+
+    async def _maybe_sync(self):
+        if self._syncing is None and (
+                self._synced_at is None or time.monotonic() - self._synced_at >= self.sync_interval):
+            self._syncing = asyncio.ensure_future(self._sync())
+        if self._synced_at is None and self._syncing is not None:
+            await asyncio.shield(self._syncing)
+
+    def _forget_unknown(self):
+        self._unknown_ids.clear()
+        self._unknown_usernames.clear()
+
+    async def _fetch(self, param: str, keys) -> None:
+        self.misses += len(keys)
+        response = await self.client.aget("/users", params={param: ",".join(str(k) for k in keys)},
+                                          headers=self.headers)
+        if response.status_code != 200:
+            logger.warning("User lookup returned %s", response.status_code)
+            raise HTTPException(status_code=503, detail=f"{self.client.name} unavailable")
+        for user in response.json():
+            self._store(user)
+        if len(self._unknown_ids) + len(self._unknown_usernames) >= self.max_unknown:
+            self._forget_unknown()
+        if param == "ids":
+            self._unknown_ids.update(k for k in keys if k not in self._by_id)
+        else:
+            self._unknown_usernames.update(k for k in keys if k not in self._by_username)
+
+    async def get_many(self, user_ids) -> dict:
+        """user_id -> user dict for the ids that exist."""
+        await self._maybe_sync()
+        ids = set(user_ids)
+        missing = sorted(ids - self._by_id.keys() - self._unknown_ids)
+        self.hits += len(ids) - len(missing)
+        if missing:
+            await self._fetch("ids", missing)
+        return {i: self._by_id[i] for i in ids if i in self._by_id}
+
+    async def get(self, user_id: int):
+        return (await self.get_many([user_id])).get(user_id)
+
+    async def by_username(self, username: str):
+        await self._maybe_sync()
+        user = self._by_username.get(username)
+        if user is None and username not in self._unknown_usernames:
+            await self._fetch("usernames", [username])
+            user = self._by_username.get(username)
+        else:
+            self.hits += 1
+        return user
+
+    def stats(self) -> dict:
+        return {"users": len(self._by_id), "unknown": len(self._unknown_ids) + len(self._unknown_usernames),
+                "cursor": self.cursor, "hits": self.hits, "misses": self.misses,
+                "synced_ago": None if self._synced_at is None else round(time.monotonic() - self._synced_at, 3)}
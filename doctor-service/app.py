@@ -1,15 +1,27 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime
-from sqlalchemy import or_, func
-from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from sqlalchemy import Column, Integer, String, Float, Text, Date, Time, DateTime, Index
+from sqlalchemy import or_, func, literal, literal_column, select, text
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
-import requests
 import os
-from datetime import datetime
+import json
+from datetime import datetime, date, time
+from common.cache import ReadThroughCache, bump_version, read_version, version_table
+from common.db import Database, env_flag
+from common.etag import ETagMiddleware
+from common.expand import parse_ids
+from common.http import close_clients
+from common.instrumentation import instrument
+from common.migrations import run_migrations
+from common.pagination import NEXT_CURSOR_HEADER, PageParams, paginate
+from common.profiling import install_profiler
+from common.static import mount_frontend
+from common.tokens import TokenVerifier
+from common.tracing import TRACE_ID_HEADER, install_tracing
 
 # ------------------------------
 # FastAPI setup
@@ -22,37 +34,29 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, TRACE_ID_HEADER],
 )
+app.add_middleware(ETagMiddleware)
+# Outermost, so ETags are computed on the uncompressed body.
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
 
-frontend_dir = "frontend"
-if os.path.isdir(frontend_dir):
-    app.mount("/static", StaticFiles(directory=frontend_dir), name="static")
-
-    @app.get("/")
-    def serve_index():
-        return FileResponse(os.path.join(frontend_dir, "index.html"))
-else:
-    @app.get("/")
-    def serve_index():
-        return {"service": "doctor", "frontend": False}
+# frontend/build (scripts/build_static.py) when present, else the raw sources
+mount_frontend(app, "doctor")
 
 # ------------------------------
 # Environment variables
 # ------------------------------
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8000")
+token_verifier = TokenVerifier.from_env(AUTH_SERVICE_URL)
 
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT", "5432")
-DB_NAME = os.getenv("DB_NAME")
-
-DB_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-
-engine = create_engine(DB_URL)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# DB_USER/DB_PASSWORD/DB_HOST/DB_PORT/DB_NAME; DB_ASYNC=0 selects the sync driver
+database = Database.from_env()
+engine = database.engine
 Base = declarative_base()
 
+# Request, query, outbound-call and threadpool metrics at /metrics
+instrument(app, database)
+
 # ------------------------------
 # Database model
 # ------------------------------
@@ -70,7 +74,41 @@ class DoctorDB(Base):
     available_days = Column(String, default="Mon,Tue,Wed,Thu,Fri")
     created_at = Column(DateTime, default=datetime.utcnow)
 
-Base.metadata.create_all(bind=engine)
+    # Fee-range filter; the trigram search indexes are Postgres-only (migration 0002).
+    __table_args__ = (Index("ix_doctors_consultation_fee", "consultation_fee"),)
+
+class ScheduleDB(Base):
+    """Working hours template; weekdays come from DoctorDB.available_days."""
+    __tablename__ = "doctor_schedules"
+    doctor_id = Column(Integer, primary_key=True)
+    work_start = Column(Time, nullable=False, default=time(9, 0))
+    work_end = Column(Time, nullable=False, default=time(17, 0))
+    slot_minutes = Column(Integer, nullable=False, default=60)
+    breaks = Column(Text, nullable=True)  # JSON list of {"start": "HH:MM", "end": "HH:MM"}
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ScheduleExceptionDB(Base):
+    """Whole days off (vacations, conferences), inclusive of both ends."""
+    __tablename__ = "doctor_schedule_exceptions"
+    id = Column(Integer, primary_key=True, index=True)
+    doctor_id = Column(Integer, nullable=False, index=True)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+    reason = Column(String, nullable=True)
+
+cache_versions = version_table(Base.metadata)
+
+# Schema changes live in migrations/; DB_MIGRATE_ON_STARTUP=0 leaves them to a
+# separate job (python -m common.migrations <service>-service).
+@app.on_event("startup")
+async def migrate():
+    if env_flag("DB_MIGRATE_ON_STARTUP", "1"):
+        await run_migrations(database, "doctor", os.path.join(os.path.dirname(__file__), "migrations"))
+
+# Outbound connection pools (common/http.py), sync and async.
+@app.on_event("shutdown")
+async def close_service_clients():
+    await close_clients()
 
 # ------------------------------
 # Pydantic models
@@ -92,45 +130,137 @@ class DoctorResponse(Doctor):
     class Config:
         from_attributes = True
 
+class Break(BaseModel):
+    start: time
+    end: time
+
+class Schedule(BaseModel):
+    weekdays: List[str] = ["Mon", "Tue", "Wed", "Thu", "Fri"]
+    work_start: time = time(9, 0)
+    work_end: time = time(17, 0)
+    slot_minutes: int = 60
+    breaks: List[Break] = []
+
+class ScheduleException(BaseModel):
+    start_date: date
+    end_date: date
+    reason: Optional[str] = None
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+DEFAULT_SCHEDULE = Schedule()
+
 # ------------------------------
 # Dependencies
 # ------------------------------
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with database.session() as db:
         yield db
-    finally:
-        db.close()
 
-def verify_token(authorization: str = Header(None)):
+async def verify_token(authorization: str = Header(None)):
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header missing")
-    try:
-        response = requests.get(
-            f"{AUTH_SERVICE_URL}/verify",
-            headers={"Authorization": authorization}
-        )
-        if response.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return response.json()["user"]
-    except requests.RequestException:
-        raise HTTPException(status_code=503, detail="Auth service unavailable")
+    return await token_verifier.averify(authorization)
+
+# Per-request SQL profiling: SQL_PROFILE at startup, PUT /debug/sql-profile at runtime
+install_profiler(app, database, verify_token)
+# Outermost: traceparent in and out, spans for requests, DB statements and service calls
+install_tracing(app, database, "doctor-service")
+
+# ------------------------------
+# Directory cache
+# ------------------------------
+# /doctors, /doctors/{id} and /specializations are read on every booking page
+# and rarely written. Values are response-ready dicts, never ORM objects.
+async def load_directory_version():
+    async with database.session() as db:
+        return await read_version(db, cache_versions, "doctors")
+
+directory_cache = ReadThroughCache(
+    maxsize=int(os.getenv("DOCTOR_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("DOCTOR_CACHE_TTL", "30")),
+    stale_ttl=float(os.getenv("DOCTOR_CACHE_STALE_TTL", "300")),
+    version_loader=load_directory_version,
+    sync_interval=float(os.getenv("DOCTOR_CACHE_SYNC_INTERVAL", "1")),
+)
+
+async def directory_changed(db):
+    """Record a directory write in the current transaction; call before commit."""
+    await bump_version(db, cache_versions, "doctors")
+
+async def schedules_changed(db):
+    """Record a schedule write in the current transaction; call before commit.
+
+    appointment-service replicas poll this version and drop their compiled
+    slot grids when it moves.
+    """
+    await bump_version(db, cache_versions, "schedules")
+
+def schedule_document(doctor: DoctorDB, schedule: Optional[ScheduleDB], exceptions) -> dict:
+    if schedule is None:
+        work_start, work_end = DEFAULT_SCHEDULE.work_start, DEFAULT_SCHEDULE.work_end
+        slot_minutes, breaks = DEFAULT_SCHEDULE.slot_minutes, []
+    else:
+        work_start, work_end = schedule.work_start, schedule.work_end
+        slot_minutes, breaks = schedule.slot_minutes, json.loads(schedule.breaks or "[]")
+    return {
+        "doctor_id": doctor.id,
+        "weekdays": [d.strip() for d in (doctor.available_days or "").split(",") if d.strip() in WEEKDAYS],
+        "work_start": work_start.strftime("%H:%M"),
+        "work_end": work_end.strftime("%H:%M"),
+        "slot_minutes": slot_minutes,
+        "breaks": breaks,
+        "exceptions": [
+            {"id": e.id, "start_date": e.start_date.isoformat(), "end_date": e.end_date.isoformat(), "reason": e.reason}
+            for e in exceptions
+        ],
+    }
+
+async def load_schedules(db: AsyncSession, doctor_ids: List[int]) -> List[dict]:
+    doctors = (await db.scalars(select(DoctorDB).where(DoctorDB.id.in_(doctor_ids)))).all()
+    schedules = {s.doctor_id: s for s in (await db.scalars(
+        select(ScheduleDB).where(ScheduleDB.doctor_id.in_(doctor_ids))
+    )).all()}
+    exceptions = {}
+    for e in (await db.scalars(select(ScheduleExceptionDB).where(
+        ScheduleExceptionDB.doctor_id.in_(doctor_ids),
+        ScheduleExceptionDB.end_date >= date.today()
+    ).order_by(ScheduleExceptionDB.start_date))).all():
+        exceptions.setdefault(e.doctor_id, []).append(e)
+    return [schedule_document(d, schedules.get(d.id), exceptions.get(d.id, [])) for d in doctors]
+
+async def get_editable_doctor(doctor_id: int, user: dict, db: AsyncSession) -> DoctorDB:
+    doctor = await db.get(DoctorDB, doctor_id)
+    if not doctor:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    if user["role"] != "admin" and doctor.user_id != user["user_id"]:
+        raise HTTPException(status_code=403, detail="Only admins or the doctor can change this schedule")
+    return doctor
 
 # ------------------------------
 # Routes
 # ------------------------------
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "healthy", "service": "doctor"}
 
+@app.get("/health/db")
+async def db_pool_stats():
+    """Connection pool occupancy and checkout wait times, for sizing DB_POOL_SIZE against max_connections."""
+    return database.pool_stats()
+
+@app.get("/health/cache")
+async def cache_stats():
+    """Directory cache size and hit/stale-hit/miss counters."""
+    return directory_cache.stats()
+
 @app.post("/doctors", response_model=DoctorResponse)
-def create_doctor(doctor: Doctor, db: Session = Depends(get_db)):
+async def create_doctor(doctor: Doctor, db: AsyncSession = Depends(get_db)):
     """
     Create a doctor profile. Public endpoint: anyone can create a doctor profile.
     This endpoint no longer requires or checks Authorization — profiles are created unconditionally.
     """
     # Prevent duplicate license numbers
-    existing = db.query(DoctorDB).filter(DoctorDB.license_number == doctor.license_number).first()
+    existing = await db.scalar(select(DoctorDB).where(DoctorDB.license_number == doctor.license_number))
     if existing:
         raise HTTPException(status_code=400, detail="License number already exists")
 
@@ -146,45 +276,201 @@ def create_doctor(doctor: Doctor, db: Session = Depends(get_db)):
         available_days=doctor.available_days
     )
     db.add(new_doctor)
-    db.commit()
-    db.refresh(new_doctor)
+    await directory_changed(db)
+    # appointment-service may have cached this id as an unknown doctor.
+    await schedules_changed(db)
+    await db.commit()
+    await db.refresh(new_doctor)
+    directory_cache.invalidate()
     return new_doctor
 
 @app.get("/doctors", response_model=List[DoctorResponse])
-def list_doctors(specialization: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(DoctorDB)
-    if specialization:
-        # case-insensitive partial match
-        query = query.filter(func.lower(DoctorDB.specialization).like(f"%{specialization.lower()}%"))
-    return query.all()
+async def list_doctors(response: Response, page: PageParams = Depends(), specialization: Optional[str] = None,
+                       ids: Optional[str] = None, user_ids: Optional[str] = None):
+    """Doctor directory, paginated. ``ids`` or ``user_ids`` (comma-separated) instead fetch just those doctors."""
+    if ids is not None or user_ids is not None:
+        return await get_doctors_batch(ids, user_ids)
+
+    async def load():
+        async with database.session() as db:
+            query = select(DoctorDB)
+            if specialization:
+                # case-insensitive partial match
+                query = query.where(func.lower(DoctorDB.specialization).like(f"%{specialization.lower()}%"))
+            page_response = Response()
+            doctors = await paginate(db, query, [DoctorDB.id], page, page_response, descending=False)
+            return ([DoctorResponse.model_validate(d).model_dump() for d in doctors],
+                    page_response.headers.get(NEXT_CURSOR_HEADER))
+
+    doctors, next_cursor = await directory_cache.get(
+        ("list", specialization, page.limit, page.cursor, page.all), load)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return doctors
+
+async def get_doctors_batch(ids: Optional[str], user_ids: Optional[str]) -> list:
+    if ids is not None and user_ids is not None:
+        raise HTTPException(status_code=400, detail="Give either ids or user_ids")
+    column = DoctorDB.id if ids is not None else DoctorDB.user_id
+    keys = tuple(parse_ids(ids, "ids") if ids is not None else parse_ids(user_ids, "user_ids"))
+
+    async def load():
+        async with database.session() as db:
+            doctors = (await db.scalars(select(DoctorDB).where(column.in_(keys)).order_by(DoctorDB.id))).all()
+            return [DoctorResponse.model_validate(d).model_dump() for d in doctors]
+
+    if not keys:
+        return []
+    return await directory_cache.get(("batch", column.key, keys), load)
+
+# Search text for ranked lookup. Must match ix_doctors_search_trgm's expression
+# exactly (hence literal separators, not bound parameters) for Postgres to use it.
+SEARCH_TEXT = func.lower(
+    DoctorDB.first_name + literal_column("' '") + DoctorDB.last_name + literal_column("' '")
+    + DoctorDB.specialization + literal_column("' '") + DoctorDB.license_number
+)
+# pg_trgm word_similarity cut-off; lower tolerates more typos but matches more loosely.
+SEARCH_THRESHOLD = float(os.getenv("DOCTOR_SEARCH_THRESHOLD", "0.4"))
+
+@app.get("/doctors/search", response_model=List[DoctorResponse])
+async def search_doctors(q: Optional[str] = None, day: Optional[str] = None,
+                         min_fee: Optional[float] = None, max_fee: Optional[float] = None,
+                         limit: int = Query(20, ge=1, le=100), db: AsyncSession = Depends(get_db)):
+    """Doctors matching ``q`` by name, specialization or licence, best match first.
+
+    Matching is trigram word similarity, so partial words and small typos
+    ("cardiolgy") still match; ``day`` (Mon..Sun) and the fee range narrow it.
+    """
+    query = select(DoctorDB)
+    if day:
+        if day not in WEEKDAYS:
+            raise HTTPException(status_code=400, detail=f"day must be one of {', '.join(WEEKDAYS)}")
+        query = query.where(DoctorDB.available_days.like(f"%{day}%"))
+    if min_fee is not None:
+        query = query.where(DoctorDB.consultation_fee >= min_fee)
+    if max_fee is not None:
+        query = query.where(DoctorDB.consultation_fee <= max_fee)
+
+    q = (q or "").strip().lower()
+    if not q:
+        query = query.order_by(DoctorDB.last_name, DoctorDB.first_name, DoctorDB.id)
+    elif database.sync_engine.dialect.name == "postgresql":
+        await db.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :t, true)"),
+                         {"t": str(SEARCH_THRESHOLD)})
+        query = query.where(literal(q).op("<%")(SEARCH_TEXT)).order_by(
+            func.word_similarity(q, SEARCH_TEXT).desc(), DoctorDB.id
+        )
+    else:
+        # No pg_trgm: plain substring match, unranked.
+        query = query.where(SEARCH_TEXT.contains(q, autoescape=True)).order_by(DoctorDB.last_name, DoctorDB.id)
+    return (await db.scalars(query.limit(limit))).all()
 
 @app.get("/doctors/{doctor_id}", response_model=DoctorResponse)
-def get_doctor(doctor_id: int, db: Session = Depends(get_db)):
-    doctor = db.query(DoctorDB).filter(DoctorDB.id == doctor_id).first()
+async def get_doctor(doctor_id: int):
+    async def load():
+        async with database.session() as db:
+            doctor = await db.get(DoctorDB, doctor_id)
+            return DoctorResponse.model_validate(doctor).model_dump() if doctor else None
+
+    doctor = await directory_cache.get(("doctor", doctor_id), load)
     if not doctor:
         raise HTTPException(status_code=404, detail="Doctor not found")
     return doctor
 
 @app.put("/doctors/{doctor_id}", response_model=DoctorResponse)
-def update_doctor(doctor_id: int, doctor: Doctor, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def update_doctor(doctor_id: int, doctor: Doctor, user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can update doctors")
     
-    db_doctor = db.query(DoctorDB).filter(DoctorDB.id == doctor_id).first()
+    db_doctor = await db.get(DoctorDB, doctor_id)
     if not db_doctor:
         raise HTTPException(status_code=404, detail="Doctor not found")
     
     for field, value in doctor.dict().items():
         setattr(db_doctor, field, value)
     
-    db.commit()
-    db.refresh(db_doctor)
+    await directory_changed(db)
+    await schedules_changed(db)
+    await db.commit()
+    await db.refresh(db_doctor)
+    directory_cache.invalidate()
     return db_doctor
 
+@app.get("/doctors/{doctor_id}/schedule")
+async def get_doctor_schedule(doctor_id: int, db: AsyncSession = Depends(get_db)):
+    documents = await load_schedules(db, [doctor_id])
+    if not documents:
+        raise HTTPException(status_code=404, detail="Doctor not found")
+    return documents[0]
+
+@app.put("/doctors/{doctor_id}/schedule")
+async def update_doctor_schedule(doctor_id: int, schedule: Schedule,
+                                 user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    doctor = await get_editable_doctor(doctor_id, user, db)
+    if any(d not in WEEKDAYS for d in schedule.weekdays):
+        raise HTTPException(status_code=400, detail=f"weekdays must be drawn from {','.join(WEEKDAYS)}")
+    if schedule.work_start >= schedule.work_end:
+        raise HTTPException(status_code=400, detail="work_start must be before work_end")
+    if not 5 <= schedule.slot_minutes <= 240:
+        raise HTTPException(status_code=400, detail="slot_minutes must be between 5 and 240")
+    if any(b.start >= b.end for b in schedule.breaks):
+        raise HTTPException(status_code=400, detail="Each break must start before it ends")
+
+    db_schedule = await db.get(ScheduleDB, doctor_id)
+    if db_schedule is None:
+        db_schedule = ScheduleDB(doctor_id=doctor_id)
+        db.add(db_schedule)
+    db_schedule.work_start = schedule.work_start
+    db_schedule.work_end = schedule.work_end
+    db_schedule.slot_minutes = schedule.slot_minutes
+    db_schedule.breaks = json.dumps([{"start": b.start.strftime("%H:%M"), "end": b.end.strftime("%H:%M")}
+                                     for b in schedule.breaks])
+    # available_days is part of the cached directory entry.
+    doctor.available_days = ",".join(d for d in WEEKDAYS if d in schedule.weekdays)
+    await directory_changed(db)
+    await schedules_changed(db)
+    await db.commit()
+    directory_cache.invalidate()
+    return (await load_schedules(db, [doctor_id]))[0]
+
+@app.post("/doctors/{doctor_id}/schedule/exceptions")
+async def add_schedule_exception(doctor_id: int, exception: ScheduleException,
+                                 user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    await get_editable_doctor(doctor_id, user, db)
+    if exception.start_date > exception.end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+    new_exception = ScheduleExceptionDB(doctor_id=doctor_id, start_date=exception.start_date,
+                                        end_date=exception.end_date, reason=exception.reason)
+    db.add(new_exception)
+    await schedules_changed(db)
+    await db.commit()
+    return {"id": new_exception.id, "start_date": new_exception.start_date, "end_date": new_exception.end_date,
+            "reason": new_exception.reason}
+
+@app.delete("/doctors/{doctor_id}/schedule/exceptions/{exception_id}")
+async def delete_schedule_exception(doctor_id: int, exception_id: int,
+                                    user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    await get_editable_doctor(doctor_id, user, db)
+    exception = await db.get(ScheduleExceptionDB, exception_id)
+    if not exception or exception.doctor_id != doctor_id:
+        raise HTTPException(status_code=404, detail="Schedule exception not found")
+    await db.delete(exception)
+    await schedules_changed(db)
+    await db.commit()
+    return {"message": "Schedule exception removed"}
+
+@app.get("/schedules")
+async def get_schedules(doctor_ids: str, db: AsyncSession = Depends(get_db)):
+    """Schedule templates for several doctors at once (comma-separated ids); unknown ids are omitted."""
+    return {"schedules": await load_schedules(db, parse_ids(doctor_ids, "doctor_ids"))}
+
 @app.get("/specializations")
-def get_specializations(db: Session = Depends(get_db)):
-    results = db.query(DoctorDB.specialization).distinct().all()
-    return {"specializations": [r[0] for r in results]}
+async def get_specializations():
+    async def load():
+        async with database.session() as db:
+            return {"specializations": list((await db.scalars(select(DoctorDB.specialization).distinct())).all())}
+
+    return await directory_cache.get("specializations", load)
 
 """
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+"""Baseline: doctors and schedule tables as created by create_all before migrations existed."""
+from sqlalchemy import Column, Date, DateTime, Float, Integer, MetaData, String, Table, Text, Time
+
+metadata = MetaData()
+
+doctors = Table(
+    "doctors", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, unique=True, nullable=True),
+    Column("first_name", String, nullable=False),
+    Column("last_name", String, nullable=False),
+    Column("specialization", String, nullable=False),
+    Column("license_number", String, unique=True, nullable=False),
+    Column("phone", String),
+    Column("email", String),
+    Column("consultation_fee", Float),
+    Column("available_days", String),
+    Column("created_at", DateTime),
+)
+
+doctor_schedules = Table(
+    "doctor_schedules", metadata,
+    Column("doctor_id", Integer, primary_key=True),
+    Column("work_start", Time, nullable=False),
+    Column("work_end", Time, nullable=False),
+    Column("slot_minutes", Integer, nullable=False),
+    Column("breaks", Text, nullable=True),
+    Column("updated_at", DateTime),
+)
+
+doctor_schedule_exceptions = Table(
+    "doctor_schedule_exceptions", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("doctor_id", Integer, nullable=False, index=True),
+    Column("start_date", Date, nullable=False),
+    Column("end_date", Date, nullable=False),
+    Column("reason", String, nullable=True),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn)
@@ -0,0 +1,22 @@
+"""Indexes for doctor search and directory filters.
+
+On Postgres, pg_trgm GIN indexes cover the ranked search text (must match
+SEARCH_TEXT in app.py exactly) and lower(specialization), which makes the
+existing ``/doctors?specialization=`` substring filter indexable too.
+"""
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_doctors_consultation_fee ON doctors (consultation_fee)"))
+    if conn.dialect.name != "postgresql":
+        return
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_doctors_search_trgm ON doctors USING gin "
+        "(lower(first_name || ' ' || last_name || ' ' || specialization || ' ' || license_number) gin_trgm_ops)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_doctors_specialization_trgm ON doctors USING gin "
+        "(lower(specialization) gin_trgm_ops)"
+    ))
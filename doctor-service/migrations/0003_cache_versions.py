@@ -0,0 +1,16 @@
+"""cache_versions: per-scope counters bumped on writes so every replica's cache notices."""
+from sqlalchemy import Column, Integer, MetaData, String, Table, insert, select
+
+metadata = MetaData()
+
+cache_versions = Table(
+    "cache_versions", metadata,
+    Column("scope", String, primary_key=True),
+    Column("version", Integer, nullable=False),
+)
+
+
+def upgrade(conn):
+    cache_versions.create(conn, checkfirst=True)
+    if conn.scalar(select(cache_versions.c.scope).where(cache_versions.c.scope == "doctors")) is None:
+        conn.execute(insert(cache_versions).values(scope="doctors", version=0))
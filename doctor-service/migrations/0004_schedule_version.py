@@ -0,0 +1,15 @@
+"""cache_versions 'schedules' scope: bumped with every schedule write, polled by appointment-service."""
+from sqlalchemy import Column, Integer, MetaData, String, Table, insert, select
+
+metadata = MetaData()
+
+cache_versions = Table(
+    "cache_versions", metadata,
+    Column("scope", String, primary_key=True),
+    Column("version", Integer, nullable=False),
+)
+
+
+def upgrade(conn):
+    if conn.scalar(select(cache_versions.c.scope).where(cache_versions.c.scope == "schedules")) is None:
+        conn.execute(insert(cache_versions).values(scope="schedules", version=0))
@@ -1,14 +1,26 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from sqlalchemy import create_engine, Column, Integer, String, Text, Date, DateTime
-from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from fastapi.middleware.gzip import GZipMiddleware
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, Index, func, select
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import Optional, List
-import requests
 import os
 from datetime import datetime, date
+from common.db import Database, env_flag
+from common.etag import ETagMiddleware, check_etag
+from common.expand import BatchLookup, expander
+from common.export import export_response
+from common.fastjson import columns_for
+from common.http import close_clients, get_client
+from common.instrumentation import instrument
+from common.migrations import run_migrations
+from common.pagination import NEXT_CURSOR_HEADER, PageParams, paginate_rows
+from common.profiling import install_profiler
+from common.static import mount_frontend
+from common.tokens import TokenVerifier
+from common.tracing import TRACE_ID_HEADER, install_tracing
 
 # ------------------------------
 # FastAPI setup
@@ -21,37 +33,41 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, TRACE_ID_HEADER],
 )
+app.add_middleware(ETagMiddleware)
+# Outermost, so ETags are computed on the uncompressed body.
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
 
-frontend_dir = "frontend"
-if os.path.isdir(frontend_dir):
-    app.mount("/static", StaticFiles(directory=frontend_dir), name="static")
-
-    @app.get("/")
-    def serve_index():
-        return FileResponse(os.path.join(frontend_dir, "index.html"))
-else:
-    @app.get("/")
-    def serve_index():
-        return {"service": "medical-records", "frontend": False}
+# frontend/build (scripts/build_static.py) when present, else the raw sources
+mount_frontend(app, "medical-records")
 
 # ------------------------------
 # Environment variables
 # ------------------------------
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8000")
+token_verifier = TokenVerifier.from_env(AUTH_SERVICE_URL)
+DOCTOR_SERVICE_URL = os.getenv("DOCTOR_SERVICE_URL", "http://doctor-service:8002")
+PATIENT_SERVICE_URL = os.getenv("PATIENT_SERVICE_URL", "http://patient-service:8001")
+EXPAND_CACHE_TTL = float(os.getenv("EXPAND_CACHE_TTL", "60"))
 
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT", "5432")
-DB_NAME = os.getenv("DB_NAME")
-
-DB_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# ?expand= sources. Records store the authoring doctor's and the patient's auth user ids.
+expand_lookups = {
+    "doctor": BatchLookup(get_client(DOCTOR_SERVICE_URL, name="Doctor service"), "/doctors",
+                          param="user_ids", key="user_id", ttl=EXPAND_CACHE_TTL),
+    # patient-service narrows /patients to the caller's own profile for patients.
+    "patient": BatchLookup(get_client(PATIENT_SERVICE_URL, name="Patient service"), "/patients",
+                           param="user_ids", key="user_id", ttl=EXPAND_CACHE_TTL, per_caller=True),
+}
 
-engine = create_engine(DB_URL)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# DB_USER/DB_PASSWORD/DB_HOST/DB_PORT/DB_NAME; DB_ASYNC=0 selects the sync driver
+database = Database.from_env()
+engine = database.engine
 Base = declarative_base()
 
+# Request, query, outbound-call and threadpool metrics at /metrics
+instrument(app, database)
+
 # ------------------------------
 # Database model
 # ------------------------------
@@ -67,8 +83,25 @@ class MedicalRecordDB(Base):
     notes = Column(Text, nullable=True)
     record_date = Column(Date, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Patient/doctor record lists ordered by record_date (migration 0002).
+    __table_args__ = (
+        Index("ix_medical_records_patient_date", "patient_id", "record_date", "id"),
+        Index("ix_medical_records_doctor_date", "doctor_id", "record_date", "id"),
+    )
+
+# Schema changes live in migrations/; DB_MIGRATE_ON_STARTUP=0 leaves them to a
+# separate job (python -m common.migrations <service>-service).
+@app.on_event("startup")
+async def migrate():
+    if env_flag("DB_MIGRATE_ON_STARTUP", "1"):
+        await run_migrations(database, "medical-records", os.path.join(os.path.dirname(__file__), "migrations"))
 
-Base.metadata.create_all(bind=engine)
+# Outbound connection pools (common/http.py), sync and async.
+@app.on_event("shutdown")
+async def close_service_clients():
+    await close_clients()
 
 # ------------------------------
 # Pydantic models
@@ -89,39 +122,42 @@ class MedicalRecordResponse(MedicalRecord):
     class Config:
         from_attributes = True
 
+class MedicalRecordExpanded(MedicalRecordResponse):
+    """List item shape; ``doctor``/``patient`` are only present when asked for with ``expand=``."""
+    doctor: Optional[dict] = None
+    patient: Optional[dict] = None
+
 # ------------------------------
 # Dependencies
 # ------------------------------
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with database.session() as db:
         yield db
-    finally:
-        db.close()
 
-def verify_token(authorization: str = Header(None)):
+async def verify_token(authorization: str = Header(None)):
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header missing")
-    try:
-        response = requests.get(
-            f"{AUTH_SERVICE_URL}/verify",
-            headers={"Authorization": authorization}
-        )
-        if response.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return response.json()["user"]
-    except requests.RequestException:
-        raise HTTPException(status_code=503, detail="Auth service unavailable")
+    return await token_verifier.averify(authorization)
+
+# Per-request SQL profiling: SQL_PROFILE at startup, PUT /debug/sql-profile at runtime
+install_profiler(app, database, verify_token)
+# Outermost: traceparent in and out, spans for requests, DB statements and service calls
+install_tracing(app, database, "medical-records-service")
 
 # ------------------------------
 # Routes
 # ------------------------------
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "healthy", "service": "medical-records"}
 
+@app.get("/health/db")
+async def db_pool_stats():
+    """Connection pool occupancy and checkout wait times, for sizing DB_POOL_SIZE against max_connections."""
+    return database.pool_stats()
+
 @app.post("/records", response_model=MedicalRecordResponse)
-def create_record(record: MedicalRecord, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def create_record(record: MedicalRecord, user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     if user["role"] not in ["doctor", "admin"]:
         raise HTTPException(status_code=403, detail="Only doctors or admins can create medical records")
     
@@ -141,26 +177,61 @@ def create_record(record: MedicalRecord, user: dict = Depends(verify_token), db:
         record_date=record_date
     )
     db.add(new_record)
-    db.commit()
-    db.refresh(new_record)
+    await db.commit()
+    await db.refresh(new_record)
     return new_record
 
-@app.get("/records/patient/{patient_id}", response_model=List[MedicalRecordResponse])
-def get_patient_records(patient_id: int, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
+# List routes select just the response columns and skip ORM hydration (common/fastjson.py).
+RECORD_COLUMNS = columns_for(MedicalRecordDB, MedicalRecordResponse)
+# Newest first; id breaks ties between records on the same date.
+RECORD_ORDER = [MedicalRecordDB.record_date, MedicalRecordDB.id]
+
+@app.get("/records/patient/{patient_id}", response_model=List[MedicalRecordExpanded])
+async def get_patient_records(patient_id: int, response: Response, page: PageParams = Depends(),
+                              expand: Optional[str] = None, authorization: str = Header(None),
+                              user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     if user["user_id"] != patient_id and user["role"] not in ["doctor", "admin"]:
         raise HTTPException(status_code=403, detail="Not authorized to view these records")
     
-    records = db.query(MedicalRecordDB).filter(MedicalRecordDB.patient_id == patient_id).order_by(MedicalRecordDB.record_date.desc()).all()
-    return records
+    query = select(*RECORD_COLUMNS).where(MedicalRecordDB.patient_id == patient_id)
+    return await paginate_rows(db, query, RECORD_ORDER, page, response,
+                               expand=expander(expand, expand_lookups, authorization, user))
+
+@app.get("/records/my", response_model=List[MedicalRecordExpanded])
+async def get_my_records(request: Request, response: Response, page: PageParams = Depends(),
+                         expand: Optional[str] = None, authorization: str = Header(None),
+                         user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    expand_hook = expander(expand, expand_lookups, authorization, user)
+    mine = MedicalRecordDB.patient_id == user["user_id"]
+    if expand_hook is None:
+        count, last_update = (await db.execute(select(func.count(), func.max(MedicalRecordDB.updated_at)).where(mine))).one()
+        check_etag(request, response, user["user_id"], count, last_update)
+    return await paginate_rows(db, select(*RECORD_COLUMNS).where(mine), RECORD_ORDER, page, response,
+                               expand=expand_hook)
 
-@app.get("/records/my", response_model=List[MedicalRecordResponse])
-def get_my_records(user: dict = Depends(verify_token), db: Session = Depends(get_db)):
-    records = db.query(MedicalRecordDB).filter(MedicalRecordDB.patient_id == user["user_id"]).order_by(MedicalRecordDB.record_date.desc()).all()
-    return records
+@app.get("/records/export")
+async def export_records(format: str = "ndjson", start: Optional[date] = None, end: Optional[date] = None,
+                         doctor_id: Optional[int] = None, patient_id: Optional[int] = None,
+                         user: dict = Depends(verify_token)):
+    """Stream records (by record_date, inclusive) as NDJSON or CSV; doctors and patients only get their own."""
+    if user["role"] == "doctor":
+        doctor_id = user["user_id"]
+    elif user["role"] != "admin":
+        patient_id = user["user_id"]
+    query = select(*MedicalRecordDB.__table__.columns)
+    if start:
+        query = query.where(MedicalRecordDB.record_date >= start)
+    if end:
+        query = query.where(MedicalRecordDB.record_date <= end)
+    if doctor_id is not None:
+        query = query.where(MedicalRecordDB.doctor_id == doctor_id)
+    if patient_id is not None:
+        query = query.where(MedicalRecordDB.patient_id == patient_id)
+    return export_response(database, query.order_by(MedicalRecordDB.id), format, "medical-records")
 
 @app.get("/records/{record_id}", response_model=MedicalRecordResponse)
-def get_record(record_id: int, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
-    record = db.query(MedicalRecordDB).filter(MedicalRecordDB.id == record_id).first()
+async def get_record(record_id: int, user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    record = await db.get(MedicalRecordDB, record_id)
     if not record:
         raise HTTPException(status_code=404, detail="Record not found")
     if record.patient_id != user["user_id"] and user["role"] not in ["doctor", "admin"]:
@@ -168,20 +239,23 @@ def get_record(record_id: int, user: dict = Depends(verify_token), db: Session =
     return record
 
 
-@app.get("/records/doctor/my", response_model=List[MedicalRecordResponse])
-def get_records_for_doctor(user: dict = Depends(verify_token), db: Session = Depends(get_db)):
+@app.get("/records/doctor/my", response_model=List[MedicalRecordExpanded])
+async def get_records_for_doctor(response: Response, page: PageParams = Depends(), expand: Optional[str] = None,
+                                 authorization: str = Header(None), user: dict = Depends(verify_token),
+                                 db: AsyncSession = Depends(get_db)):
     # only doctors or admins can call this endpoint
     if user["role"] not in ["doctor", "admin"]:
         raise HTTPException(status_code=403, detail="Not authorized")
-    records = db.query(MedicalRecordDB).filter(MedicalRecordDB.doctor_id == user["user_id"]).order_by(MedicalRecordDB.record_date.desc()).all()
-    return records
+    query = select(*RECORD_COLUMNS).where(MedicalRecordDB.doctor_id == user["user_id"])
+    return await paginate_rows(db, query, RECORD_ORDER, page, response,
+                               expand=expander(expand, expand_lookups, authorization, user))
 
 @app.put("/records/{record_id}", response_model=MedicalRecordResponse)
-def update_record(record_id: int, record: MedicalRecord, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def update_record(record_id: int, record: MedicalRecord, user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
     if user["role"] not in ["doctor", "admin"]:
         raise HTTPException(status_code=403, detail="Only doctors or admins can update records")
     
-    db_record = db.query(MedicalRecordDB).filter(MedicalRecordDB.id == record_id).first()
+    db_record = await db.get(MedicalRecordDB, record_id)
     if not db_record:
         raise HTTPException(status_code=404, detail="Record not found")
     if db_record.doctor_id != user["user_id"] and user["role"] != "admin":
@@ -196,8 +270,8 @@ def update_record(record_id: int, record: MedicalRecord, user: dict = Depends(ve
     else:
         db_record.record_date = record.record_date
     
-    db.commit()
-    db.refresh(db_record)
+    # expire_on_commit is off and updated_at is set client-side, so the object is already current.
+    await db.commit()
     return db_record
 
 """
@@ -0,0 +1,22 @@
+"""Baseline: the medical_records table as created by create_all before migrations existed."""
+from sqlalchemy import Column, Date, DateTime, Integer, MetaData, Table, Text
+
+metadata = MetaData()
+
+medical_records = Table(
+    "medical_records", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("patient_id", Integer, nullable=False),
+    Column("doctor_id", Integer, nullable=False),
+    Column("appointment_id", Integer, nullable=True),
+    Column("diagnosis", Text, nullable=False),
+    Column("prescription", Text, nullable=True),
+    Column("lab_results", Text, nullable=True),
+    Column("notes", Text, nullable=True),
+    Column("record_date", Date, nullable=False),
+    Column("created_at", DateTime),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn)
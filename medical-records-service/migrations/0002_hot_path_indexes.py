@@ -0,0 +1,13 @@
+"""Composite indexes for patient and doctor record lists ordered by record_date, then id."""
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_medical_records_patient_date "
+        "ON medical_records (patient_id, record_date, id)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_medical_records_doctor_date "
+        "ON medical_records (doctor_id, record_date, id)"
+    ))
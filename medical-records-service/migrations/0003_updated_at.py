@@ -0,0 +1,9 @@
+"""medical_records.updated_at: last write time, a cheap validator for conditional GETs."""
+from sqlalchemy import inspect, text
+
+
+def upgrade(conn):
+    if "updated_at" in {c["name"] for c in inspect(conn).get_columns("medical_records")}:
+        return
+    conn.execute(text("ALTER TABLE medical_records ADD COLUMN updated_at TIMESTAMP"))
+    conn.execute(text("UPDATE medical_records SET updated_at = created_at"))
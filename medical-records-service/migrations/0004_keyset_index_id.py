@@ -0,0 +1,21 @@
+"""Add id to the record list indexes so the keyset ORDER BY is fully covered.
+
+Pages are ordered by record_date, then id, and continue with
+``WHERE (..., id) < cursor``. Indexes that 0002 built before it included
+id leave rows sharing a date to be sorted; those are rebuilt.
+"""
+from sqlalchemy import inspect, text
+
+INDEXES = {
+    "ix_medical_records_patient_date": ["patient_id", "record_date", "id"],
+    "ix_medical_records_doctor_date": ["doctor_id", "record_date", "id"],
+}
+
+
+def upgrade(conn):
+    existing = {i["name"]: i["column_names"] for i in inspect(conn).get_indexes("medical_records")}
+    for name, columns in INDEXES.items():
+        if existing.get(name) == columns:
+            continue
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        conn.execute(text(f"CREATE INDEX {name} ON medical_records ({', '.join(columns)})"))
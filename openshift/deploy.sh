@@ -42,7 +42,8 @@ oc new-app $GIT_REPO \
   -e DB_NAME=healthcare \
   -e DB_USER=healthcare_user \
   -e DB_PASSWORD=supersecurepassword \
-  -e SECRET_KEY="your-super-secret-jwt-key-change-this"
+  -e SECRET_KEY="your-super-secret-jwt-key-change-this" \
+  -e SERVICE_TOKEN="change-this-internal-service-token"
 
 echo "Deploying Patient Service..."
 oc new-app $GIT_REPO \
@@ -74,7 +75,8 @@ oc new-app $GIT_REPO \
   -e DB_USER=healthcare_user \
   -e DB_PASSWORD=supersecurepassword \
   -e AUTH_SERVICE_URL=http://auth-service:8000 \
-  -e NOTIFICATION_SERVICE_URL=http://notification-service:8005
+  -e NOTIFICATION_SERVICE_URL=http://notification-service:8005 \
+  -e SERVICE_TOKEN="change-this-internal-service-token"
 
 echo "Deploying Medical Records Service..."
 oc new-app $GIT_REPO \
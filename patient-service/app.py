@@ -1,14 +1,29 @@
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from sqlalchemy import create_engine, Column, Integer, String, Text, Date, DateTime
-from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from fastapi.middleware.gzip import GZipMiddleware
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, select
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import Optional, List
-import requests
+import asyncio
+import logging
 import os
 from datetime import datetime, date
+from common.db import Database, env_flag
+from common.etag import ETagMiddleware
+from common.expand import parse_ids
+from common.fastjson import columns_for, rows_response
+from common.http import close_clients, get_client
+from common.instrumentation import instrument
+from common.migrations import run_migrations
+from common.pagination import NEXT_CURSOR_HEADER, PageParams, paginate_rows
+from common.profiling import install_profiler
+from common.static import mount_frontend
+from common.tokens import TokenVerifier
+from common.tracing import TRACE_ID_HEADER, install_tracing
+
+logger = logging.getLogger(__name__)
 
 # ------------------------------
 # FastAPI setup
@@ -21,37 +36,39 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, TRACE_ID_HEADER],
 )
+app.add_middleware(ETagMiddleware)
+# Outermost, so ETags are computed on the uncompressed body.
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
 
-frontend_dir = "frontend"
-if os.path.isdir(frontend_dir):
-    app.mount("/static", StaticFiles(directory=frontend_dir), name="static")
-
-    @app.get("/")
-    def serve_index():
-        return FileResponse(os.path.join(frontend_dir, "index.html"))
-else:
-    @app.get("/")
-    def serve_index():
-        return {"service": "patient", "frontend": False}
+# frontend/build (scripts/build_static.py) when present, else the raw sources
+mount_frontend(app, "patient")
 
 # ------------------------------
 # Environment variables
 # ------------------------------
 AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth-service:8000")
+token_verifier = TokenVerifier.from_env(AUTH_SERVICE_URL)
 
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT", "5432")
-DB_NAME = os.getenv("DB_NAME")
-
-DB_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Dashboard fan-out targets
+APPOINTMENT_SERVICE_URL = os.getenv("APPOINTMENT_SERVICE_URL", "http://appointment-service:8003")
+MEDICAL_RECORDS_SERVICE_URL = os.getenv("MEDICAL_RECORDS_SERVICE_URL", "http://medical-records-service:8004")
+BILLING_SERVICE_URL = os.getenv("BILLING_SERVICE_URL", "http://billing-service:8006")
+appointment_client = get_client(APPOINTMENT_SERVICE_URL, name="Appointment service")
+records_client = get_client(MEDICAL_RECORDS_SERVICE_URL, name="Medical records service")
+billing_client = get_client(BILLING_SERVICE_URL, name="Billing service")
+DASHBOARD_BRANCH_TIMEOUT = float(os.getenv("DASHBOARD_BRANCH_TIMEOUT", "2"))
+DASHBOARD_ITEMS = int(os.getenv("DASHBOARD_ITEMS", "10"))
 
-engine = create_engine(DB_URL)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# DB_USER/DB_PASSWORD/DB_HOST/DB_PORT/DB_NAME; DB_ASYNC=0 selects the sync driver
+database = Database.from_env()
+engine = database.engine
 Base = declarative_base()
 
+# Request, query, outbound-call and threadpool metrics at /metrics
+instrument(app, database)
+
 # ------------------------------
 # Database model
 # ------------------------------
@@ -70,7 +87,17 @@ class PatientDB(Base):
     allergies = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-Base.metadata.create_all(bind=engine)
+# Schema changes live in migrations/; DB_MIGRATE_ON_STARTUP=0 leaves them to a
+# separate job (python -m common.migrations <service>-service).
+@app.on_event("startup")
+async def migrate():
+    if env_flag("DB_MIGRATE_ON_STARTUP", "1"):
+        await run_migrations(database, "patient", os.path.join(os.path.dirname(__file__), "migrations"))
+
+# Outbound connection pools (common/http.py), sync and async.
+@app.on_event("shutdown")
+async def close_service_clients():
+    await close_clients()
 
 # ------------------------------
 # Pydantic models
@@ -95,37 +122,35 @@ class PatientResponse(Patient):
 # ------------------------------
 # Dependencies
 # ------------------------------
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with database.session() as db:
         yield db
-    finally:
-        db.close()
 
-def verify_token(authorization: str = Header(None)):
+async def verify_token(authorization: str = Header(None)):
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header missing")
-    try:
-        response = requests.get(
-            f"{AUTH_SERVICE_URL}/verify",
-            headers={"Authorization": authorization}
-        )
-        if response.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return response.json()["user"]
-    except requests.RequestException:
-        raise HTTPException(status_code=503, detail="Auth service unavailable")
+    return await token_verifier.averify(authorization)
+
+# Per-request SQL profiling: SQL_PROFILE at startup, PUT /debug/sql-profile at runtime
+install_profiler(app, database, verify_token)
+# Outermost: traceparent in and out, spans for requests, DB statements and service calls
+install_tracing(app, database, "patient-service")
 
 # ------------------------------
 # Routes
 # ------------------------------
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"status": "healthy", "service": "patient"}
 
+@app.get("/health/db")
+async def db_pool_stats():
+    """Connection pool occupancy and checkout wait times, for sizing DB_POOL_SIZE against max_connections."""
+    return database.pool_stats()
+
 @app.post("/patients", response_model=PatientResponse)
-def create_patient(patient: Patient, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
-    existing = db.query(PatientDB).filter(PatientDB.user_id == user["user_id"]).first()
+async def create_patient(patient: Patient, user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    existing = await db.scalar(select(PatientDB).where(PatientDB.user_id == user["user_id"]))
     if existing:
         raise HTTPException(status_code=400, detail="Patient already exists for this user")
     
@@ -146,33 +171,100 @@ def create_patient(patient: Patient, user: dict = Depends(verify_token), db: Ses
         allergies=patient.allergies
     )
     db.add(new_patient)
-    db.commit()
-    db.refresh(new_patient)
+    await db.commit()
+    await db.refresh(new_patient)
     return new_patient
 
 @app.get("/patients/me", response_model=PatientResponse)
-def get_my_patient(user: dict = Depends(verify_token), db: Session = Depends(get_db)):
-    patient = db.query(PatientDB).filter(PatientDB.user_id == user["user_id"]).first()
+async def get_my_patient(user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    patient = await db.scalar(select(PatientDB).where(PatientDB.user_id == user["user_id"]))
     if not patient:
         raise HTTPException(status_code=404, detail="Patient profile not found")
     return patient
 
+async def dashboard_section(client, path: str, authorization: str, **params) -> dict:
+    # The deadline stops retries in time; dashboard_branch's timeout is the hard cap.
+    response = await client.aget(path, params={"limit": DASHBOARD_ITEMS, **params},
+                                 headers={"Authorization": authorization}, deadline=DASHBOARD_BRANCH_TIMEOUT)
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail=f"{client.name} returned {response.status_code}")
+    return {"items": response.json(), "has_more": NEXT_CURSOR_HEADER in response.headers}
+
+async def dashboard_branch(name: str, branch, errors: dict):
+    """Await one branch for at most DASHBOARD_BRANCH_TIMEOUT; on failure record why and return None."""
+    try:
+        async with asyncio.timeout(DASHBOARD_BRANCH_TIMEOUT):
+            return await branch
+    except TimeoutError:
+        errors[name] = "timed out"
+    except HTTPException as e:
+        errors[name] = e.detail
+    except Exception as e:
+        # A bad body or a DB error costs this branch only, not the whole dashboard.
+        logger.exception("Dashboard branch %s failed", name)
+        errors[name] = f"failed ({type(e).__name__})"
+    return None
+
+@app.get("/patients/me/dashboard")
+async def get_my_dashboard(authorization: str = Header(None), user: dict = Depends(verify_token),
+                           db: AsyncSession = Depends(get_db)):
+    """Profile, latest appointments, records and invoices for the patient UI in one call.
+
+    The token is verified here once; the other services are called
+    concurrently, so the page waits for the slowest branch rather than the
+    sum of them. A branch that fails or exceeds DASHBOARD_BRANCH_TIMEOUT is
+    null in the result, with the reason under ``errors``.
+    """
+    async def profile():
+        patient = await db.scalar(select(PatientDB).where(PatientDB.user_id == user["user_id"]))
+        return PatientResponse.model_validate(patient).model_dump(mode="json") if patient else None
+
+    errors = {}
+    patient, appointments, records, invoices = await asyncio.gather(
+        dashboard_branch("patient", profile(), errors),
+        dashboard_branch("appointments", dashboard_section(
+            appointment_client, "/appointments/my", authorization, expand="doctor"), errors),
+        dashboard_branch("records", dashboard_section(records_client, "/records/my", authorization), errors),
+        dashboard_branch("invoices", dashboard_section(billing_client, "/invoices/my", authorization), errors),
+    )
+    return {"patient": patient, "appointments": appointments, "records": records, "invoices": invoices,
+            "errors": errors, "partial": bool(errors)}
+
 @app.get("/patients/{patient_id}", response_model=PatientResponse)
-def get_patient(patient_id: int, db: Session = Depends(get_db)):
-    patient = db.query(PatientDB).filter(PatientDB.id == patient_id).first()
+async def get_patient(patient_id: int, db: AsyncSession = Depends(get_db)):
+    patient = await db.get(PatientDB, patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
     return patient
 
+# List routes select just the response columns and skip ORM hydration (common/fastjson.py).
+PATIENT_COLUMNS = columns_for(PatientDB, PatientResponse)
+
 @app.get("/patients", response_model=List[PatientResponse])
-def list_patients(user: dict = Depends(verify_token), db: Session = Depends(get_db)):
+async def list_patients(response: Response, page: PageParams = Depends(), ids: Optional[str] = None,
+                        user_ids: Optional[str] = None, user: dict = Depends(verify_token),
+                        db: AsyncSession = Depends(get_db)):
+    """All patients, paginated (admins and doctors).
+
+    ``ids`` or ``user_ids`` (comma-separated) instead fetch just those patients,
+    unpaginated; patients only get their own profile back.
+    """
+    if ids is not None or user_ids is not None:
+        if ids is not None and user_ids is not None:
+            raise HTTPException(status_code=400, detail="Give either ids or user_ids")
+        column = PatientDB.id if ids is not None else PatientDB.user_id
+        keys = parse_ids(ids, "ids") if ids is not None else parse_ids(user_ids, "user_ids")
+        query = select(*PATIENT_COLUMNS).where(column.in_(keys)).order_by(PatientDB.id)
+        if user["role"] not in ["admin", "doctor"]:
+            query = query.where(PatientDB.user_id == user["user_id"])
+        return rows_response((await db.execute(query)).all())
     if user["role"] not in ["admin", "doctor"]:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return db.query(PatientDB).all()
+    return await paginate_rows(db, select(*PATIENT_COLUMNS), [PatientDB.id], page, response, descending=False)
 
 @app.put("/patients/{patient_id}", response_model=PatientResponse)
-def update_patient(patient_id: int, patient: Patient, user: dict = Depends(verify_token), db: Session = Depends(get_db)):
-    db_patient = db.query(PatientDB).filter(PatientDB.id == patient_id).first()
+async def update_patient(patient_id: int, patient: Patient, user: dict = Depends(verify_token), db: AsyncSession = Depends(get_db)):
+    db_patient = await db.get(PatientDB, patient_id)
     if not db_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
     
@@ -191,8 +283,8 @@ def update_patient(patient_id: int, patient: Patient, user: dict = Depends(verif
     db_patient.blood_type = patient.blood_type
     db_patient.allergies = patient.allergies
     
-    db.commit()
-    db.refresh(db_patient)
+    await db.commit()
+    await db.refresh(db_patient)
     return db_patient
 
 """
@@ -25,6 +25,7 @@ function init(){
         logoutBtn.onclick = logoutAndRedirect;
         navEl.appendChild(logoutBtn);
         if(!nav) container.insertBefore(navEl, container.firstChild);
+        loadDashboard();
     } else if (role === 'doctor'){
         // show doctor+patient nav when a doctor signs in (doctor can navigate between doctor and patient views)
         let navEl = nav || document.createElement('nav');
@@ -89,6 +90,28 @@ function init(){
 }
 document.addEventListener('DOMContentLoaded', init);
 
+// patient view: profile, appointments, records and invoices from one aggregated call
+async function loadDashboard(){
+    const target = document.getElementById('patients-list');
+    if(!target) return;
+    try{
+        const token = localStorage.getItem('access_token') || '';
+        const res = await fetch('http://localhost:8001/patients/me/dashboard', { headers: { 'Authorization': `Bearer ${token}` } });
+        if(!res.ok){ target.innerText = 'Error loading dashboard'; return; }
+        const d = await res.json();
+        const section = (title, key, row) => {
+            if(d[key] === null) return `<h3>${title}</h3><p class="small">Unavailable right now (${d.errors[key] || 'error'})</p>`;
+            if(d[key].items.length === 0) return `<h3>${title}</h3><p class="small">None</p>`;
+            return `<h3>${title}</h3><table>${d[key].items.map(row).join('')}</table>`;
+        };
+        let html = d.patient ? `<h2>${d.patient.first_name} ${d.patient.last_name}</h2>` : '<p class="small">No patient profile yet</p>';
+        html += section('Appointments', 'appointments', a => `<tr><td>${a.appointment_date} ${a.appointment_time}</td><td>${a.doctor ? `Dr. ${a.doctor.first_name} ${a.doctor.last_name}` : a.doctor_id}</td><td>${a.status}</td></tr>`);
+        html += section('Medical records', 'records', r => `<tr><td>${r.record_date}</td><td>${r.diagnosis || ''}</td></tr>`);
+        html += section('Invoices', 'invoices', i => `<tr><td>${i.invoice_date}</td><td>${i.amount}</td><td>${i.status}</td></tr>`);
+        target.innerHTML = html;
+    }catch(err){ target.innerText = 'Error loading dashboard'; console.error(err); }
+}
+
 function logoutAndRedirect(){
     try{
         localStorage.removeItem('access_token');
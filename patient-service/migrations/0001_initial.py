@@ -0,0 +1,23 @@
+"""Baseline: the patients table as created by create_all before migrations existed."""
+from sqlalchemy import Column, Date, DateTime, Integer, MetaData, String, Table, Text
+
+metadata = MetaData()
+
+patients = Table(
+    "patients", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, unique=True, nullable=False),
+    Column("first_name", String, nullable=False),
+    Column("last_name", String, nullable=False),
+    Column("date_of_birth", Date, nullable=False),
+    Column("gender", String, nullable=True),
+    Column("phone", String, nullable=True),
+    Column("address", Text, nullable=True),
+    Column("blood_type", String, nullable=True),
+    Column("allergies", Text, nullable=True),
+    Column("created_at", DateTime),
+)
+
+
+def upgrade(conn):
+    metadata.create_all(conn)
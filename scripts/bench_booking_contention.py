@@ -0,0 +1,78 @@
+"""Booking-rush benchmark: N concurrent clients fight over the same few slots.
+
+Runs against a live appointment-service and checks that each slot was booked
+at most once while reporting throughput and latency under contention.
+
+    python scripts/bench_booking_contention.py --clients 200 --slots 8 \
+        --base-url http://localhost:8003 --doctor-id 1 --date 2030-01-07
+
+Tokens are signed locally with SECRET_KEY (HS256), so the service must be in
+local verification mode with the same key.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from collections import Counter
+
+import httpx
+import jwt
+
+
+def make_token(user_id: int, secret: str) -> str:
+    payload = {"user_id": user_id, "username": f"bench{user_id}", "role": "patient",
+               "exp": int(time.time()) + 3600}
+    return jwt.encode(payload, secret, algorithm="HS256")
+
+
+async def book(client, token, body, results):
+    start = time.perf_counter()
+    response = await client.post("/appointments", json=body, headers={"Authorization": f"Bearer {token}"})
+    results.append((body["appointment_time"], response.status_code, time.perf_counter() - start))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8003")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--slots", type=int, default=8, help="slots contended for, starting at 09:00 hourly")
+    parser.add_argument("--doctor-id", type=int, default=1)
+    parser.add_argument("--date", required=True, help="YYYY-MM-DD with no existing bookings for the doctor")
+    parser.add_argument("--secret", default=os.getenv("SECRET_KEY", "your-secret-key-change-in-production"))
+    args = parser.parse_args()
+
+    slots = [f"{9 + i:02d}:00" for i in range(args.slots)]
+    tokens = [make_token(100000 + i, args.secret) for i in range(args.clients)]
+    results = []
+    limits = httpx.Limits(max_connections=args.clients)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            book(client, token, {"doctor_id": args.doctor_id, "appointment_date": args.date,
+                                 "appointment_time": random.choice(slots)}, results)
+            for token in tokens
+        ))
+        elapsed = time.perf_counter() - start
+
+    statuses = Counter(status for _, status, _ in results)
+    booked = Counter(slot for slot, status, _ in results if status == 200)
+    latencies = sorted(latency for _, _, latency in results)
+    double_booked = {slot: n for slot, n in booked.items() if n > 1}
+
+    print(f"clients={args.clients} slots={args.slots} elapsed={elapsed:.3f}s "
+          f"throughput={len(results) / elapsed:.1f} req/s")
+    print(f"status codes: {dict(statuses)}")
+    print(f"latency p50={statistics.median(latencies) * 1000:.1f}ms "
+          f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms "
+          f"max={latencies[-1] * 1000:.1f}ms")
+    print(f"slots booked: {len(booked)}/{args.slots}")
+    if double_booked:
+        print(f"DOUBLE BOOKED: {double_booked}")
+        raise SystemExit(1)
+    print("no slot was booked more than once")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
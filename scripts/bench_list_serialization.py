@@ -0,0 +1,104 @@
+"""Compare the ORM + response_model list path with the Core row fast path.
+
+Seeds N appointments (default 10k) for one patient and times, for the
+whole list, both ways of producing the response body:
+
+- orm:  select(AppointmentModel) -> ORM objects -> FastAPI response_model
+        validation/serialization -> JSONResponse
+- core: select(*APPOINTMENT_COLUMNS) -> rows -> rows_response (orjson)
+
+Both run through the service's own session and models; the body bytes are
+checked to decode to the same JSON.
+
+    PYTHONPATH=. python scripts/bench_list_serialization.py --rows 10000
+    PYTHONPATH=. python scripts/bench_list_serialization.py --url postgresql+asyncpg://...
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta, time as dtime
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_service(url: str):
+    from common.db import Database
+    Database.from_env = classmethod(lambda cls, **kw: cls(url, use_async=True, **kw))
+    os.environ.setdefault("DB_MIGRATE_ON_STARTUP", "1")
+    spec = importlib.util.spec_from_file_location("appointment_app", os.path.join(ROOT, "appointment-service", "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def run(args):
+    url = args.url or f"sqlite+aiosqlite:///{tempfile.mktemp(suffix='.db')}"
+    svc = load_service(url)
+    await svc.migrate()
+    from sqlalchemy import delete, insert, select
+    from common.fastjson import rows_response
+
+    Model = svc.AppointmentModel
+    async with svc.database.session() as db:
+        await db.execute(delete(Model).where(Model.patient_id == args.patient_id))
+        rows = [{"patient_id": args.patient_id, "doctor_id": 1 + i % 50, "status": "scheduled",
+                 "appointment_date": date(2030, 1, 1) + timedelta(days=i // 8),
+                 "appointment_time": dtime(9 + i % 8), "reason": f"visit {i}", "notes": None}
+                for i in range(args.rows)]
+        await db.execute(insert(Model), rows)
+        await db.commit()
+
+    order = [k.desc() for k in svc.APPOINTMENT_ORDER]
+    field = create_response_field(name="response", type_=List[svc.AppointmentResponse])
+
+    async def orm_path():
+        async with svc.database.session() as db:
+            objs = (await db.scalars(select(Model).where(Model.patient_id == args.patient_id).order_by(*order))).all()
+            content = await serialize_response(field=field, response_content=objs, is_coroutine=True)
+            return JSONResponse(content).body
+
+    async def core_path():
+        async with svc.database.session() as db:
+            result = (await db.execute(
+                select(*svc.APPOINTMENT_COLUMNS).where(Model.patient_id == args.patient_id).order_by(*order)
+            )).all()
+            return rows_response(result).body
+
+    assert json.loads(await orm_path()) == json.loads(await core_path()), "paths disagree"
+    print(f"rows={args.rows} repeats={args.repeats} db={url.split('://')[0]}")
+    results = {}
+    for name, path in (("orm", orm_path), ("core", core_path)):
+        timings = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            await path()
+            timings.append(time.perf_counter() - start)
+        results[name] = statistics.median(timings)
+        print(f"{name:5s} median={results[name] * 1000:8.1f}ms  min={min(timings) * 1000:8.1f}ms")
+    print(f"speedup: {results['orm'] / results['core']:.1f}x")
+    await svc.database.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=7)
+    parser.add_argument("--patient-id", type=int, default=900001)
+    parser.add_argument("--url", help="async SQLAlchemy URL; defaults to a temporary SQLite file")
+    sys.path.insert(0, ROOT)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Login benchmark: throughput and latency of /login, and whether it stalls the service.
+
+Registers --users accounts on a live auth-service (skipped if they already
+exist), then sends --requests logins with --concurrency in flight, mixing in
+--bad-ratio wrong passwords. While that runs, /health is polled every 10ms:
+its latency shows whether password hashing is blocking the event loop.
+
+    python scripts/bench_login.py --base-url http://localhost:8000 \
+        --users 50 --requests 1000 --concurrency 32
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter
+
+import httpx
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[max(int(len(values) * q) - 1, 0)]
+
+
+def summary(latencies):
+    return (f"p50={statistics.median(latencies) * 1000:.1f}ms "
+            f"p95={percentile(latencies, 0.95) * 1000:.1f}ms "
+            f"max={max(latencies) * 1000:.1f}ms")
+
+
+async def register(client, i, password):
+    body = {"username": f"benchlogin{i}", "email": f"benchlogin{i}@example.com",
+            "password": password, "role": "patient"}
+    response = await client.post("/register", json=body)
+    if response.status_code not in (200, 400):
+        raise SystemExit(f"register failed: {response.status_code} {response.text}")
+
+
+async def login_worker(client, queue, password, bad_ratio, results):
+    while True:
+        try:
+            i = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        ok = random.random() >= bad_ratio
+        body = {"username": f"benchlogin{i}", "password": password if ok else password + "x"}
+        start = time.perf_counter()
+        response = await client.post("/login", json=body)
+        results.append((ok, response.status_code, time.perf_counter() - start))
+
+
+async def poll_health(client, stop, latencies):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/health")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--bad-ratio", type=float, default=0.1, help="fraction of logins with a wrong password")
+    parser.add_argument("--password", default="bench-login-password")
+    args = parser.parse_args()
+
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        for i in range(args.users):
+            await register(client, i, args.password)
+
+        queue = asyncio.Queue()
+        for _ in range(args.requests):
+            queue.put_nowait(random.randrange(args.users))
+        results, health = [], []
+        stop = asyncio.Event()
+        poller = asyncio.create_task(poll_health(client, stop, health))
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            login_worker(client, queue, args.password, args.bad_ratio, results)
+            for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await poller
+
+    wrong = [(ok, status) for ok, status, _ in results if (status == 200) != ok]
+    print(f"requests={len(results)} concurrency={args.concurrency} elapsed={elapsed:.3f}s "
+          f"throughput={len(results) / elapsed:.1f} logins/s")
+    print(f"status codes: {dict(Counter(status for _, status, _ in results))}")
+    print(f"login latency  {summary([latency for _, _, latency in results])}")
+    print(f"/health during {summary(health)} ({len(health)} polls)")
+    if wrong:
+        print(f"UNEXPECTED RESULTS: {len(wrong)} logins did not match the password sent")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+"""Measure what the /metrics instrumentation costs.
+
+- request path: the same small FastAPI app with and without MetricsMiddleware,
+  driven in-process (no network), mean time per request
+- query path: ``SELECT 1`` on in-memory SQLite with and without the
+  cursor-execute listeners
+- scrape: rendering /metrics with a realistic number of series
+
+    PYTHONPATH=. python scripts/bench_metrics_overhead.py --requests 5000
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, text
+
+from common.instrumentation import MetricsMiddleware, instrument_engine
+from common.metrics import REGISTRY
+
+
+def make_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        return {"id": item_id, "name": "item"}
+
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def time_requests(app, n: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(200):
+            await client.get(f"/items/{i}")
+        start = time.perf_counter()
+        for i in range(n):
+            await client.get(f"/items/{i}")
+        return (time.perf_counter() - start) / n
+
+
+def time_queries(instrumented: bool, n: int) -> float:
+    engine = create_engine("sqlite://")
+    if instrumented:
+        instrument_engine(engine)
+    with engine.connect() as conn:
+        statement = text("SELECT 1")
+        start = time.perf_counter()
+        for _ in range(n):
+            conn.execute(statement).scalar()
+        elapsed = time.perf_counter() - start
+    engine.dispose()
+    return elapsed / n
+
+
+def time_render(routes: int, repeats: int = 50) -> tuple:
+    family = REGISTRY.histogram("bench_request_duration_seconds", "bench", ("route", "method", "status"))
+    for r in range(routes):
+        for status in (200, 404, 500):
+            family.labels(f"/bench/{r}/{{id}}", "GET", status).observe(0.01)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        body = REGISTRY.render()
+    return (time.perf_counter() - start) / repeats, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--routes", type=int, default=40, help="route templates to fill the registry with")
+    args = parser.parse_args()
+
+    # Alternate the variants and keep each one's best round, to damp noise.
+    rounds = [(asyncio.run(time_requests(make_app(False), args.requests)),
+               asyncio.run(time_requests(make_app(True), args.requests))) for _ in range(args.rounds)]
+    plain, measured = min(r[0] for r in rounds), min(r[1] for r in rounds)
+    print(f"request  plain={plain * 1e6:7.1f}us  instrumented={measured * 1e6:7.1f}us  "
+          f"overhead={(measured - plain) * 1e6:+6.1f}us ({(measured / plain - 1) * 100:+.1f}%)")
+
+    rounds = [(time_queries(False, args.queries), time_queries(True, args.queries)) for _ in range(args.rounds)]
+    plain, measured = min(r[0] for r in rounds), min(r[1] for r in rounds)
+    print(f"query    plain={plain * 1e6:7.1f}us  instrumented={measured * 1e6:7.1f}us  "
+          f"overhead={(measured - plain) * 1e6:+6.1f}us ({(measured / plain - 1) * 100:+.1f}%)")
+
+    seconds, size = time_render(args.routes)
+    print(f"scrape   {args.routes * 3} request series render in {seconds * 1000:.2f}ms ({size / 1024:.0f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Measure what tracing costs per request.
+
+The same small FastAPI app, driven in-process (no network), with:
+
+- plain: no tracing middleware
+- unsampled: ids are generated and propagated, nothing is recorded
+  (``TRACE_EXPORTER=none``, or a trace the sampler skipped)
+- sampled: every request recorded with a server span and one DB span and
+  exported to a temporary JSON-lines file
+
+    PYTHONPATH=. python scripts/bench_tracing_overhead.py --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, text
+
+from common.tracing import TRACER, BatchProcessor, FileExporter, TracingMiddleware, trace_engine
+
+
+def make_app(traced: bool, engine) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        # Blocking on purpose: keeps threadpool scheduling noise out of the comparison.
+        with engine.connect() as conn:
+            return {"id": item_id, "name": conn.execute(text("SELECT 'item'")).scalar()}
+
+    if traced:
+        app.add_middleware(TracingMiddleware, tracer=TRACER)
+    return app
+
+
+async def time_requests(app, n: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(200):
+            await client.get(f"/items/{i}")
+        start = time.perf_counter()
+        for i in range(n):
+            await client.get(f"/items/{i}")
+        return (time.perf_counter() - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    trace_engine(engine, TRACER)
+    with tempfile.TemporaryDirectory() as tmp:
+        processor = BatchProcessor(FileExporter(os.path.join(tmp, "traces.jsonl")), queue_size=100000)
+        variants = {
+            "plain": (False, None, 0.0),
+            "unsampled": (True, None, 0.0),
+            "sampled": (True, processor, 1.0),
+        }
+        best = {}
+        # Alternate the variants and keep each one's best round, to damp noise.
+        for _ in range(args.rounds):
+            for name, (traced, exporter, ratio) in variants.items():
+                TRACER.configure("bench", exporter, sample_ratio=ratio, max_per_second=1e9, max_spans=256)
+                seconds = asyncio.run(time_requests(make_app(traced, engine), args.requests))
+                best[name] = min(best.get(name, seconds), seconds)
+        processor.flush()
+
+    plain = best["plain"]
+    for name, seconds in best.items():
+        print(f"{name:<10} {seconds * 1e6:7.1f}us  overhead={(seconds - plain) * 1e6:+6.1f}us "
+              f"({(seconds / plain - 1) * 100:+.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
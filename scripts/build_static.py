@@ -0,0 +1,97 @@
+"""Build each service's frontend into frontend/build/ for production serving.
+
+- JS and CSS are copied under content-hashed names (style.<hash>.css) and
+  every HTML page is rewritten to reference them, so they can be cached
+  forever (see common/static.py).
+- Every text file gets a gzip (.gz) sibling, and a brotli (.br) one when the
+  optional ``brotli`` package is installed.
+- manifest.json maps source names to hashed names.
+
+Run from the repository root before building images:
+
+    python scripts/build_static.py            # all services
+    python scripts/build_static.py auth-service
+"""
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+HASHED_EXTENSIONS = (".js", ".css")
+COMPRESSIBLE_EXTENSIONS = (".html", ".js", ".css", ".json", ".svg", ".txt")
+MIN_COMPRESS_SIZE = 256
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def compress(path: str):
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return
+    with open(path + ".gz", "wb") as f:
+        # mtime=0 keeps the output byte-identical across builds.
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + ".br", "wb") as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def build(frontend_dir: str):
+    out = os.path.join(frontend_dir, "build")
+    shutil.rmtree(out, ignore_errors=True)
+    os.makedirs(out)
+
+    manifest = {}
+    sources = sorted(p for p in os.listdir(frontend_dir) if os.path.isfile(os.path.join(frontend_dir, p)))
+    for name in sources:
+        with open(os.path.join(frontend_dir, name), "rb") as f:
+            data = f.read()
+        stem, ext = os.path.splitext(name)
+        if ext in HASHED_EXTENSIONS:
+            manifest[name] = f"{stem}.{content_hash(data)}{ext}"
+            with open(os.path.join(out, manifest[name]), "wb") as f:
+                f.write(data)
+
+    for name in sources:
+        if name.endswith(HASHED_EXTENSIONS):
+            continue
+        with open(os.path.join(frontend_dir, name), "rb") as f:
+            data = f.read()
+        if name.endswith(".html"):
+            html = data.decode()
+            for source, hashed in manifest.items():
+                html = html.replace(f"/static/{source}", f"/static/{hashed}")
+            data = html.encode()
+        with open(os.path.join(out, name), "wb") as f:
+            f.write(data)
+
+    with open(os.path.join(out, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    for name in os.listdir(out):
+        if name.endswith(COMPRESSIBLE_EXTENSIONS):
+            compress(os.path.join(out, name))
+    print(f"{out}: {len(manifest)} hashed assets{'' if brotli else ' (brotli not installed: gzip only)'}")
+
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    services = sys.argv[1:] or sorted(os.path.basename(os.path.dirname(p))
+                                      for p in glob.glob(os.path.join(root, "*-service", "frontend")))
+    for service in services:
+        build(os.path.join(root, service, "frontend"))
+
+
+if __name__ == "__main__":
+    main()
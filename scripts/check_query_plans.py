@@ -0,0 +1,109 @@
+"""Check that the hot-path queries are planned on their composite indexes.
+
+Runs EXPLAIN for each query against the database configured by the usual
+DB_USER/DB_PASSWORD/DB_HOST/DB_PORT/DB_NAME variables and fails if the plan
+doesn't use the expected index. Sequential scans are disabled for the check
+so the result doesn't depend on how much data the database holds; a missing
+or unusable index still shows up as a Seq Scan.
+
+List endpoints are checked with the statements ``paginate_rows`` sends (first
+page and a cursor page: keyset predicate, ORDER BY ending in id, LIMIT), and
+must also need no Sort step.
+
+    PYTHONPATH=. python scripts/check_query_plans.py
+"""
+import json
+import os
+from datetime import date, time
+
+from sqlalchemy import MetaData, Table, create_engine, select, text
+
+from common.pagination import DEFAULT_PAGE_SIZE, PageParams, _page_query, encode_cursor
+
+# (label, index or indexes that must all be used, SQL)
+CHECKS = [
+    ("login by username or email", ("users_username_key", "users_email_key"),
+     "SELECT * FROM users WHERE username = 'alice' OR email = 'alice'"),
+    ("user change feed", "ix_users_change_seq",
+     "SELECT * FROM users WHERE change_seq > 100 ORDER BY change_seq LIMIT 1001"),
+    ("booked slots", "uq_appointments_doctor_slot",
+     "SELECT appointment_time FROM appointments WHERE doctor_id = 1 "
+     "AND appointment_date = DATE '2030-01-07' AND status != 'cancelled'"),
+    ("doctor search", "ix_doctors_search_trgm",
+     "SELECT * FROM doctors WHERE 'cardio' <% "
+     "lower(first_name || ' ' || last_name || ' ' || specialization || ' ' || license_number)"),
+    ("doctors by specialization", "ix_doctors_specialization_trgm",
+     "SELECT * FROM doctors WHERE lower(specialization) LIKE '%cardio%'"),
+]
+
+# (label, index, table, filters, sort keys as the service passes them to paginate_rows; all descending)
+LIST_CHECKS = [
+    ("doctor appointments", "ix_appointments_doctor_date", "appointments", {"doctor_id": 1},
+     ["appointment_date", "appointment_time", "id"]),
+    ("patient appointments", "ix_appointments_patient_date", "appointments", {"patient_id": 1},
+     ["appointment_date", "appointment_time", "id"]),
+    ("patient records", "ix_medical_records_patient_date", "medical_records", {"patient_id": 1},
+     ["record_date", "id"]),
+    ("doctor records", "ix_medical_records_doctor_date", "medical_records", {"doctor_id": 1},
+     ["record_date", "id"]),
+    ("patient invoices", "ix_invoices_patient_date", "invoices", {"patient_id": 1},
+     ["invoice_date", "id"]),
+    ("patient invoices by status", "ix_invoices_patient_status_date", "invoices",
+     {"patient_id": 1, "status": "pending"}, ["invoice_date", "id"]),
+]
+
+SAMPLE_VALUES = {date: date(2030, 1, 7), time: time(9, 0), int: 1000}
+
+
+def list_statements(conn, label, index, table_name, filters, key_names):
+    """The first-page and cursor-page statements for one list, as literal SQL."""
+    table = Table(table_name, MetaData(), autoload_with=conn)
+    keys = [table.c[name] for name in key_names]
+    query = select(table).where(*(table.c[column] == value for column, value in filters.items()))
+    cursor = encode_cursor([SAMPLE_VALUES[key.type.python_type] for key in keys])
+    for suffix, page in (("first page", PageParams(DEFAULT_PAGE_SIZE, None, False)),
+                         ("next page", PageParams(DEFAULT_PAGE_SIZE, cursor, False))):
+        statement = _page_query(query, keys, page, descending=True)
+        sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+        yield f"{label}, {suffix}", index, sql
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def main():
+    url = (
+        f"postgresql+psycopg2://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
+        f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME')}"
+    )
+    engine = create_engine(url)
+    failures = 0
+    with engine.connect() as conn:
+        checks = [(label, index, query, False) for label, index, query in CHECKS]
+        for check in LIST_CHECKS:
+            checks += [(label, index, sql, True) for label, index, sql in list_statements(conn, *check)]
+        for label, index, query, presorted in checks:
+            with conn.begin() as trans:
+                conn.execute(text("SET LOCAL enable_seqscan = off"))
+                plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}")).scalar()
+                trans.rollback()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            nodes = list(plan_nodes(plan[0]["Plan"]))
+            used = {node.get("Index Name") for node in nodes} - {None}
+            expected = {index} if isinstance(index, str) else set(index)
+            sorts = [node["Node Type"] for node in nodes if "Sort" in node["Node Type"]]
+            ok = expected <= used and not (presorted and sorts)
+            failures += not ok
+            print(f"{'ok  ' if ok else 'FAIL'} {label}: expected {', '.join(sorted(expected))}, "
+                  f"plan uses {sorted(used) or 'no index'}" + (f", then {', '.join(sorts)}" if sorts else ""))
+    engine.dispose()
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Stand-in trace collector and waterfall viewer.
+
+``serve`` accepts OTLP/JSON on ``POST /v1/traces`` (what services send with
+``TRACE_EXPORTER=otlp``) and appends the spans to a JSON-lines file, the same
+format ``TRACE_EXPORTER=file`` writes. ``show`` prints the slowest traces in
+such files as waterfalls, with every service's spans merged:
+
+    PYTHONPATH=. python scripts/trace_collector.py serve --port 4318 --out traces.jsonl
+    PYTHONPATH=. python scripts/trace_collector.py show traces.jsonl --slowest 3
+    PYTHONPATH=. python scripts/trace_collector.py show traces.jsonl --trace <X-Trace-Id>
+"""
+import argparse
+import json
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common.tracing import records_from_otlp
+
+
+def serve(port: int, out: str):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/v1/traces":
+                self.send_error(404)
+                return
+            if not self.headers.get("Content-Type", "").startswith("application/json"):
+                self.send_error(415, "Only OTLP/JSON is accepted")
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                records = records_from_otlp(json.loads(body))
+            except (ValueError, KeyError, TypeError):
+                self.send_error(400, "Malformed OTLP/JSON")
+                return
+            with lock, open(out, "a") as f:
+                f.writelines(json.dumps(r, separators=(",", ":")) + "\n" for r in records)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"Collecting spans on :{port}/v1/traces into {out}")
+    ThreadingHTTPServer(("0.0.0.0", port), Handler).serve_forever()
+
+
+def load_traces(paths) -> dict:
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    traces[record["traceId"]].append(record)
+    return traces
+
+
+def waterfall(spans: list) -> list:
+    """Lines for one trace: spans in start order under their parents, with offsets from the trace start."""
+    ids = {s["spanId"] for s in spans}
+    children = defaultdict(list)
+    for s in spans:
+        # Parents outside the file (the browser, unsampled hops) make their children roots.
+        children[s["parentSpanId"] if s["parentSpanId"] in ids else None].append(s)
+    start = min(s["startTimeUnixNano"] for s in spans)
+    lines = []
+
+    def walk(parent, depth):
+        for s in sorted(children[parent], key=lambda s: s["startTimeUnixNano"]):
+            offset = (s["startTimeUnixNano"] - start) / 1e6
+            duration = (s["endTimeUnixNano"] - s["startTimeUnixNano"]) / 1e6
+            flag = " ERROR" if s["status"] == "error" else ""
+            detail = s["attributes"].get("db.statement", "")[:80]
+            lines.append(f"{offset:9.1f}ms {duration:9.1f}ms  {s['service']:<24} {'  ' * depth}{s['name']}{flag}"
+                         + (f"  {detail}" if detail else ""))
+            walk(s["spanId"], depth + 1)
+
+    walk(None, 0)
+    return lines
+
+
+def duration_ms(spans: list) -> float:
+    return (max(s["endTimeUnixNano"] for s in spans) - min(s["startTimeUnixNano"] for s in spans)) / 1e6
+
+
+def show(paths, trace_id: str = None, slowest: int = 5):
+    traces = load_traces(paths)
+    if trace_id:
+        selected = [trace_id] if trace_id in traces else []
+    else:
+        selected = sorted(traces, key=lambda t: duration_ms(traces[t]), reverse=True)[:slowest]
+    if not selected:
+        print("No matching traces")
+    for t in selected:
+        print(f"trace {t}  {duration_ms(traces[t]):.1f}ms  {len(traces[t])} spans")
+        print("\n".join(waterfall(traces[t])))
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="accept OTLP/JSON spans")
+    serve_parser.add_argument("--port", type=int, default=4318)
+    serve_parser.add_argument("--out", default="traces.jsonl")
+    show_parser = commands.add_parser("show", help="print traces as waterfalls")
+    show_parser.add_argument("files", nargs="+")
+    show_parser.add_argument("--trace", help="trace id, e.g. from a response's X-Trace-Id")
+    show_parser.add_argument("--slowest", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.port, args.out)
+    else:
+        show(args.files, args.trace, args.slowest)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The services import shared code as ``common.*``; in the images the repo root is on PYTHONPATH.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
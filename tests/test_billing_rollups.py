@@ -0,0 +1,101 @@
+import importlib.util
+import os
+import time
+from datetime import date
+from types import SimpleNamespace
+
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+from common import db as common_db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET = "test-secret"
+
+
+@pytest.fixture(scope="module")
+def billing(tmp_path_factory):
+    """billing-service/app.py on a fresh SQLite database (sync driver), migrated on startup."""
+    path = tmp_path_factory.mktemp("billing") / "billing.db"
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("SECRET_KEY", SECRET)
+        patch.setattr(common_db.Database, "from_env",
+                      classmethod(lambda cls, **kw: cls(f"sqlite:///{path}", use_async=False)))
+        spec = importlib.util.spec_from_file_location(
+            "billing_app", os.path.join(ROOT, "billing-service", "app.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    with TestClient(module.app) as client:
+        module.client = client
+        yield module
+
+
+def auth(user_id=1, role="admin"):
+    token = jwt.encode({"user_id": user_id, "role": role, "exp": int(time.time()) + 600}, SECRET)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def invoice(patient_id, amount, invoice_date="2026-03-10", appointment_id=None):
+    return {"patient_id": patient_id, "appointment_id": appointment_id, "amount": amount,
+            "invoice_date": invoice_date, "due_date": "2026-12-31"}
+
+
+def test_delta_touches_every_grain(billing):
+    deltas = {}
+    billing.add_rollup_delta(deltas, SimpleNamespace(invoice_date=date(2026, 3, 10), patient_id=7, amount=40.0),
+                             "pending", 1)
+    assert deltas == {
+        ("2026-03", 7, "pending"): [1, 40.0], ("2026-03", 0, "pending"): [1, 40.0],
+        ("all", 7, "pending"): [1, 40.0], ("all", 0, "pending"): [1, 40.0],
+    }
+
+
+def test_payment_delta_nets_out(billing):
+    deltas = {}
+    paid = SimpleNamespace(invoice_date=date(2026, 3, 10), patient_id=7, amount=40.0)
+    billing.add_rollup_delta(deltas, paid, "pending", 1)
+    billing.add_rollup_delta(deltas, paid, "pending", -1)
+    billing.add_rollup_delta(deltas, paid, "paid", 1)
+    assert deltas[("all", 0, "pending")] == [0, 0.0]
+    assert deltas[("all", 0, "paid")] == [1, 40.0]
+
+
+def test_rollups_track_every_write_path(billing):
+    client = billing.client
+    first = client.post("/invoices", json=invoice(11, 100.0, appointment_id=501), headers=auth()).json()
+    assert client.post("/invoices", json=invoice(11, 100.0, appointment_id=501), headers=auth()).status_code == 409
+    batch = client.post("/invoices/batch", headers=auth(), json={"items": [
+        invoice(11, 50.0, "2026-04-02"),
+        invoice(12, 25.0, appointment_id=502),
+        invoice(12, 25.0, appointment_id=502),  # twice in one batch
+        invoice(12, 30.0, appointment_id=501),  # already invoiced
+        {"patient_id": 12},  # invalid
+    ]}).json()
+    assert batch["created"] == 2
+    assert [r["status"] for r in batch["results"]] == [201, 201, 409, 409, 422]
+    for _ in range(2):  # paying twice must not move it twice
+        assert client.put(f"/invoices/{first['id']}/pay", params={"paid_date": "2026-03-20"},
+                          headers=auth()).status_code == 200
+
+    summary = client.get("/invoices/stats/summary", headers=auth()).json()
+    periods = client.get("/invoices/stats/periods", params={"start": "2026-03", "end": "2026-04",
+                                                            "patient_id": 11}, headers=auth()).json()
+    rebuilt = client.post("/invoices/stats/rebuild", headers=auth()).json()
+    assert rebuilt["drifted"] == 0, rebuilt["examples"]
+    assert client.get("/invoices/stats/summary", headers=auth()).json() == summary
+    assert [p["period"] for p in periods["periods"]] == ["2026-03", "2026-04"]
+
+
+def test_rebuild_reports_and_repairs_drift(billing):
+    client = billing.client
+    client.post("/invoices", json=invoice(13, 10.0), headers=auth())
+    with billing.database.sync_engine.begin() as conn:
+        conn.execute(billing.InvoiceRollupDB.__table__.update()
+                     .where(billing.InvoiceRollupDB.patient_id == 13).values(invoice_count=99))
+    assert client.post("/invoices/stats/rebuild", headers=auth()).json()["drifted"] > 0
+    assert client.post("/invoices/stats/rebuild", headers=auth()).json()["drifted"] == 0
+
+
+def test_stats_are_admin_only(billing):
+    assert billing.client.get("/invoices/stats/summary", headers=auth(3, "patient")).status_code == 403
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from common.expand import BatchLookup, expander
+
+
+class Response:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class PatientService:
+    """Stands in for patient-service /patients?user_ids=: staff see everyone, patients only themselves."""
+
+    name = "Patient service"
+
+    def __init__(self, profiles):
+        self.profiles = profiles
+        self.calls = 0
+        self.down = False
+
+    async def aget(self, path, params=None, headers=None):
+        self.calls += 1
+        if self.down:
+            raise HTTPException(status_code=503, detail="Patient service unavailable")
+        if not headers:
+            return Response(401)
+        role, _, user_id = headers["Authorization"].partition(":")
+        ids = [int(i) for i in params["user_ids"].split(",")]
+        if role not in ("admin", "doctor"):
+            ids = [i for i in ids if i == int(user_id)]
+        return Response(200, [self.profiles[i] for i in ids if i in self.profiles])
+
+
+def caller(role, user_id):
+    return {"Authorization": f"{role}:{user_id}"}, (role, user_id)
+
+
+def get_many(lookup, ids, who=None):
+    headers, key = who or (None, None)
+    return asyncio.run(lookup.get_many(ids, headers=headers, caller=key))
+
+
+@pytest.fixture
+def service():
+    return PatientService({1: {"user_id": 1, "name": "Ann"}, 2: {"user_id": 2, "name": "Bob"}})
+
+
+def test_shared_lookup_serves_the_cache_to_everyone(service):
+    lookup = BatchLookup(service, "/patients", param="user_ids", key="user_id")
+    get_many(lookup, [1, 2], caller("admin", 9))
+    assert get_many(lookup, [1, 2], caller("doctor", 5))[2]["name"] == "Bob"
+    assert service.calls == 1
+
+
+def test_per_caller_entries_are_not_served_to_other_callers(service):
+    lookup = BatchLookup(service, "/patients", param="user_ids", key="user_id", per_caller=True)
+    assert set(get_many(lookup, [1, 2], caller("admin", 9))) == {1, 2}
+    with pytest.raises(HTTPException) as raised:
+        get_many(lookup, [1, 2])
+    assert raised.value.status_code == 401
+    assert get_many(lookup, [1, 2], caller("patient", 1)) == {1: service.profiles[1]}
+
+
+def test_narrowed_response_does_not_hide_objects_from_others(service):
+    lookup = BatchLookup(service, "/patients", param="user_ids", key="user_id", per_caller=True)
+    get_many(lookup, [1, 2], caller("patient", 1))
+    assert set(get_many(lookup, [1, 2], caller("doctor", 5))) == {1, 2}
+
+
+def test_per_caller_misses_are_not_cached(service):
+    lookup = BatchLookup(service, "/patients", param="user_ids", key="user_id", per_caller=True)
+    get_many(lookup, [3], caller("admin", 9))
+    service.profiles[3] = {"user_id": 3, "name": "Cy"}
+    assert get_many(lookup, [3], caller("admin", 9))[3]["name"] == "Cy"
+
+
+def test_shared_misses_are_cached(service):
+    lookup = BatchLookup(service, "/patients", param="user_ids", key="user_id")
+    get_many(lookup, [3], caller("admin", 9))
+    get_many(lookup, [3], caller("admin", 9))
+    assert service.calls == 1
+
+
+def test_stale_entries_are_served_while_the_service_is_down(service):
+    lookup = BatchLookup(service, "/patients", param="user_ids", key="user_id", ttl=0, per_caller=True)
+    get_many(lookup, [1], caller("admin", 9))
+    service.down = True
+    assert get_many(lookup, [1], caller("admin", 9))[1]["name"] == "Ann"
+    with pytest.raises(HTTPException):
+        get_many(lookup, [1], caller("doctor", 5))
+
+
+def test_expander_keys_the_cache_by_the_verified_user(service):
+    lookups = {"patient": BatchLookup(service, "/patients", param="user_ids", key="user_id", per_caller=True)}
+    items = [{"patient_id": 1}, {"patient_id": 2}]
+    hook = expander("patient", lookups, "patient:1", {"role": "patient", "user_id": 1})
+    asyncio.run(hook(items))
+    assert items[0]["patient"]["name"] == "Ann" and items[1]["patient"] is None
+    assert expander(None, lookups) is None
+
+
+def test_unknown_expand_field_is_400(service):
+    with pytest.raises(HTTPException) as raised:
+        expander("billing", {"patient": BatchLookup(service, "/patients")})
+    assert raised.value.status_code == 400
@@ -0,0 +1,171 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from common.http import CircuitBreaker, CircuitOpenError, ServiceClient
+
+
+def make_client(handler, **kwargs) -> ServiceClient:
+    """A client whose requests go to ``handler`` (sync or async) instead of the network."""
+    kwargs.setdefault("backoff", 0.0)
+    client = ServiceClient("http://svc", name="Test service", **kwargs)
+    transport = httpx.MockTransport(handler)
+    client._client = httpx.Client(base_url=client.base_url, transport=transport)
+    client._async_client = httpx.AsyncClient(base_url=client.base_url, transport=transport)
+    client._async_slots = asyncio.Semaphore(client.max_concurrency)
+    return client
+
+
+def expire(breaker: CircuitBreaker):
+    breaker.opened_at -= breaker.reset_timeout
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_breaker_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    expire(breaker)
+    assert breaker.before_call() is True
+    assert breaker.state == "half-open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.before_call() is False
+
+
+def test_failed_trial_reopens():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    expire(breaker)
+    assert breaker.before_call() is True
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_abandoned_trial_frees_the_next_call():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    expire(breaker)
+    assert breaker.before_call() is True
+    breaker.abandon_trial()
+    assert breaker.before_call() is True
+
+
+def test_get_is_retried_on_503():
+    statuses = iter([503, 503, 200])
+    client = make_client(lambda request: httpx.Response(next(statuses)), retries=2)
+    assert client.get("/x").status_code == 200
+    assert client.breaker.failures == 0
+
+
+def test_post_is_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    client = make_client(handler, retries=2)
+    assert client.post("/x").status_code == 503
+    assert len(calls) == 1
+    assert client.breaker.failures == 1
+
+
+def test_transport_error_after_retries_is_503():
+    def handler(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    client = make_client(handler, retries=1)
+    with pytest.raises(HTTPException) as raised:
+        client.get("/x")
+    assert raised.value.status_code == 503
+
+
+def test_open_breaker_fails_fast_without_calling():
+    calls = []
+    client = make_client(lambda request: calls.append(request) or httpx.Response(200))
+    client.breaker.state = "open"
+    client.breaker.opened_at = float("inf")
+    with pytest.raises(HTTPException):
+        client.get("/x")
+    assert calls == []
+
+
+def test_deadline_skips_a_retry_that_cannot_finish():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return httpx.Response(503)
+
+    client = make_client(handler, retries=3, backoff=10.0)
+    client._delay = lambda attempt: 1.0
+    response = asyncio.run(client.aget("/x", deadline=0.5))
+    assert response.status_code == 503
+    assert len(calls) == 1
+
+
+def test_deadline_caps_each_attempt_timeout():
+    timeouts = []
+
+    async def handler(request):
+        timeouts.append(request.extensions["timeout"]["read"])
+        return httpx.Response(200)
+
+    client = make_client(handler, timeout=3.0)
+    asyncio.run(client.aget("/x", deadline=0.5))
+    assert 0 < timeouts[0] <= 0.5
+
+
+def test_cancelled_trial_is_released():
+    started = asyncio.Event()
+
+    async def handler(request):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def scenario(client):
+        call = asyncio.ensure_future(client.aget("/x"))
+        await started.wait()
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+    client = make_client(handler, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=30))
+    client.breaker.record_failure()
+    expire(client.breaker)
+    asyncio.run(scenario(client))
+    assert client.breaker.before_call() is True
+
+
+def test_close_releases_both_pools_and_reopens_on_use():
+    client = make_client(lambda request: httpx.Response(200))
+    sync_client, async_client = client._client, client._async_client
+    asyncio.run(client.close())
+    assert sync_client.is_closed and async_client.is_closed
+    reopened = client._sync_client()
+    assert reopened is not sync_client and not reopened.is_closed